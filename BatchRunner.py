@@ -0,0 +1,220 @@
+"""
+Runs many routing problems in parallel, one process per problem.
+
+Every job is a dict with the data of one routing problem (see solve_routing_problem). The jobs are spread over at most
+max_workers processes:
+- a job that runs longer than time_budget seconds is terminated,
+- a job that crashes (exception or a dying process, e.g. in OR-Tools) only loses that job,
+- the metrics of every finished job are saved right away in results_directory, so a rerun skips the finished jobs,
+- at the end the metrics of all the jobs are merged in one DataFrame.
+
+Example (a week of TSP routes):
+    jobs = [{'name': route, 'coordinates': coordinates, 'original_solution': original} for ...]
+    metrics_df, statuses = BatchRunner(max_workers=8, time_budget=600).run(jobs)
+"""
+import os
+import time
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+import pandas as pd
+import Instrumentation
+from RoutingProblem import get_problem_name
+
+# Names of the original solution, the matrices (straight line, OSRM distance, OSRM time or None) and the solutions
+# (matrix they are solved on, solution name) per problem type, the same as in TSPTests.py and VRPTests.py so the
+# metrics of a batch line up with the metrics of those scripts
+PROBLEM_NAMING = {
+    'tsp': {
+        'original': 'ORIGINAL',
+        'matrices': ('straight_line', 'osrm_distance', None),
+        'solutions': [('straight_line', 'OPTIMAL (STRAIGHT-LINE)'), ('osrm_distance', 'OPTIMAL (REAL)')],
+    },
+    'cvrp': {
+        'original': 'original',
+        'matrices': ('straight-line', 'osrm-distance', 'osrm-time'),
+        'solutions': [('straight-line', 'straight_line_solution'), ('osrm-distance', 'osrm-distance'),
+                      ('osrm-time', 'osrm-time')],
+    },
+}
+
+
+def solve_routing_problem(job):
+    """
+    Builds (or loads), solves and scores one routing problem, returns the metrics DataFrame of its solutions.
+
+    job keys:
+        name: name of the routing problem
+        coordinates: list of (latitude, longitude), the depot first
+        original_solution: solution dict of the current routes
+        demands, nb_vehicles, capacities: only for a CVRP, without them the problem is solved as a TSP
+        scale: scale factor of the distance matrices in the solvers (default 1)
+        search_settings: Solvers.SearchSettings of the solves (default the solver defaults)
+        osrm_route_metric: add the OSRM route distance to the metrics (default False)
+    """
+    from RoutingProblem import RoutingProblem
+    from Distances import get_straight_line_distance_array
+    from Solvers import get_tsp_solution, get_cvrp_solution
+    from OSRM import osrm_get_matrix
+
+    routing_problem = RoutingProblem(get_problem_name(job['name']))
+    is_cvrp = job.get('nb_vehicles') is not None
+    naming = PROBLEM_NAMING['cvrp' if is_cvrp else 'tsp']
+    scale = job.get('scale', 1)
+    if routing_problem.is_saved():
+        routing_problem.load()
+    else:
+        routing_problem.add_coordinates(job['coordinates'])
+        routing_problem.add_solution(naming['original'], job['original_solution'])
+        straight_line_name, osrm_distance_name, osrm_time_name = naming['matrices']
+        routing_problem.add_distance_matrix(straight_line_name,
+                                            get_straight_line_distance_array(job['coordinates']),
+                                            kind='straight_line', condensed=True)
+        osrm_dist, osrm_time = osrm_get_matrix(job['coordinates'])
+        routing_problem.add_distance_matrix(osrm_distance_name, osrm_dist)
+        if osrm_time_name is not None:
+            routing_problem.add_distance_matrix(osrm_time_name, osrm_time)
+        if is_cvrp:
+            routing_problem.set_demands(job['demands'])
+            routing_problem.set_capacities(job['nb_vehicles'], job['capacities'])
+        for matrix_name, solution_name in naming['solutions']:
+            if is_cvrp:
+                solution = get_cvrp_solution(routing_problem.get_distance_matrix(matrix_name),
+                                             routing_problem.get_nb_vehicles(), routing_problem.get_capacities(),
+                                             routing_problem.get_demands(), scale=scale,
+                                             search_settings=job.get('search_settings'))
+            else:
+                solution = get_tsp_solution(routing_problem.get_distance_matrix(matrix_name), scale=scale,
+                                            search_settings=job.get('search_settings'))
+            routing_problem.add_solution(solution_name, solution)
+        routing_problem.save()
+    return routing_problem.get_metrics(original_solution_name=naming['original'],
+                                       add_osrm_route_metric=job.get('osrm_route_metric', False))
+
+
+def _run_job(worker, job, connection, report_path=None):
+    """
+    Runs in the child process, sends ('ok', result) or ('error', traceback) to the parent. With a report_path the job
+    runs instrumented and its report is saved as <report_path>.json and <report_path>.prom.
+    """
+    try:
+        if report_path is None:
+            result = worker(job)
+        else:
+            Instrumentation.enable()
+            with Instrumentation.problem_report(job['name']) as report:
+                try:
+                    result = worker(job)
+                finally:
+                    report.save_json(report_path + '.json')
+                    report.save_prometheus(report_path + '.prom')
+    except Exception:
+        connection.send(('error', traceback.format_exc()))
+    else:
+        connection.send(('ok', result))
+    finally:
+        connection.close()
+
+
+class BatchRunner:
+
+    def __init__(self, worker=solve_routing_problem, max_workers=None, time_budget=None,
+                 results_directory='./BatchResults/', start_method=None, instrumentation=False):
+        """
+        worker: function job -> metrics DataFrame, runs in a child process (it must be picklable, a module-level function)
+        max_workers: number of problems solved at the same time (default the number of cores)
+        time_budget: seconds a single problem may take before its process is terminated, None for no limit
+        results_directory: directory where the metrics of every finished problem are saved as <name>.csv
+        start_method: multiprocessing start method ('fork', 'spawn', ...), default the platform default
+        instrumentation: save the timing report of every problem (see Instrumentation.py) as <name>.report.json and
+            <name>.report.prom in results_directory
+        """
+        self.worker = worker
+        self.max_workers = max_workers or os.cpu_count()
+        self.time_budget = time_budget
+        self.results_directory = results_directory
+        self.context = multiprocessing.get_context(start_method)
+        self.instrumentation = instrumentation
+        self.statuses = {}
+
+    def _result_path(self, job_name):
+        return os.path.join(self.results_directory, get_problem_name(job_name) + '.csv')
+
+    def _report_path(self, job_name):
+        if not self.instrumentation:
+            return None
+        return os.path.join(self.results_directory, get_problem_name(job_name) + '.report')
+
+    def run(self, jobs):
+        """
+        Runs all the jobs and returns (metrics_df, statuses). statuses maps every job name to 'done', 'skipped' (already
+        done in an earlier run), 'error', 'timeout' or 'crashed'.
+        """
+        os.makedirs(self.results_directory, exist_ok=True)
+        pending_jobs = []
+        for job in jobs:
+            if os.path.isfile(self._result_path(job['name'])):
+                self.statuses[job['name']] = 'skipped'
+            else:
+                pending_jobs.append(job)
+        pending_jobs.reverse()
+
+        running = {}  # connection -> (job name, process, start time)
+        try:
+            while pending_jobs or running:
+                while pending_jobs and len(running) < self.max_workers:
+                    job = pending_jobs.pop()
+                    parent_connection, child_connection = self.context.Pipe(duplex=False)
+                    process = self.context.Process(
+                        target=_run_job, args=(self.worker, job, child_connection, self._report_path(job['name'])))
+                    process.start()
+                    child_connection.close()
+                    running[parent_connection] = (job['name'], process, time.time())
+
+                for connection in wait(list(running), timeout=1.0):
+                    job_name, process, start_time = running.pop(connection)
+                    try:
+                        status, result = connection.recv()
+                    except EOFError:
+                        # The process died without sending a result
+                        process.join()
+                        print(f"{job_name}: crashed (exit code {process.exitcode})")
+                        self.statuses[job_name] = 'crashed'
+                        continue
+                    finally:
+                        connection.close()
+                    process.join()
+                    if status == 'ok':
+                        result.to_csv(self._result_path(job_name), sep=';', index=False)
+                        self.statuses[job_name] = 'done'
+                        print(f"{job_name}: done in {time.time() - start_time:.1f}s")
+                    else:
+                        print(f"{job_name}: failed\n{result}")
+                        self.statuses[job_name] = 'error'
+
+                if self.time_budget is not None:
+                    for connection, (job_name, process, start_time) in list(running.items()):
+                        if time.time() - start_time > self.time_budget:
+                            process.terminate()
+                            process.join()
+                            connection.close()
+                            del running[connection]
+                            print(f"{job_name}: terminated after {self.time_budget}s")
+                            self.statuses[job_name] = 'timeout'
+        finally:
+            # Workers are not daemonic (a worker may start processes of its own), so the ones that still run after an
+            # interruption are stopped here
+            for connection, (job_name, process, start_time) in running.items():
+                process.terminate()
+                process.join()
+                connection.close()
+
+        return self.merge_results(jobs), self.statuses
+
+    def merge_results(self, jobs):
+        """Merges the saved metrics of the jobs (in the order of the jobs) into one DataFrame."""
+        metrics_dfs = [pd.read_csv(self._result_path(job['name']), sep=';') for job in jobs
+                       if os.path.isfile(self._result_path(job['name']))]
+        if not metrics_dfs:
+            return None
+        return pd.concat(metrics_dfs, ignore_index=True)
@@ -0,0 +1,212 @@
+"""
+Reproducible benchmarks of the routing pipeline on synthetic Ghent-like instances (see InstanceGenerator.py).
+
+Every scenario is timed on seeded instances of a few sizes, with all OSRM requests answered by a local stand-in server
+(see OSRMStandIn.py) and the OSRM cache disabled, so the numbers only depend on the code and the machine:
+- matrix_straight_line: straight-line distance matrix
+- matrix_osrm: OSRM distance and time matrices (tiled above MAX_TABLE_SIZE stops)
+- tsp_solve, cvrp_solve: solving the instance on the OSRM distance matrix (with the solution cost next to the time)
+- metrics: RoutingProblem.get_metrics with the OSRM route metric
+- map_export: RoutingProblem.plot_folium(compact=True), the map export of Plotting.export_folium_map
+
+The results are written as JSON (with the git commit), run with --compare to compare against an earlier result:
+    python Benchmarks.py --sizes 50 200 --repeats 3
+    python Benchmarks.py --compare BenchmarkResults/benchmark_<commit>_<time>.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from InstanceGenerator import generate_tsp_instance, generate_cvrp_instance
+from OSRMClient import OSRMClient, osrm_base_url, get_client, set_client
+from OSRMCache import get_default_cache, set_default_cache
+from OSRMStandIn import OSRMStandIn
+
+RESULTS_DIRECTORY = './BenchmarkResults/'
+SCENARIOS = ['matrix_straight_line', 'matrix_osrm', 'tsp_solve', 'cvrp_solve', 'metrics', 'map_export']
+
+
+@contextmanager
+def benchmark_environment(latency=0.0):
+    """
+    Runs the block in an empty working directory (RoutingProblems/ and maps/ are written there) with the local OSRM
+    server replaced by a stand-in and the OSRM cache disabled. Restores everything afterwards.
+    """
+    working_directory = os.getcwd()
+    local_client = get_client(local=True)
+    cache = get_default_cache()
+    with tempfile.TemporaryDirectory() as directory, OSRMStandIn(latency=latency) as stand_in:
+        client = OSRMClient(stand_in.url, use_cache=False)
+        set_client(client, osrm_base_url(local=True))
+        set_default_cache(None)
+        os.chdir(directory)
+        os.makedirs('maps', exist_ok=True)
+        try:
+            yield stand_in
+        finally:
+            os.chdir(working_directory)
+            set_client(local_client)
+            set_default_cache(cache)
+            client.close()
+
+
+def _time(function, repeats):
+    """Runs function repeats times, returns (list of seconds, result of the last run)."""
+    seconds = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return seconds, result
+
+
+def _get_routing_problem(instance, osrm_distance):
+    from RoutingProblem import RoutingProblem
+    routing_problem = RoutingProblem(instance['name'])
+    routing_problem.add_coordinates(instance['coordinates'])
+    routing_problem.add_solution('original' if 'demands' in instance else 'ORIGINAL', instance['original_solution'])
+    routing_problem.add_distance_matrix('osrm-distance', osrm_distance, kind='osrm_distance')
+    return routing_problem
+
+
+def run_scenarios(size, seed=0, repeats=3, scenarios=SCENARIOS, cvrp_time_limit=10):
+    """Runs the scenarios on the instances of one size, returns a list of result dicts."""
+    from Distances import get_straight_line_distance_array
+    from OSRM import osrm_get_matrix
+    from Solvers import SearchSettings, get_tsp_solution, get_cvrp_solution
+
+    tsp_instance = generate_tsp_instance(size, seed)
+    cvrp_instance = generate_cvrp_instance(size, seed)
+    coordinates = tsp_instance['coordinates']
+    results = []
+
+    def record(scenario, seconds, **extra):
+        results.append({'scenario': scenario, 'size': size, 'seed': seed, 'seconds': seconds,
+                        'min': min(seconds), 'median': statistics.median(seconds), **extra})
+        print(f"{scenario:<22} {size:>6} stops  median {statistics.median(seconds):8.3f}s")
+
+    if 'matrix_straight_line' in scenarios:
+        seconds, _ = _time(lambda: get_straight_line_distance_array(coordinates), repeats)
+        record('matrix_straight_line', seconds)
+    osrm_distance, _ = osrm_get_matrix(coordinates)
+    if 'matrix_osrm' in scenarios:
+        seconds, _ = _time(lambda: osrm_get_matrix(coordinates), repeats)
+        record('matrix_osrm', seconds)
+    tsp_solution = None
+    if 'tsp_solve' in scenarios:
+        seconds, (tsp_solution, info) = _time(lambda: get_tsp_solution(osrm_distance, return_info=True), repeats)
+        record('tsp_solve', seconds, objective=info['objective'] if info else None)
+    if 'cvrp_solve' in scenarios:
+        cvrp_distance, _ = osrm_get_matrix(cvrp_instance['coordinates'])
+        settings = SearchSettings(local_search_metaheuristic='GUIDED_LOCAL_SEARCH', time_limit=cvrp_time_limit)
+        seconds, (_, info) = _time(lambda: get_cvrp_solution(
+            cvrp_distance, cvrp_instance['nb_vehicles'], cvrp_instance['capacities'], cvrp_instance['demands'],
+            search_settings=settings, return_info=True), repeats)
+        record('cvrp_solve', seconds, objective=info['objective'] if info else None,
+               distance=info['distance'] if info else None)
+
+    routing_problem = _get_routing_problem(tsp_instance, osrm_distance)
+    if tsp_solution:
+        routing_problem.add_solution('OPTIMAL (REAL)', tsp_solution)
+    if 'metrics' in scenarios:
+        # Every run starts without fetched route geometries
+        def get_metrics():
+            routing_problem.route_geometries = {}
+            return routing_problem.get_metrics(original_solution_name='ORIGINAL', add_osrm_route_metric=True)
+        seconds, _ = _time(get_metrics, repeats)
+        record('metrics', seconds)
+    if 'map_export' in scenarios:
+        seconds, _ = _time(lambda: routing_problem.plot_folium(compact=True), repeats)
+        record('map_export', seconds)
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=(50, 200), seed=0, repeats=3, scenarios=SCENARIOS, cvrp_time_limit=10, latency=0.0,
+                   output=None):
+    """Runs the scenarios for every size and writes the results as JSON to output (default in RESULTS_DIRECTORY)."""
+    commit = get_commit()
+    report = {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'settings': {'sizes': list(sizes), 'seed': seed, 'repeats': repeats, 'scenarios': list(scenarios),
+                     'cvrp_time_limit': cvrp_time_limit, 'latency': latency},
+        'results': [],
+    }
+    if output is None:
+        file_name = f"benchmark_{commit or 'unknown'}_{time.strftime('%Y%m%d-%H%M%S')}.json"
+        output = os.path.join(RESULTS_DIRECTORY, file_name)
+    output = os.path.abspath(output)
+    with benchmark_environment(latency) as stand_in:
+        for size in sizes:
+            report['results'] += run_scenarios(size, seed, repeats, scenarios, cvrp_time_limit)
+        report['osrm_requests'] = stand_in.request_count
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+    return report
+
+
+def compare_results(baseline, current):
+    """
+    Prints the median time (and cost) of every scenario and size of current next to baseline (report dicts or JSON
+    paths). Returns a list of (scenario, size, time ratio current / baseline).
+    """
+    if isinstance(baseline, str):
+        with open(baseline) as f:
+            baseline = json.load(f)
+    if isinstance(current, str):
+        with open(current) as f:
+            current = json.load(f)
+    baseline_results = {(result['scenario'], result['size']): result for result in baseline['results']}
+    baseline_name = baseline.get('commit') or 'baseline'
+    current_name = current.get('commit') or 'current'
+    print(f"{'scenario':<22} {'size':>6} {baseline_name:>12} {current_name:>12} {'ratio':>7}")
+    ratios = []
+    for result in current['results']:
+        old = baseline_results.get((result['scenario'], result['size']))
+        if old is None:
+            continue
+        ratio = result['median'] / old['median'] if old['median'] > 0 else float('inf')
+        ratios.append((result['scenario'], result['size'], ratio))
+        line = (f"{result['scenario']:<22} {result['size']:>6} {old['median']:11.3f}s {result['median']:11.3f}s "
+                f"{ratio:7.2f}")
+        if result.get('objective') is not None and old.get('objective') is not None:
+            line += f"  cost {old['objective']:.0f} -> {result['objective']:.0f}"
+        print(line)
+    return ratios
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200], help='numbers of stops of the instances')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--cvrp-time-limit', type=float, default=10, help='seconds of the CVRP search')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the OSRM stand-in waits per request')
+    parser.add_argument('--output', help='JSON file of the results')
+    parser.add_argument('--compare', help='JSON file of earlier results to compare with')
+    arguments = parser.parse_args()
+    report = run_benchmarks(arguments.sizes, arguments.seed, arguments.repeats, arguments.scenarios,
+                            arguments.cvrp_time_limit, arguments.latency, arguments.output)
+    if arguments.compare:
+        compare_results(arguments.compare, report)
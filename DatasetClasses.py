@@ -0,0 +1,288 @@
+"""
+Reader of the service frequency dataset (one row per collection point of a route).
+
+The CSV is parsed once into columns (the route names categorical, the coordinates and containers NumPy arrays) and
+sorted by day, route and visiting order, so the stops of a route and the stops of a day are contiguous slices of the
+columns. The problems of a route or a day are then built from those slices without scanning the dataset again:
+
+    dataset = DatasetReader(file='DATASET_SERVICEFREQS_NODUP_20240405.csv')
+    for route in dataset.get_routes_of_day(1):
+        coordinates, original_solution = dataset.get_routing_problem_data_for_route(route)
+
+Consecutive rows of a route at the same location are one stop with the containers of all the rows, a route that comes
+back to a location later keeps the revisit as a stop of its own. The parsed columns are cached in a .npz file in
+cache_directory, which is used instead of the CSV as long as the CSV and the column names do not change.
+
+The columns are looked up by name (case-insensitive), see DEFAULT_COLUMNS. Only the route and the coordinates are
+required: without a day column the day is the day code in the route name (e.g. "BA DI RES1" is on Tuesday), without a
+sequence column the rows are in visiting order and without a containers column every row is one container.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from Depot import GHENT_DEPOT
+
+CACHE_DIRECTORY = './cache/'
+CACHE_VERSION = 2
+DEFAULT_COLUMNS = {
+    'route': 'ROUTE',
+    'day': 'DAY',
+    'sequence': 'SEQUENCE',
+    'latitude': 'LATITUDE',
+    'longitude': 'LONGITUDE',
+    'containers': 'CONTAINERS',
+}
+REQUIRED_COLUMNS = ('route', 'latitude', 'longitude')
+# Day codes (Dutch) in the route names and day columns, Monday is day 1
+DAY_CODES = {'MA': 1, 'DI': 2, 'WO': 3, 'DO': 4, 'VR': 5, 'ZA': 6, 'ZO': 7}
+# Rows of a route closer than this (degrees) are at the same location
+LOCATION_DECIMALS = 6
+
+
+def _detect_separator(path):
+    """The most frequent of ',', ';' and tab in the header line."""
+    with open(path, 'r', encoding='utf-8-sig') as inp:
+        header = inp.readline()
+    return max((',', ';', '\t'), key=header.count)
+
+
+def _get_day_from_name(name):
+    """Day of a route name or a day label ('DI', 'dinsdag', '2'), 0 when it has no day."""
+    for token in str(name).upper().split():
+        if token.isdigit() and 1 <= int(token) <= 7:
+            return int(token)
+        day = DAY_CODES.get(token[:2]) if len(token) == 2 or token.endswith('DAG') else None
+        if day is not None:
+            return day
+    return 0
+
+
+def _parse_days(values):
+    """Day numbers (1-7, 0 when unknown) of a day column, either numbers or day labels."""
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.notna().all():
+        return numbers.to_numpy(dtype=np.int8)
+    # Labels are categorical, so every distinct label is parsed once
+    labels = values.astype('category')
+    days = np.array([_get_day_from_name(label) for label in labels.cat.categories], dtype=np.int8)
+    codes = labels.cat.codes.to_numpy()
+    return np.where(codes < 0, 0, days[codes]).astype(np.int8)
+
+
+class DatasetReader:
+
+    def __init__(self, file, columns=None, depot=GHENT_DEPOT, separator=None, cache_directory=CACHE_DIRECTORY):
+        """
+        file: CSV of the dataset
+        columns: names of the columns in the CSV, overrides DEFAULT_COLUMNS, e.g. {'route': 'RONDE'}
+        depot: (latitude, longitude) of the depot, the first coordinate of every problem
+        separator: separator of the CSV, default detected from the header
+        cache_directory: directory of the parsed dataset (None to always parse the CSV)
+        """
+        self.file = file
+        self.columns = {**DEFAULT_COLUMNS, **(columns or {})}
+        self.depot = np.array(depot, dtype=np.float64)
+        self.separator = separator
+        self.cache_directory = cache_directory
+        arrays = self._load_cache()
+        if arrays is None:
+            arrays = self._parse()
+            self._save_cache(arrays)
+        self._set_arrays(arrays)
+
+    def _get_cache_key(self):
+        stat = os.stat(self.file)
+        key = {'file': os.path.abspath(self.file), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+               'columns': self.columns, 'separator': self.separator, 'version': CACHE_VERSION}
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _get_cache_path(self):
+        name = os.path.splitext(os.path.basename(self.file))[0]
+        return os.path.join(self.cache_directory, f"dataset_{name}.npz")
+
+    def _load_cache(self):
+        if self.cache_directory is None or not os.path.isfile(self._get_cache_path()):
+            return None
+        with np.load(self._get_cache_path(), allow_pickle=False) as cache:
+            if str(cache['key']) != self._get_cache_key():
+                return None
+            return {name: cache[name] for name in cache.files if name != 'key'}
+
+    def _save_cache(self, arrays):
+        if self.cache_directory is None:
+            return
+        os.makedirs(self.cache_directory, exist_ok=True)
+        # Written next to the cache and renamed, an interrupted save does not leave a broken cache
+        temporary_path = self._get_cache_path() + '.tmp.npz'
+        np.savez(temporary_path, key=np.array(self._get_cache_key()), **arrays)
+        os.replace(temporary_path, self._get_cache_path())
+
+    def _resolve_columns(self, header):
+        """Maps the column names of self.columns to the names in the header (case-insensitive), None when missing."""
+        names = {name.strip().upper(): name for name in header}
+        resolved = {field: names.get(str(name).strip().upper()) for field, name in self.columns.items()}
+        missing = [self.columns[field] for field in REQUIRED_COLUMNS if resolved[field] is None]
+        if missing:
+            raise ValueError(f"{self.file} has no column {', '.join(missing)} (columns: {', '.join(header)}), "
+                             f"give the column names with columns=")
+        return resolved
+
+    def _parse(self):
+        """Parses the CSV into the stop columns of the routes, sorted by day, route and visiting order."""
+        separator = self.separator or _detect_separator(self.file)
+        header = pd.read_csv(self.file, sep=separator, nrows=0, encoding='utf-8-sig').columns
+        resolved = self._resolve_columns(header)
+        dtypes = {resolved['route']: 'category', resolved['latitude']: np.float64, resolved['longitude']: np.float64}
+        frame = pd.read_csv(self.file, sep=separator, encoding='utf-8-sig', dtype=dtypes,
+                            usecols=[name for name in resolved.values() if name is not None])
+
+        routes = frame[resolved['route']]
+        latitudes = frame[resolved['latitude']].to_numpy()
+        longitudes = frame[resolved['longitude']].to_numpy()
+        valid = routes.notna().to_numpy() & np.isfinite(latitudes) & np.isfinite(longitudes)
+        if not valid.all():
+            print(f"{int((~valid).sum())} rows of {self.file} without route or coordinates are skipped")
+        route_names = np.array(routes.cat.categories.astype(str), dtype=str)
+        route_codes = routes.cat.codes.to_numpy()
+        if resolved['day'] is not None:
+            days = _parse_days(frame[resolved['day']])
+        else:
+            days = np.array([_get_day_from_name(name) for name in route_names], dtype=np.int8)[route_codes]
+        if resolved['sequence'] is not None:
+            sequence = pd.to_numeric(frame[resolved['sequence']], errors='coerce').to_numpy(dtype=np.float64)
+        else:
+            sequence = np.arange(len(frame), dtype=np.float64)
+        if resolved['containers'] is not None:
+            containers = pd.to_numeric(frame[resolved['containers']], errors='coerce').fillna(1).to_numpy()
+        else:
+            containers = np.ones(len(frame))
+
+        # Routes are sorted by day and name, the rows of a route by sequence (file order for equal sequences)
+        route_days = np.zeros(len(route_names), dtype=np.int8)
+        route_days[route_codes[valid]] = days[valid]
+        route_order = np.lexsort((route_names, route_days))
+        route_rank = np.empty(len(route_names), dtype=np.int64)
+        route_rank[route_order] = np.arange(len(route_names))
+        rows = np.flatnonzero(valid)
+        rows = rows[np.lexsort((rows, sequence[rows], route_rank[route_codes[rows]]))]
+
+        # Consecutive rows of a route at the same location are one stop (at the first of them) with all their
+        # containers, a later revisit of the location stays a stop so the original routes keep their length
+        row_routes = route_codes[rows]
+        row_latitudes = np.round(latitudes[rows], LOCATION_DECIMALS)
+        row_longitudes = np.round(longitudes[rows], LOCATION_DECIMALS)
+        new_stop = np.ones(len(rows), dtype=bool)
+        new_stop[1:] = ((row_routes[1:] != row_routes[:-1]) | (row_latitudes[1:] != row_latitudes[:-1])
+                        | (row_longitudes[1:] != row_longitudes[:-1]))
+        stop_of_row = np.cumsum(new_stop) - 1
+        stop_containers = np.bincount(stop_of_row, weights=containers[rows], minlength=int(new_stop.sum()))
+        stop_rows = rows[new_stop]
+        stop_routes = route_rank[route_codes[stop_rows]]
+
+        route_names = route_names[route_order]
+        route_days = route_days[route_order]
+        route_offsets = np.searchsorted(stop_routes, np.arange(len(route_names) + 1))
+        # Routes without any valid row are dropped
+        used = np.diff(route_offsets) > 0
+        return {
+            'latitudes': latitudes[stop_rows],
+            'longitudes': longitudes[stop_rows],
+            'containers': np.round(stop_containers).astype(np.int64),
+            'route_names': route_names[used],
+            'route_days': route_days[used],
+            'route_offsets': np.concatenate([route_offsets[:-1][used], route_offsets[-1:]]),
+        }
+
+    def _set_arrays(self, arrays):
+        self.latitudes = arrays['latitudes']
+        self.longitudes = arrays['longitudes']
+        self.containers = arrays['containers']
+        self.route_names = arrays['route_names']
+        self.route_days = arrays['route_days']
+        self.route_offsets = arrays['route_offsets']
+        self._route_index = {str(name): index for index, name in enumerate(self.route_names)}
+        # The routes of a day are contiguous (sorted by day): day_offsets[day] is the first route of the day
+        self._day_offsets = np.searchsorted(self.route_days, np.arange(9))
+
+    @property
+    def nb_stops(self):
+        return len(self.latitudes)
+
+    def get_days(self):
+        """The days with routes."""
+        return sorted(set(self.route_days.tolist()))
+
+    def get_all_routes(self):
+        return self.route_names.tolist()
+
+    def _get_route_range(self, day):
+        if not 1 <= day <= 7:
+            return 0, 0
+        return int(self._day_offsets[day]), int(self._day_offsets[day + 1])
+
+    def _get_stop_range(self, route):
+        """First and end index of the stops of a route in the stop columns."""
+        index = self._route_index.get(route)
+        if index is None:
+            raise KeyError(f"route {route} is not in {self.file}")
+        return int(self.route_offsets[index]), int(self.route_offsets[index + 1])
+
+    def _get_coordinates(self, start, end):
+        """(n + 1, 2) array with the depot and the stops start:end."""
+        coordinates = np.empty((end - start + 1, 2))
+        coordinates[0] = self.depot
+        coordinates[1:, 0] = self.latitudes[start:end]
+        coordinates[1:, 1] = self.longitudes[start:end]
+        return coordinates
+
+    def get_routes_of_day(self, day):
+        """Names of the routes of a day (1 is Monday), sorted by name."""
+        first, end = self._get_route_range(day)
+        return self.route_names[first:end].tolist()
+
+    def get_routing_problem_data_for_route(self, route):
+        """
+        Returns the coordinates of the route (an (n + 1, 2) array of (latitude, longitude), the depot first) and the
+        original solution {'TSP_1': [0, 1, ..., n, 0]}: the stops are in the visiting order of the dataset.
+        """
+        start, end = self._get_stop_range(route)
+        return self._get_coordinates(start, end), {'TSP_1': [0] + list(range(1, end - start + 1)) + [0]}
+
+    def get_route_containers(self, route):
+        """Number of containers of every stop of the route, in visiting order."""
+        start, end = self._get_stop_range(route)
+        return self.containers[start:end]
+
+    def get_cvrp_data(self, day):
+        """
+        Returns the problem of all the routes of a day: the coordinates (an (n + 1, 2) array, the depot first), the
+        original solution {'truck_<i>': [0, stops of the i-th route, 0]} and the demands as arrays, in stops (1 per
+        stop, 0 for the depot) and in containers.
+        """
+        first_route, end_route = self._get_route_range(day)
+        start = int(self.route_offsets[first_route])
+        end = int(self.route_offsets[end_route])
+        original_solution = {}
+        for truck, route_index in enumerate(range(first_route, end_route)):
+            route_start = int(self.route_offsets[route_index]) - start + 1
+            route_end = int(self.route_offsets[route_index + 1]) - start + 1
+            original_solution['truck_' + str(truck)] = [0] + list(range(route_start, route_end)) + [0]
+        demand_stops = np.ones(end - start + 1, dtype=np.int64)
+        demand_stops[0] = 0
+        demand_containers = np.concatenate([[0], self.containers[start:end]])
+        return self._get_coordinates(start, end), original_solution, demand_stops, demand_containers
+
+    def get_nb_trucks_of_day(self, day):
+        """Number of routes of the day, one truck per route."""
+        first, end = self._get_route_range(day)
+        return end - first
+
+    def get_nb_stops_of_day(self, day):
+        first, end = self._get_route_range(day)
+        return int(self.route_offsets[end] - self.route_offsets[first])
+
+    def get_nb_containers_of_day(self, day):
+        first, end = self._get_route_range(day)
+        return int(self.containers[self.route_offsets[first]:self.route_offsets[end]].sum())
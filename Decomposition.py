@@ -0,0 +1,270 @@
+"""
+Cluster-first, route-second solving of large CVRPs.
+
+One OR-Tools model with every truck and stop of a city-wide day does not scale past a few thousand stops. Instead:
+1. the stops are partitioned into clusters around the depot (sweep or capacitated k-means), every cluster gets a group
+   of vehicles with enough capacity for its stops,
+2. every cluster is solved on its own (a small CVRP, with one vehicle per cluster a TSP with a capacity), in parallel
+   processes,
+3. the cluster routes are stitched into one solution and the boundaries are polished: every pair of neighboring
+   clusters is solved again together, starting from the current routes, and the result is kept if it is shorter.
+
+The solution has the format of Solvers.get_cvrp_solution ({'truck_<i>': [indices in visiting order]}), so it can be
+added to a RoutingProblem and scored like any other solution; get_cvrp_solution(..., mode='decomposed') solves this way.
+The distance matrix is never expanded to N x N: the matrix of a cluster is looked up with take(), so a condensed
+DistanceMatrix or a SparseDistanceMatrix stays as it is.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from Solvers import SearchSettings, get_cvrp_solution
+from DistanceMatrix import DistanceMatrix, SparseDistanceMatrix
+from SpatialIndex import SpatialIndex
+
+DEFAULT_CLUSTER_SEARCH = SearchSettings(local_search_metaheuristic='GUIDED_LOCAL_SEARCH', time_limit=10)
+DEFAULT_POLISH_SEARCH = SearchSettings(local_search_metaheuristic='GUIDED_LOCAL_SEARCH', time_limit=5)
+
+
+def get_vehicle_groups(nb_vehicles, vehicles_per_cluster=1):
+    """Splits the vehicles 0..nb_vehicles-1 in consecutive groups, one group per cluster."""
+    return [list(range(start, min(start + vehicles_per_cluster, nb_vehicles)))
+            for start in range(0, nb_vehicles, vehicles_per_cluster)]
+
+
+def _get_stop_angles(points, depot):
+    """Polar angle of every point around the depot, starting at the largest empty angle so no cluster is split by it."""
+    angles = np.arctan2(points[:, 1] - points[depot, 1], points[:, 0] - points[depot, 0])
+    stops = np.array([node for node in range(len(points)) if node != depot], dtype=np.int64)
+    if len(stops) > 1:
+        sorted_angles = np.sort(angles[stops])
+        gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * np.pi))
+        start_angle = sorted_angles[(np.argmax(gaps) + 1) % len(sorted_angles)]
+        angles = (angles - start_angle) % (2 * np.pi)
+    return angles
+
+
+def _assign_leftovers(clusters, loads, group_capacities, leftovers, demands):
+    """Puts the stops that did not fit in their cluster in the first cluster with room, False if one fits nowhere."""
+    for node in leftovers:
+        for cluster in range(len(clusters)):
+            if loads[cluster] + demands[node] <= group_capacities[cluster]:
+                clusters[cluster].append(node)
+                loads[cluster] += demands[node]
+                break
+        else:
+            return False
+    return True
+
+
+def sweep_clusters(coordinate_list, demands, group_capacities, depot=0):
+    """
+    Sweeps a ray around the depot and cuts the stops into clusters in the order of their angle. Every cluster is filled
+    up to its share of the total demand (its capacity times the average utilization), never beyond its capacity.
+    Returns a list of stop lists (one per vehicle group) or None when the stops do not fit in the capacities.
+    """
+    points = SpatialIndex(coordinate_list).points
+    angles = _get_stop_angles(points, depot)
+    stops = [node for node in np.argsort(angles, kind='stable').tolist() if node != depot]
+    total_demand = sum(demands[node] for node in stops)
+    utilization = total_demand / max(sum(group_capacities), 1)
+
+    clusters = [[] for _ in group_capacities]
+    loads = [0] * len(group_capacities)
+    cluster = 0
+    leftovers = []
+    for node in stops:
+        while cluster < len(clusters) - 1 and (
+                loads[cluster] >= group_capacities[cluster] * utilization or
+                loads[cluster] + demands[node] > group_capacities[cluster]):
+            cluster += 1
+        if loads[cluster] + demands[node] <= group_capacities[cluster]:
+            clusters[cluster].append(node)
+            loads[cluster] += demands[node]
+        else:
+            leftovers.append(node)
+    if not _assign_leftovers(clusters, loads, group_capacities, leftovers, demands):
+        return None
+    return clusters
+
+
+def kmeans_clusters(coordinate_list, demands, group_capacities, depot=0, max_iterations=20):
+    """
+    Capacitated k-means: Lloyd iterations where every stop goes to the nearest cluster center that still has capacity
+    for it, the stops with the most to lose (largest gap between their nearest and second nearest center) first.
+    Starts from the centers of the sweep clusters. Returns a list of stop lists (one per vehicle group) or None when the
+    stops do not fit in the capacities.
+    """
+    clusters = sweep_clusters(coordinate_list, demands, group_capacities, depot)
+    if clusters is None:
+        return None
+    points = SpatialIndex(coordinate_list).points
+    stops = np.array([node for node in range(len(points)) if node != depot], dtype=np.int64)
+    used = [cluster for cluster in range(len(clusters)) if clusters[cluster]]
+    if len(stops) == 0 or len(used) < 2:
+        return clusters
+    # Only the clusters that got stops from the sweep get a center, the others stay empty
+    centers = np.array([points[clusters[cluster]].mean(axis=0) for cluster in used])
+    capacities = np.array([group_capacities[cluster] for cluster in used], dtype=np.float64)
+    stop_demands = np.array([demands[node] for node in stops], dtype=np.float64)
+
+    assignment = None
+    for _ in range(max_iterations):
+        distances = np.hypot(points[stops, 0:1] - centers[None, :, 0], points[stops, 1:2] - centers[None, :, 1])
+        preferences = np.argsort(distances, axis=1)
+        sorted_distances = np.take_along_axis(distances, preferences, axis=1)
+        regret = sorted_distances[:, 1] - sorted_distances[:, 0]
+        new_assignment = np.full(len(stops), -1, dtype=np.int64)
+        loads = np.zeros(len(used))
+        for stop in np.argsort(-regret, kind='stable'):
+            for cluster in preferences[stop]:
+                if loads[cluster] + stop_demands[stop] <= capacities[cluster]:
+                    new_assignment[stop] = cluster
+                    loads[cluster] += stop_demands[stop]
+                    break
+        if (new_assignment < 0).any():
+            # Greedy assignment failed where the sweep succeeded, keep the last feasible clusters
+            break
+        if assignment is not None and (new_assignment == assignment).all():
+            break
+        assignment = new_assignment
+        for cluster in range(len(used)):
+            if (assignment == cluster).any():
+                centers[cluster] = points[stops[assignment == cluster]].mean(axis=0)
+
+    if assignment is None:
+        return clusters
+    clusters = [[] for _ in group_capacities]
+    for cluster, group in enumerate(used):
+        clusters[group] = stops[assignment == cluster].tolist()
+    return clusters
+
+
+def _order_clusters(coordinate_list, clusters, depot=0):
+    """Indices of the non-empty clusters ordered by the angle of their center around the depot."""
+    points = SpatialIndex(coordinate_list).points
+    angles = _get_stop_angles(points, depot)
+    non_empty = [cluster for cluster in range(len(clusters)) if clusters[cluster]]
+    return sorted(non_empty, key=lambda cluster: np.mean(angles[clusters[cluster]]))
+
+
+def _get_polish_rounds(order):
+    """
+    Pairs of neighboring clusters (consecutive in order, which wraps around the depot), in rounds where no two pairs
+    share a cluster so a round can be solved in parallel.
+    """
+    if len(order) < 2:
+        return []
+    if len(order) == 2:
+        return [[(order[0], order[1])]]
+    pairs = [(order[i], order[(i + 1) % len(order)]) for i in range(len(order))]
+    if len(pairs) % 2 == 0:
+        return [pairs[0::2], pairs[1::2]]
+    # With an odd number of pairs the last pair shares a cluster with the first one
+    return [pairs[0:-1:2], pairs[1::2], [pairs[-1]]]
+
+
+def _solve_cluster(task):
+    """Runs in a worker process: solves the CVRP of one cluster (or pair of clusters) on its sub-matrix."""
+    matrix, capacities, demands, scale, native, search_settings, initial_routes = task
+    return get_cvrp_solution(matrix, len(capacities), capacities, demands, scale=scale, native=native,
+                             search_settings=search_settings, initial_solution=initial_routes)
+
+
+def _make_task(matrix, nodes, vehicles, capacities, demands, scale, native, search_settings, routes=None):
+    """Cuts the sub-problem of nodes (the depot first) with the given vehicles out of the full problem."""
+    node_array = np.asarray(nodes, dtype=np.int64)
+    local_index = {node: i for i, node in enumerate(nodes)}
+    initial_routes = None
+    if routes is not None:
+        initial_routes = [[local_index[node] for node in routes[vehicle] if node in local_index]
+                          for vehicle in vehicles]
+    return (matrix.take(node_array[:, None], node_array[None, :]), [capacities[vehicle] for vehicle in vehicles],
+            [int(demands[node]) for node in nodes], scale, native, search_settings, initial_routes)
+
+
+def _get_route_distance(matrix, route):
+    return float(matrix.take(route[:-1], route[1:]).sum()) if len(route) > 1 else 0.0
+
+
+def get_decomposed_cvrp_solution(distance_matrix, nb_vehicles, capacities, demands, coordinate_list, method='sweep',
+                                 vehicles_per_cluster=1, cluster_search_settings=None, polish_search_settings=None,
+                                 polish=True, max_workers=None, scale=1, native=True, return_info=False):
+    """
+    Solves the CVRP of get_cvrp_solution cluster-first, route-second.
+    Returns a solution dict {'truck_<i>': [indices in visiting order]} (unused trucks get [0, 0]), with return_info a
+    tuple (solution, info) where info has the objective (the distance) of the solution, the distance per route, the clusters (stop
+    lists per vehicle group) and the wall-clock time.
+    distance_matrix: nested lists, array, DistanceMatrix (also condensed) or SparseDistanceMatrix, only the pairs of the
+        clusters are looked up
+    coordinate_list: list of (latitude, longitude) of the nodes, the depot first, used to cluster the stops
+    method: 'sweep' or 'kmeans' (see sweep_clusters and kmeans_clusters)
+    vehicles_per_cluster: number of vehicles that share a cluster, 1 solves a TSP per truck
+    cluster_search_settings: SearchSettings of the cluster solves, default DEFAULT_CLUSTER_SEARCH
+    polish_search_settings: SearchSettings of the boundary solves, default DEFAULT_POLISH_SEARCH
+    polish: solve every pair of neighboring clusters again together
+    max_workers: number of processes that solve clusters at the same time (default the number of cores)
+    """
+    start_time = time.time()
+    if isinstance(distance_matrix, (DistanceMatrix, SparseDistanceMatrix)):
+        matrix = distance_matrix
+    else:
+        matrix = DistanceMatrix(distance_matrix)
+    demands = [int(demand) for demand in demands]
+    vehicle_groups = get_vehicle_groups(nb_vehicles, vehicles_per_cluster)
+    group_capacities = [sum(capacities[vehicle] for vehicle in group) for group in vehicle_groups]
+    if method == 'sweep':
+        clusters = sweep_clusters(coordinate_list, demands, group_capacities)
+    elif method == 'kmeans':
+        clusters = kmeans_clusters(coordinate_list, demands, group_capacities)
+    else:
+        raise ValueError(f"unknown clustering method {method}, use 'sweep' or 'kmeans'")
+    if clusters is None:
+        print("no solution: the demands do not fit in the capacities")
+        return ({}, None) if return_info else {}
+
+    routes = {vehicle: [0, 0] for vehicle in range(nb_vehicles)}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Route: solve every cluster with its vehicles
+        solved = [cluster for cluster in range(len(clusters)) if clusters[cluster]]
+        tasks = [_make_task(matrix, [0] + clusters[cluster], vehicle_groups[cluster], capacities, demands, scale,
+                            native, cluster_search_settings or DEFAULT_CLUSTER_SEARCH) for cluster in solved]
+        for cluster, cluster_solution in zip(solved, executor.map(_solve_cluster, tasks)):
+            if not cluster_solution:
+                print(f"no solution for cluster {cluster}")
+                return ({}, None) if return_info else {}
+            nodes = [0] + clusters[cluster]
+            for vehicle, route in zip(vehicle_groups[cluster], cluster_solution.values()):
+                routes[vehicle] = [nodes[node] for node in route]
+
+        # Polish: solve neighboring clusters together, in rounds of pairs that do not share a cluster
+        if polish:
+            for round_pairs in _get_polish_rounds(_order_clusters(coordinate_list, clusters)):
+                tasks = []
+                for first, second in round_pairs:
+                    vehicles = vehicle_groups[first] + vehicle_groups[second]
+                    nodes = [0] + [node for vehicle in vehicles for node in routes[vehicle][1:-1]]
+                    tasks.append((vehicles, nodes, _make_task(
+                        matrix, nodes, vehicles, capacities, demands, scale, native,
+                        polish_search_settings or DEFAULT_POLISH_SEARCH, routes)))
+                results = executor.map(_solve_cluster, [task for _, _, task in tasks])
+                for (vehicles, nodes, _), pair_solution in zip(tasks, results):
+                    if not pair_solution:
+                        continue
+                    new_routes = [[nodes[node] for node in route] for route in pair_solution.values()]
+                    old_distance = sum(_get_route_distance(matrix, routes[vehicle]) for vehicle in vehicles)
+                    new_distance = sum(_get_route_distance(matrix, route) for route in new_routes)
+                    if new_distance < old_distance:
+                        for vehicle, route in zip(vehicles, new_routes):
+                            routes[vehicle] = route
+
+    output = {"truck_" + str(vehicle): routes[vehicle] for vehicle in range(nb_vehicles)}
+    if return_info:
+        route_distances = {name: _get_route_distance(matrix, route) for name, route in output.items()}
+        return output, {
+            'objective': sum(route_distances.values()),
+            'distance': sum(route_distances.values()),
+            'route_distances': route_distances,
+            'clusters': clusters,
+            'wall_time': time.time() - start_time,
+        }
+    return output
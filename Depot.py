@@ -0,0 +1,6 @@
+"""
+Location of the depot, kept without imports so the modules that only need the depot do not load the distance code.
+"""
+
+# (latitude, longitude) of the depot of the Ghent waste collection, the first coordinate of the routing problems
+GHENT_DEPOT = (51.0206803530003, 3.7406690974811703)
@@ -0,0 +1,293 @@
+"""
+Array-backed distance (or travel time) matrix.
+
+A DistanceMatrix wraps one NumPy array with its units ('m' for distances, 's' for travel times), whether it is symmetric
+and how it is stored:
+- full: the n x n array, used as it is (a memory-mapped matrix of a binary save stays memory-mapped),
+- condensed: only the upper triangle of a symmetric matrix with a zero diagonal, n * (n - 1) / 2 values in row order
+  (the layout of scipy.spatial.distance.squareform), half the memory of the full matrix.
+
+Unreachable pairs (None, NaN or inf in the input, e.g. of an OSRM table) are stored as NaN, see unreachable_mask and
+filled. The matrix works wherever an array or nested lists were used before: np.asarray(matrix) gives the full array
+(without a copy for full storage), matrix[i][j] and matrix[i, j] look up values and take() looks up many pairs at once
+without expanding a condensed matrix:
+
+    matrix = DistanceMatrix(osrm_distances, units='m')
+    straight_line = DistanceMatrix(get_straight_line_distance_array(coordinates), symmetric=True, condensed=True)
+    totals = straight_line.take(from_indices, to_indices)
+
+A SparseDistanceMatrix keeps the values of only some pairs (e.g. the neighbor arcs of a large problem) and has the same
+take().
+"""
+import numpy as np
+
+
+def _get_condensed_size(nb_values):
+    """Number of points of a condensed matrix with nb_values values."""
+    size = int(round((1 + np.sqrt(1 + 8 * nb_values)) / 2))
+    if size * (size - 1) // 2 != nb_values:
+        raise ValueError(f"{nb_values} values are not the upper triangle of a square matrix")
+    return size
+
+
+def _to_float_array(values, dtype=None):
+    """Float array of the values, None entries become NaN. Float arrays of the right dtype are not copied."""
+    array = np.asarray(values)
+    if array.dtype.kind != 'f' or (dtype is not None and array.dtype != dtype):
+        array = np.asarray(values, dtype=dtype or np.float64)
+    return array
+
+
+class DistanceMatrix:
+
+    def __init__(self, values, units=None, symmetric=None, condensed=False, dtype=None):
+        """
+        values: n x n matrix (nested lists, array or DistanceMatrix) or the condensed upper triangle (1-D)
+        units: 'm' (default), 's' or any other label of the values
+        symmetric: whether matrix[i][j] == matrix[j][i], default checked on first use (up to floating point noise, the
+            ellipsoidal distance from a to b can differ from b to a in the last digits)
+        condensed: store only the upper triangle (the matrix must be symmetric with a zero diagonal)
+        dtype: float dtype of the stored values, default the dtype of values (float64 for lists)
+        """
+        if isinstance(values, DistanceMatrix):
+            units = units or values.units
+            symmetric = values._symmetric if symmetric is None else symmetric
+            values = values.storage
+        array = _to_float_array(values, dtype)
+        if np.isinf(array).any():
+            # Unreachable pairs are NaN, whatever the input used for them
+            array = np.where(np.isinf(array), np.nan, array)
+        self.units = units or 'm'
+        if array.ndim == 1:
+            self.size = _get_condensed_size(len(array))
+            self.storage = array
+            self._symmetric = True
+            return
+        if array.ndim != 2 or array.shape[0] != array.shape[1]:
+            raise ValueError(f"a distance matrix must be square, got shape {array.shape}")
+        self.size = len(array)
+        self.storage = array
+        self._symmetric = symmetric
+        if condensed:
+            self.storage = self._condense_array(array)
+            self._symmetric = True
+
+    def _condense_array(self, array):
+        if not self.symmetric:
+            raise ValueError("only a symmetric matrix can be stored condensed")
+        if np.any(np.diagonal(array)):
+            raise ValueError("only a matrix with a zero diagonal can be stored condensed")
+        if self.size < 2:
+            return np.zeros(0, dtype=array.dtype)
+        # Row by row, np.triu_indices would need two index arrays as large as the matrix itself
+        return np.concatenate([array[row, row + 1:] for row in range(self.size - 1)])
+
+    @classmethod
+    def from_storage(cls, storage, metadata):
+        """From the stored array and the metadata of a save (see get_metadata), without copying the array."""
+        return cls(storage, units=metadata.get('units'), symmetric=metadata.get('symmetric'))
+
+    def get_metadata(self):
+        """JSON-serializable description of the matrix, stored next to the array of a save."""
+        return {'units': self.units, 'symmetric': self._symmetric, 'condensed': self.is_condensed, 'size': self.size}
+
+    @property
+    def is_condensed(self):
+        return self.storage.ndim == 1
+
+    @property
+    def symmetric(self):
+        if self._symmetric is None:
+            self._symmetric = bool(np.allclose(self.storage, self.storage.T, rtol=1e-9, atol=1e-6, equal_nan=True))
+        return self._symmetric
+
+    @property
+    def dtype(self):
+        return self.storage.dtype
+
+    @property
+    def shape(self):
+        return self.size, self.size
+
+    @property
+    def nbytes(self):
+        return self.storage.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def _condensed_positions(self, rows, columns):
+        """Positions in the condensed storage of the pairs (rows, columns), -1 on the diagonal."""
+        low = np.minimum(rows, columns)
+        high = np.maximum(rows, columns)
+        positions = self.size * low - low * (low + 1) // 2 + high - low - 1
+        return np.where(low == high, -1, positions)
+
+    def take(self, rows, columns):
+        """Values of the pairs (rows[k], columns[k]) as an array, a condensed matrix is not expanded."""
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        if not self.is_condensed:
+            return self.storage[rows, columns]
+        positions = self._condensed_positions(rows, columns)
+        if len(self.storage) == 0:
+            return np.zeros(np.shape(positions), dtype=self.dtype)
+        return np.where(positions < 0, 0, self.storage[np.maximum(positions, 0)])
+
+    def row(self, index):
+        """The distances from index to every point."""
+        if not self.is_condensed:
+            return self.storage[index]
+        return self.take(np.full(self.size, index), np.arange(self.size))
+
+    def _get_indices(self, index):
+        """Point indices of an integer, slice or index array (negative indices count from the end)."""
+        if isinstance(index, slice):
+            return np.arange(self.size)[index]
+        indices = np.asarray(index)
+        if indices.dtype.kind not in 'iu':
+            raise IndexError("only integers, slices and integer arrays are valid indices of a distance matrix")
+        if np.any((indices < -self.size) | (indices >= self.size)):
+            raise IndexError(f"index out of range for a distance matrix of size {self.size}")
+        return np.where(indices < 0, indices + self.size, indices)
+
+    def __getitem__(self, index):
+        """
+        matrix[i] is a row and matrix[i, j] a value, like for the full array: slices and index arrays select rows and
+        columns in the same way (matrix[1:3] is a 2 x n block, matrix[1:3, [0, 2]] a 2 x 2 block) for both storages.
+        """
+        if not self.is_condensed:
+            return self.storage[index]
+        if not isinstance(index, tuple):
+            index = (index, slice(None))
+        if len(index) != 2:
+            raise IndexError(f"a distance matrix has 2 dimensions, got {len(index)} indices")
+        rows, columns = (self._get_indices(part) for part in index)
+        # A slice selects a block with the other index, like NumPy
+        if any(isinstance(part, slice) for part in index) and rows.ndim == 1 and columns.ndim == 1:
+            rows = rows[:, None]
+        return self.take(rows, columns)
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self.row(index)
+
+    def to_array(self):
+        """The full n x n array, the stored array itself for full storage."""
+        if not self.is_condensed:
+            return self.storage
+        array = np.zeros((self.size, self.size), dtype=self.dtype)
+        start = 0
+        for row in range(self.size - 1):
+            values = self.storage[start:start + self.size - row - 1]
+            array[row, row + 1:] = values
+            array[row + 1:, row] = values
+            start += self.size - row - 1
+        return array
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.to_array()
+        if dtype is not None and array.dtype != dtype:
+            return array.astype(dtype)
+        return array.copy() if copy else array
+
+    def condense(self):
+        """The same matrix with condensed storage."""
+        if self.is_condensed:
+            return self
+        return DistanceMatrix(self.storage, units=self.units, symmetric=self._symmetric, condensed=True)
+
+    def expand(self):
+        """The same matrix with full storage."""
+        if not self.is_condensed:
+            return self
+        return DistanceMatrix(self.to_array(), units=self.units, symmetric=True)
+
+    def astype(self, dtype):
+        return DistanceMatrix(self.storage.astype(dtype), units=self.units, symmetric=self._symmetric)
+
+    def unreachable_mask(self):
+        """Boolean n x n array, True for the pairs without a route."""
+        return np.isnan(self.to_array())
+
+    @property
+    def nb_unreachable(self):
+        """Number of ordered pairs without a route."""
+        nb_unreachable = int(np.isnan(self.storage).sum())
+        return 2 * nb_unreachable if self.is_condensed else nb_unreachable
+
+    def filled(self, value):
+        """The full array with value for the unreachable pairs."""
+        array = self.to_array()
+        if not np.isnan(self.storage).any():
+            return array
+        return np.where(np.isnan(array), value, array)
+
+    def tolist(self):
+        """Nested lists, None for the unreachable pairs (the format of the OSRM table service)."""
+        return [[None if value != value else value for value in row] for row in self.to_array().tolist()]
+
+    def __repr__(self):
+        storage = 'condensed' if self.is_condensed else 'full'
+        return f"DistanceMatrix(size={self.size}, units={self.units!r}, dtype={self.dtype}, {storage})"
+
+
+class SparseDistanceMatrix:
+
+    """
+    The values of only some pairs of points, e.g. the arcs a solver with neighbor lists uses (see
+    OSRM.get_sparse_distance_matrix), in O(number of pairs) memory instead of n x n. The pairs are stored sorted by
+    (row, column), take() looks them up with a binary search. The other pairs are computed by estimate (a function of
+    the arrays rows and columns, e.g. a straight-line estimate) when they are asked for, or NaN without estimate.
+    """
+
+    def __init__(self, size, rows, columns, values, units=None, estimate=None):
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        keys = rows * size + columns
+        # Sorted by key, the first value of a pair that is given more than once is kept
+        keys, first = np.unique(keys, return_index=True)
+        self.size = size
+        self.units = units or 'm'
+        self.keys = keys
+        self.values = _to_float_array(values)[first]
+        self.estimate = estimate
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nb_pairs(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes
+
+    def take(self, rows, columns):
+        """
+        Values of the pairs (rows[k], columns[k]) as an array, 0 on the diagonal. The pairs that are not stored are
+        estimated (NaN without estimate).
+        """
+        rows, columns = np.broadcast_arrays(np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64))
+        keys = rows * self.size + columns
+        values = np.full(keys.shape, np.nan)
+        if len(self.keys):
+            positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            stored = self.keys[positions] == keys
+            values[stored] = self.values[positions[stored]]
+        else:
+            stored = np.zeros(keys.shape, dtype=bool)
+        missing = ~stored & (rows != columns)
+        if self.estimate is not None and missing.any():
+            values[missing] = self.estimate(rows[missing], columns[missing])
+        values[rows == columns] = 0
+        return values
+
+    def get_neighbors(self):
+        """The columns of the stored pairs of every row, a list of arrays."""
+        rows, columns = np.divmod(self.keys, self.size)
+        return np.split(columns, np.searchsorted(rows, np.arange(1, self.size)))
+
+    def __repr__(self):
+        return f"SparseDistanceMatrix(size={self.size}, units={self.units!r}, pairs={self.nb_pairs})"
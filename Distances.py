@@ -8,82 +8,66 @@ Leveraging the OSRM API for real-distance calculations.
 Author: Achilles Demey, Nikolaos Kales
 """
 import math
+import numpy as np
 import pandas as pd
 import geopy.distance
-import requests
-import polyline
+from OSRMClient import OSRMError, get_client
+from Instrumentation import timed
+from RouteGeometry import decode_polyline
+from DistanceMatrix import DistanceMatrix
+from Depot import GHENT_DEPOT
 
-def fetch_osrm_route_geometry(from_node, to_node):
+def fetch_osrm_route_geometry(from_node, to_node, client=None):
     """
     Fetches the route geometry from the OSRM API between two points.
-    It returns the distance and the route geometry.
+    It returns the distance and the route geometry (an (n, 2) array of (latitude, longitude)).
     """
     try:
-        response = requests.get(
-            f"http://router.project-osrm.org/route/v1/driving/"
-            f"{from_node[1]},{from_node[0]};{to_node[1]},{to_node[0]}?overview=full"
-        )
-        if response.status_code == 200:
-            route = response.json()['routes'][0]
-            distance = route['distance']  # Get distance in meters
-            # Decode polyline to a list of coordinates if needed
-            route_geometry = polyline.decode(route['geometry'])
-            return distance, route_geometry
-        else:
-            response.raise_for_status()
+        client = client or get_client(local=False)
+        route = client.route([from_node, to_node], overview='full', profile='driving')['routes'][0]
+        distance = route['distance']  # Get distance in meters
+        # Decode polyline to an array of coordinates
+        route_geometry = decode_polyline(route['geometry'])
+        return distance, route_geometry
     except Exception as e:
         print(f"Error fetching OSRM route: {e}")
         return None, None
         
         
-def osrm_all_points_geometry(points):
-    # Convert list of points to a semicolon-separated string
-    points_str = ";".join([f"{point[1]},{point[0]}" for point in points])
-    print('points_str',points_str)
-    
-    response = requests.get(
-    f"http://router.project-osrm.org/route/v1/driving/"
-    f"{points_str}?overview=full")
-
-    if response.status_code == 200:
-        route = response.json()['routes'][0]
-        # Decode polyline to a list of coordinates
-        route_geometry = polyline.decode(route['geometry'])
-        distance = route['distance']  # Get distance in meters
-        return distance,route_geometry
-    else:
-        raise Exception("OSRM request failed")
+def osrm_all_points_geometry(points, client=None):
+    client = client or get_client(local=False)
+    try:
+        route = client.route(points, overview='full', profile='driving')['routes'][0]
+    except OSRMError as e:
+        raise Exception("OSRM request failed") from e
+    # Decode polyline to an array of coordinates
+    route_geometry = decode_polyline(route['geometry'])
+    distance = route['distance']  # Get distance in meters
+    return distance,route_geometry
     
 
 
 
-def fetch_osrm_table_service(points):
-    # Convert list of points to a semicolon-separated string
-    points_str = ";".join([f"{point[1]},{point[0]}" for point in points])
-    
-    response = requests.get(
-    'https://router.project-osrm.org/table/v1/driving/points_str?annotations=distance,duration',verify=False)
-    if response.status_code == 200:
-        print('response', response.json())
-        distance_matrix = response.json()['distances']
-        duration_matrix = response.json()['durations']
-        return distance_matrix,duration_matrix
-        #return None
-    else:
-        raise Exception("OSRM request failed")
+def fetch_osrm_table_service(points, client=None):
+    client = client or get_client(local=False)
+    try:
+        response_json = client.table(points, annotations=('distance', 'duration'), profile='driving')
+    except OSRMError as e:
+        raise Exception("OSRM request failed") from e
+    distance_matrix = response_json['distances']
+    duration_matrix = response_json['durations']
+    return distance_matrix,duration_matrix
     
 
     
 
 # Function to get the route geometries
 def get_route_geometries(data, route):
-    """ gets the route geometries for a given route"""
-    geometries = []
-    for i in range(len(route) - 1):
-        geom = fetch_osrm_route_geometry(data['locations'][route[i]], data['locations'][route[i+1]])
-        geometries.extend(geom[1])
-    #geometries = [ x for xs in geometries for x in xs ]
-    return geometries
+    """ gets the route geometries for a given route, with one OSRM request for all the stops of the route"""
+    if len(route) < 2:
+        return np.zeros((0, 2))
+    distance, route_geometry = osrm_all_points_geometry([data['locations'][index] for index in route])
+    return route_geometry
 
 
 
@@ -105,15 +89,155 @@ def get_straight_line_distance(coord1, coord2):
     """calculates the straight-line distance between two points using the geodesic distance."""
     return geopy.distance.geodesic(coord1, coord2).m
     
-def get_straight_line_distance_matrix(coordinate_list):
-    distance_matrix = []
-    for from_counter, from_node in enumerate(coordinate_list):
-        distance_matrix.append([])
-        for to_counter, to_node in enumerate(coordinate_list):
-            if from_counter == to_counter:
-                distance_matrix[from_counter] += [0]
-            else:
-                distance_matrix[from_counter].append(geopy.distance.geodesic(from_node, to_node).m)
+def get_straight_line_distance_matrix(coordinate_list, method="ellipsoidal", dtype=np.float64, max_block_elements=2**21):
+    """
+    Straight-line distance matrix (in meters) as a list of lists, see get_straight_line_distance_array.
+    """
+    return get_straight_line_distance_array(coordinate_list, method=method, dtype=dtype,
+                                            max_block_elements=max_block_elements).tolist()
+
+
+# WGS-84 ellipsoid (same as geopy.distance.geodesic) and the mean earth radius for haversine
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+MEAN_EARTH_RADIUS = 6371008.8
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between the points (lat1, lon1) and (lat2, lon2), broadcast like NumPy."""
+    half_dlat = (lat2 - lat1) * 0.5
+    half_dlon = (lon2 - lon1) * 0.5
+    h = np.sin(half_dlat) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(half_dlon) ** 2
+    return 2 * MEAN_EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def _haversine_block(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between every row point (lat1, lon1) and column point (lat2, lon2)."""
+    return _haversine(lat1[:, None], lon1[:, None], lat2[None, :], lon2[None, :])
+
+
+def _vincenty_block(lat1, lon1, lat2, lon2, max_iterations=100, tolerance=1e-12):
+    """Ellipsoidal distance in meters between every row point (lat1, lon1) and column point (lat2, lon2)."""
+    return _vincenty(lat1[:, None], lon1[:, None], lat2[None, :], lon2[None, :], max_iterations, tolerance)
+
+
+def _vincenty(lat1, lon1, lat2, lon2, max_iterations=100, tolerance=1e-12):
+    """
+    Ellipsoidal (WGS-84) distance in meters between the points (lat1, lon1) and (lat2, lon2) (broadcast like NumPy)
+    using Vincenty's inverse formula.
+    All pairs are iterated together until the longitude on the auxiliary sphere converged everywhere.
+    """
+    f = WGS84_F
+    U1 = np.arctan((1 - f) * np.tan(lat1))
+    U2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_U1, cos_U1 = np.sin(U1), np.cos(U1)
+    sin_U2, cos_U2 = np.sin(U2), np.cos(U2)
+    L = lon2 - lon1
+    lam = L
+    for _ in range(max_iterations):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(cos_U2 * sin_lam, cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lam)
+        cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        # Coincident points have sin_sigma == 0, their distance is 0 whatever alpha is
+        safe_sin_sigma = np.where(sin_sigma == 0, 1, sin_sigma)
+        sin_alpha = cos_U1 * cos_U2 * sin_lam / safe_sin_sigma
+        cos2_alpha = 1 - sin_alpha ** 2
+        # Points on the equator have cos2_alpha == 0 and cos_2sigma_m is then defined as 0
+        safe_cos2_alpha = np.where(cos2_alpha == 0, 1, cos2_alpha)
+        cos_2sigma_m = np.where(cos2_alpha == 0, 0, cos_sigma - 2 * sin_U1 * sin_U2 / safe_cos2_alpha)
+        C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        lam_previous = lam
+        lam = L + (1 - C) * f * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        if np.max(np.abs(lam - lam_previous), initial=0) < tolerance:
+            break
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+        - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    return WGS84_B * A * (sigma - delta_sigma)
+
+
+def _get_block_function(method, dtype, pairwise=False):
+    """
+    Returns the block function and the dtype it computes in for a straight-line method, with pairwise the function of
+    the distances between pairs of points instead of between every row point and column point.
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError(f"dtype must be float32 or float64, got {dtype}")
+    if method == "ellipsoidal":
+        return (_vincenty if pairwise else _vincenty_block), np.float64
+    elif method == "haversine":
+        return (_haversine if pairwise else _haversine_block), dtype
+    raise ValueError(f"Unknown straight-line method '{method}', use 'ellipsoidal' or 'haversine'")
+
+
+def get_straight_line_distance_block(from_coordinates, to_coordinates, method="ellipsoidal", dtype=np.float64,
+                                     max_block_elements=2**21):
+    """
+    Straight-line distances (in meters) from every coordinate of from_coordinates to every coordinate of to_coordinates,
+    a len(from_coordinates) x len(to_coordinates) array. See get_straight_line_distance_array for the arguments.
+    """
+    block_function, compute_dtype = _get_block_function(method, dtype)
+    from_radians = np.radians(np.asarray(from_coordinates, dtype=np.float64).reshape(-1, 2)).astype(compute_dtype)
+    to_radians = np.radians(np.asarray(to_coordinates, dtype=np.float64).reshape(-1, 2)).astype(compute_dtype)
+    distances = np.zeros((len(from_radians), len(to_radians)), dtype=dtype)
+    block_size = max(1, max_block_elements // max(len(to_radians), 1))
+    for start in range(0, len(from_radians), block_size):
+        stop = min(start + block_size, len(from_radians))
+        distances[start:stop] = block_function(from_radians[start:stop, 0], from_radians[start:stop, 1],
+                                               to_radians[:, 0], to_radians[:, 1])
+    return distances
+
+
+def get_straight_line_distance_pairs(from_coordinates, to_coordinates, method="ellipsoidal"):
+    """
+    Straight-line distances (in meters) between the pairs (from_coordinates[k], to_coordinates[k]), an array of
+    len(from_coordinates) values.
+    """
+    distance_function, _ = _get_block_function(method, np.float64, pairwise=True)
+    from_radians = np.radians(np.asarray(from_coordinates, dtype=np.float64).reshape(-1, 2))
+    to_radians = np.radians(np.asarray(to_coordinates, dtype=np.float64).reshape(-1, 2))
+    return distance_function(from_radians[:, 0], from_radians[:, 1], to_radians[:, 0], to_radians[:, 1])
+
+
+@timed('matrix.straight_line')
+def get_straight_line_distance_array(coordinate_list, method="ellipsoidal", dtype=np.float64, max_block_elements=2**21):
+    """
+    Calculates the straight-line distance matrix (in meters) of a list of (latitude, longitude) coordinates at once with NumPy.
+
+    The matrix is built per block of rows, each block holds at most max_block_elements pairs so memory stays bounded for large
+    coordinate lists. Only the upper triangle (and the diagonal block) is computed, the lower triangle is mirrored from it.
+
+    method:
+        - 'ellipsoidal': Vincenty's formula on the WGS-84 ellipsoid. Agrees with geopy.distance.geodesic within 1 mm for
+          any pair of stops in a city (Vincenty only loses accuracy for nearly antipodal points).
+        - 'haversine': great-circle distance on a sphere with the mean earth radius. Cheaper, but up to 0.5% off geopy.
+    dtype: np.float32 or np.float64, the dtype of the returned matrix. The haversine blocks are computed in this dtype
+        (float32 is accurate to about 1 m at city scale), the ellipsoidal blocks are always computed in float64 because the
+        iteration needs the precision and are cast afterwards.
+    """
+    block_function, compute_dtype = _get_block_function(method, dtype)
+    coordinates = np.radians(np.asarray(coordinate_list, dtype=np.float64).reshape(-1, 2)).astype(compute_dtype)
+    latitudes, longitudes = coordinates[:, 0], coordinates[:, 1]
+    n = len(coordinates)
+    distance_matrix = np.zeros((n, n), dtype=dtype)
+    block_size = max(1, max_block_elements // max(n, 1))
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        # Rows start:stop against columns start:n, i.e. the upper triangle of these rows
+        block = block_function(latitudes[start:stop], longitudes[start:stop], latitudes[start:], longitudes[start:])
+        # The square start:stop part is mirrored from its upper triangle too, so the matrix is exactly symmetric
+        lower = np.tril_indices(stop - start, -1)
+        block[:, :stop - start][lower] = block[:, :stop - start].T[lower]
+        distance_matrix[start:stop, start:] = block
+        distance_matrix[start:, start:stop] = block.T
+    np.fill_diagonal(distance_matrix, 0)
     return distance_matrix
 
 def get_real_distance_matrix(coordinate_list):
@@ -131,25 +255,94 @@ def get_real_distance_matrix(coordinate_list):
 
 
 def get_route_real_distance(coordinate_list):
-    """Calculates the total real distance for a sequence of coordinates. 
-    It iterates over each pair of consecutive coordinates in the sequence, 
-    calculates the real distance between them using the get_real_distance function (which fetches the real distance from the OSRM API),
-    and adds this distance to a running total. 
-    The total distance is then returned."""
-    total_distance = 0
-    for index in range(len(coordinate_list)-1):
-        coord_1 = coordinate_list[index]
-        coord_2 = coordinate_list[index+1]
-        total_distance += get_real_distance(coord_1, coord_2)
-    return total_distance
+    """
+    Calculates the total real distance for a sequence of coordinates with one OSRM route request through all the
+    coordinates (see evaluate_routes). Returns an infinite distance when the route could not be fetched.
+    """
+    _, total_distances = evaluate_routes([coordinate_list], method='osrm', local=False)
+    total_distance = float(total_distances[0])
+    return total_distance if not math.isnan(total_distance) else float('inf')
 
 def get_route_straight_line_distance(coordinate_list):
-    total_distance = 0
-    for index in range(len(coordinate_list)-1):
-        coord_1 = coordinate_list[index]
-        coord_2 = coordinate_list[index+1]
-        total_distance += get_straight_line_distance(coord_1, coord_2)
-    return total_distance
+    """Total straight-line (ellipsoidal) distance of a sequence of coordinates, all the legs at once."""
+    _, total_distances = evaluate_routes([coordinate_list], method='ellipsoidal')
+    return float(total_distances[0])
+
+
+def _get_route_legs(routes):
+    """
+    The legs of all the routes as one array of from positions and one of to positions in the concatenation of the
+    routes, with the route of every leg.
+    """
+    lengths = np.fromiter((len(route) for route in routes), dtype=np.int64, count=len(routes))
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    nb_legs = np.maximum(lengths - 1, 0)
+    route_ids = np.repeat(np.arange(len(routes)), nb_legs)
+    leg_offsets = np.concatenate([[0], np.cumsum(nb_legs)]).astype(np.int64)
+    from_positions = starts[route_ids] + np.arange(len(route_ids)) - leg_offsets[route_ids]
+    return from_positions, from_positions + 1, route_ids, leg_offsets
+
+
+def _fetch_route_leg_distances(coordinate_list, client):
+    response_json = client.route(coordinate_list, overview='false')
+    return [leg['distance'] for leg in response_json['routes'][0]['legs']]
+
+
+@timed('routes.evaluate')
+def evaluate_routes(routes, distance_matrix=None, coordinate_list=None, method='osrm', local=True, client=None):
+    """
+    Returns the distance of every leg and the total distance of many routes at once, as (leg_distances,
+    total_distances): a list with the array of leg distances of every route and the array of route totals.
+
+    routes: sequences of stop indices (in distance_matrix and coordinate_list) or of (latitude, longitude) coordinates
+    distance_matrix: matrix of the stops (DistanceMatrix, array or nested lists), the index routes are then costed by
+        one array lookup of all their legs
+    Without a matrix the legs are costed with method:
+    - 'osrm': one OSRM route request through all the stops of a route per route, sent concurrently on the pooled client
+      of the local server (local=True, the default of RoutingProblem.evaluate_routes and OSRM.py) or the public one
+    - 'ellipsoidal' or 'haversine': straight-line distances of all the legs of all the routes in one vectorized pass
+    Unreachable legs (and every leg of a route whose OSRM request failed) are NaN, and so is the total of their route.
+    """
+    routes = [list(route) for route in routes]
+    if not routes:
+        return [], np.zeros(0)
+    indexed = any(len(route) and np.ndim(route[0]) == 0 for route in routes)
+    from_positions, to_positions, route_ids, leg_offsets = _get_route_legs(routes)
+    if distance_matrix is not None:
+        if not indexed:
+            raise ValueError("routes must be sequences of stop indices to be costed with a distance matrix")
+        stops = np.fromiter((stop for route in routes for stop in route), dtype=np.int64)
+        from_stops, to_stops = stops[from_positions], stops[to_positions]
+        if isinstance(distance_matrix, DistanceMatrix):
+            values = distance_matrix.take(from_stops, to_stops)
+        else:
+            values = np.asarray(distance_matrix, dtype=np.float64)[from_stops, to_stops]
+    else:
+        if indexed:
+            if coordinate_list is None:
+                raise ValueError("routes of stop indices need a distance_matrix or a coordinate_list")
+            routes = [[coordinate_list[stop] for stop in route] for route in routes]
+        if method == 'osrm':
+            client = client or get_client(local)
+            requested = [index for index, route in enumerate(routes) if len(route) > 1]
+            results = client.batch(_fetch_route_leg_distances, [(routes[index], client) for index in requested],
+                                   return_exceptions=True)
+            values = np.full(len(route_ids), np.nan)
+            for index, result in zip(requested, results):
+                if isinstance(result, Exception):
+                    print(f"Error fetching OSRM route: {result}")
+                    continue
+                values[leg_offsets[index]:leg_offsets[index + 1]] = result
+        else:
+            distance_function, _ = _get_block_function(method, np.float64, pairwise=True)
+            points = np.radians(np.asarray([coordinate for route in routes for coordinate in route],
+                                           dtype=np.float64).reshape(-1, 2))
+            values = distance_function(points[from_positions, 0], points[from_positions, 1],
+                                       points[to_positions, 0], points[to_positions, 1])
+    values = np.asarray(values, dtype=np.float64)
+    leg_distances = np.split(values, leg_offsets[1:-1])
+    total_distances = np.bincount(route_ids, weights=values, minlength=len(routes))
+    return leg_distances, total_distances
 
 
 class StraightLineDistanceMatrix:
@@ -163,15 +356,9 @@ class StraightLineDistanceMatrix:
 
 
     def calculate_distance_matrix(self):
-        distance_matrix = []
-        for from_counter, from_node in enumerate(self.LOCATIONS):
-            distance_matrix.append([])
-            for to_counter, to_node in enumerate(self.LOCATIONS):
-                if from_counter == to_counter:
-                    distance_matrix[from_counter] += [0]
-                else:
-                    distance_matrix[from_counter].append(geopy.distance.geodesic(from_node, to_node).m)
-        self.MATRIX = distance_matrix
+        # Symmetric, only the upper triangle is stored
+        self.MATRIX = DistanceMatrix(get_straight_line_distance_array(self.LOCATIONS), units='m', symmetric=True,
+                                     condensed=True)
 
 
 
@@ -185,27 +372,28 @@ class StraightLineDistanceMatrix:
             return "No matrix calculated"
         else:
             print("Matrix type: ", self.TYPE)
-            print(pd.DataFrame(self.MATRIX))
+            print(pd.DataFrame(np.asarray(self.MATRIX)))
             return ""
 
 class RealDistanceMatrix:
 
     """This class represents a matrix of real distances (based on routes from the OSRM API) between a set of locations."""
 
-    def __init__(self, locations, depot=[51.0206803530003, 3.7406690974811703]):
+    def __init__(self, locations, depot=GHENT_DEPOT, checkpoint_directory=None, **build_options):
 
         """
         The constructor takes a list of locations and an optional depot location as input
-        and initializes the DEPOT, LOCATIONS, MATRIX, and TYPE attributes. 
-        It then calls the calculate_distance_matrix method to calculate the distance matrix.
+        and initializes the DEPOT, LOCATIONS, MATRIX, TIME_MATRIX and TYPE attributes. 
+        It then calls the calculate_distance_matrix method to calculate the distance matrix
+        (see calculate_distance_matrix for checkpoint_directory and the other build options).
         """
 
         self.DEPOT = depot
         self.LOCATIONS = locations
         self.TYPE = "REAL DISTANCE"
-        self.MATRIX = fetch_osrm_table_service(self.LOCATIONS)
-
-
+        self.MATRIX = None
+        self.TIME_MATRIX = None
+        self.calculate_distance_matrix(checkpoint_directory=checkpoint_directory, **build_options)
 
 
 
@@ -227,63 +415,28 @@ class RealDistanceMatrix:
             return "No matrix calculated"
         else:
             print("Matrix type: ", self.TYPE)
-            print(pd.DataFrame(self.MATRIX))
+            print(pd.DataFrame(np.asarray(self.MATRIX)))
             return ""
 
-    # Modified fetch function to also get and return geometry
-    def fetch_osrm_route_geometry(from_node, to_node):
-        response = requests.get(
-            f"http://router.project-osrm.org/route/v1/driving/"
-            f"{from_node[1]},{from_node[0]};{to_node[1]},{to_node[0]}?overview=full"
-        )
-        if response.status_code == 200:
-            route = response.json()['routes'][0]
-            # Decode polyline to a list of coordinates
-            route_geometry = polyline.decode(route['geometry'])
-            return route_geometry
-        else:
-            raise Exception("OSRM request failed")
-
-    # Function to get the route geometries
-    def get_route_geometries(route):
-        geometries = []
-        for i in range(len(route) - 1):
-            geom = fetch_osrm_route_geometry(data['locations'][route[i]], data['locations'][route[i + 1]])
-            geometries.extend(geom)
-        return geometries
-
-
-    def calculate_distance_matrix(self, locations, type="REAL DISTANCE", add_depot=True):
-        distance_matrix = [[0 if i == j else None for j in range(len(locations))] for i in range(len(locations))]
-        # Create a thread pool executor to send requests in parallel
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            # Dictionary to hold future to location index mappings
-            future_to_location = {}
-            # Submit all OSRM requests to the executor
-            for i, origin in enumerate(locations):
-                for j, destination in enumerate(locations):
-                    if i != j:
-                        # Submit the fetch function to the executor
-                        future = executor.submit(fetch_osrm_distance, origin, destination)
-                        future_to_location[future] = (i, j)
-            
-            # As each request completes, record the result in the distance matrix
-            for future in as_completed(future_to_location):
-                i, j = future_to_location[future]
-                try:
-                    # Get the result from the future
-                    distance_matrix[i][j] = future.result()
-                except Exception as e:
-                    print(f"Request failed: {e}")
-                    distance_matrix[i][j] = float('inf')
-
-        # Fill in any missing entries in the distance matrix
-        for i in range(len(locations)):
-            for j in range(len(locations)):
-                if distance_matrix[i][j] is None:
-                    distance_matrix[i][j] = distance_matrix[j][i]
-
-        self.MATRIX = distance_matrix
+    def get_route_geometries(self, route):
+        """ returns the route geometry of a route of location indices, with one OSRM request for all its stops """
+        return get_route_geometries({'locations': self.LOCATIONS}, route)
+
+
+    def calculate_distance_matrix(self, locations=None, checkpoint_directory=None, local=False, **build_options):
+        """
+        Fills the distance matrix (and the time matrix) of the locations, by default self.LOCATIONS, with OSRM table
+        requests in tiles, a few in parallel and optionally rate limited (see MatrixBuilder.build_osrm_matrix for the
+        options). With a checkpoint_directory the partial matrices are saved while they are built, an interrupted build
+        continues from the fetched tiles when it is started again.
+        """
+        # Imported here, MatrixBuilder imports OSRM which imports this module
+        from MatrixBuilder import build_osrm_matrix
+        locations = self.LOCATIONS if locations is None else locations
+        distance_matrix, duration_matrix = build_osrm_matrix(locations, checkpoint_directory=checkpoint_directory,
+                                                             local=local, **build_options)
+        self.MATRIX = DistanceMatrix(distance_matrix, units='m')
+        self.TIME_MATRIX = DistanceMatrix(duration_matrix, units='s')
 
 
 
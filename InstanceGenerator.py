@@ -0,0 +1,100 @@
+"""
+Seeded generator of synthetic routing problems that look like the Ghent waste collection data.
+
+The stops are drawn in clusters (neighborhoods) around the depot, every stop has a demand (number of containers) and the
+fleet is sized the way VRPTests.py sizes it from the dataset. Every instance also gets an "original" solution, routes
+planned neighborhood by neighborhood the way a planner would, so improvements can be measured against it.
+The same seed always gives the same instance.
+
+The instances are dicts with the keys of a BatchRunner job: name, coordinates (the depot first), original_solution,
+and for a CVRP demands, nb_vehicles and capacities.
+"""
+import numpy as np
+from Depot import GHENT_DEPOT
+
+METERS_PER_DEGREE_LATITUDE = 111320.0
+
+
+def generate_coordinates(nb_stops, seed=0, depot=GHENT_DEPOT, nb_clusters=None, radius=6000, cluster_spread=400):
+    """
+    Returns the depot and nb_stops stops around it as a list of (latitude, longitude), and the cluster of every stop.
+    nb_clusters: number of neighborhoods, default one per 40 stops
+    radius: maximum distance (m) of a neighborhood center to the depot
+    cluster_spread: standard deviation (m) of the stops around their neighborhood center
+    """
+    rng = np.random.default_rng(seed)
+    nb_clusters = nb_clusters or max(1, nb_stops // 40)
+    # Uniform centers in the disc around the depot
+    center_distances = radius * np.sqrt(rng.uniform(0.05, 1.0, nb_clusters))
+    center_angles = rng.uniform(0, 2 * np.pi, nb_clusters)
+    centers = np.column_stack([center_distances * np.sin(center_angles), center_distances * np.cos(center_angles)])
+    # Neighborhoods of different sizes
+    weights = rng.dirichlet(np.full(nb_clusters, 2.0))
+    clusters = rng.choice(nb_clusters, size=nb_stops, p=weights)
+    offsets = centers[clusters] + rng.normal(0, cluster_spread, (nb_stops, 2))
+
+    meters_per_degree_longitude = METERS_PER_DEGREE_LATITUDE * np.cos(np.radians(depot[0]))
+    latitudes = depot[0] + offsets[:, 0] / METERS_PER_DEGREE_LATITUDE
+    longitudes = depot[1] + offsets[:, 1] / meters_per_degree_longitude
+    coordinates = [tuple(depot)] + [(float(latitude), float(longitude))
+                                    for latitude, longitude in zip(latitudes, longitudes)]
+    return coordinates, clusters
+
+
+def _get_planned_order(coordinates, clusters):
+    """Stop indices (without the depot) neighborhood by neighborhood around the depot, by angle in a neighborhood."""
+    points = np.asarray(coordinates[1:], dtype=np.float64)
+    depot = np.asarray(coordinates[0], dtype=np.float64)
+    cluster_ids = np.unique(clusters)
+    cluster_centers = np.array([points[clusters == cluster].mean(axis=0) for cluster in cluster_ids])
+    cluster_angles = np.arctan2(cluster_centers[:, 0] - depot[0], cluster_centers[:, 1] - depot[1])
+    cluster_rank = np.empty(len(cluster_ids), dtype=np.int64)
+    cluster_rank[np.argsort(cluster_angles)] = np.arange(len(cluster_ids))
+    stop_cluster_rank = cluster_rank[np.searchsorted(cluster_ids, clusters)]
+    stop_centers = cluster_centers[np.searchsorted(cluster_ids, clusters)]
+    stop_angles = np.arctan2(points[:, 0] - stop_centers[:, 0], points[:, 1] - stop_centers[:, 1])
+    return (np.lexsort((stop_angles, stop_cluster_rank)) + 1).tolist()
+
+
+def generate_tsp_instance(nb_stops, seed=0, name=None, **coordinate_options):
+    """A TSP instance (one route of a day) with nb_stops stops, see generate_coordinates for the options."""
+    coordinates, clusters = generate_coordinates(nb_stops, seed, **coordinate_options)
+    order = _get_planned_order(coordinates, clusters)
+    return {
+        'name': name or f'SYNTHETIC_TSP_{nb_stops}_{seed}',
+        'coordinates': coordinates,
+        'original_solution': {'ORIGINAL': [0] + order + [0]},
+    }
+
+
+def generate_cvrp_instance(nb_stops, seed=0, name=None, stops_per_truck=60, max_demand=3, **coordinate_options):
+    """
+    A CVRP instance (all the routes of a day) with nb_stops stops. The number of trucks is about one per stops_per_truck
+    stops, every stop has 1 to max_demand containers and the capacities leave some slack, like in VRPTests.py.
+    See generate_coordinates for the other options.
+    """
+    coordinates, clusters = generate_coordinates(nb_stops, seed, **coordinate_options)
+    rng = np.random.default_rng(seed + 1)
+    demands = [0] + rng.integers(1, max_demand + 1, nb_stops).tolist()
+    nb_vehicles = max(1, round(nb_stops / stops_per_truck))
+    capacities = [round(sum(demands) / nb_vehicles) + 5] * nb_vehicles
+
+    # Planned routes: the neighborhoods in turn, a truck continues until it is full
+    original_solution = {}
+    route, load = [], 0
+    for stop in _get_planned_order(coordinates, clusters):
+        if route and load + demands[stop] > capacities[len(original_solution)] and \
+                len(original_solution) < nb_vehicles - 1:
+            original_solution['truck_' + str(len(original_solution))] = [0] + route + [0]
+            route, load = [], 0
+        route.append(stop)
+        load += demands[stop]
+    original_solution['truck_' + str(len(original_solution))] = [0] + route + [0]
+    return {
+        'name': name or f'SYNTHETIC_CVRP_{nb_stops}_{seed}',
+        'coordinates': coordinates,
+        'original_solution': original_solution,
+        'demands': demands,
+        'nb_vehicles': nb_vehicles,
+        'capacities': capacities,
+    }
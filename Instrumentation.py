@@ -0,0 +1,223 @@
+"""
+Lightweight timing spans and counters for the routing pipeline.
+
+Instrumentation is off by default; enable() (or the environment variable ROUTING_INSTRUMENTATION=1) switches it on.
+When it is off, span() returns a shared do-nothing context manager and count() returns right away, so the hooks in the
+hot paths cost about one function call.
+
+    with span('matrix.osrm', stops=len(coordinate_list)):
+        ...
+    count('osrm.bytes', len(response.content), service='table')
+
+Spans and counters are aggregated per name and labels (count, total, min and max seconds of a span, sum of a counter)
+in the current Recorder. problem_report(name) gives every routing problem its own recorder, which can be exported as
+JSON or as a Prometheus text file:
+
+    enable()
+    with problem_report('DAY_1') as report:
+        ...
+    report.save_json('./reports/DAY_1.json')
+    report.save_prometheus('./reports/DAY_1.prom')
+"""
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+_enabled = os.environ.get('ROUTING_INSTRUMENTATION', '') not in ('', '0')
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+class Recorder:
+
+    """Aggregated spans and counters of a run (or of one routing problem)."""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.start_time = time.time()
+        self.spans = {}     # (name, labels) -> [count, total, min, max] seconds
+        self.counters = {}  # (name, labels) -> total
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds, labels=()):
+        key = (name, labels)
+        with self._lock:
+            stats = self.spans.get(key)
+            if stats is None:
+                self.spans[key] = [1, seconds, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = min(stats[2], seconds)
+                stats[3] = max(stats[3], seconds)
+
+    def add_count(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            spans = [{'name': name, 'labels': dict(labels), 'count': count, 'total': total, 'min': minimum,
+                      'max': maximum, 'mean': total / count}
+                     for (name, labels), (count, total, minimum, maximum) in self.spans.items()]
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in self.counters.items()]
+        return {
+            'name': self.name,
+            'wall_time': time.time() - self.start_time,
+            'spans': sorted(spans, key=lambda span: -span['total']),
+            'counters': sorted(counters, key=lambda counter: counter['name']),
+        }
+
+    def save_json(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_prometheus(self, prefix='routing_'):
+        """
+        Prometheus text exposition of the recorder: every span as <prefix>span_seconds_count/_sum/_max and every counter
+        as <prefix><counter>_total, labeled with the span or counter labels and the problem name.
+        """
+        report = self.to_dict()
+        lines = [
+            f"# HELP {prefix}span_seconds Time spent in a span of the routing pipeline.",
+            f"# TYPE {prefix}span_seconds summary",
+        ]
+        max_lines = []
+        for span in report['spans']:
+            labels = _format_labels({'span': span['name'], **self._problem_label(), **span['labels']})
+            lines.append(f"{prefix}span_seconds_count{labels} {span['count']}")
+            lines.append(f"{prefix}span_seconds_sum{labels} {span['total']:.6f}")
+            max_lines.append(f"{prefix}span_seconds_max{labels} {span['max']:.6f}")
+        if max_lines:
+            lines += [f"# TYPE {prefix}span_seconds_max gauge"] + max_lines
+        counter_lines = {}
+        for counter in report['counters']:
+            metric = prefix + _metric_name(counter['name']) + '_total'
+            labels = _format_labels({**self._problem_label(), **counter['labels']})
+            counter_lines.setdefault(metric, []).append(f"{metric}{labels} {counter['value']}")
+        for metric, metric_lines in counter_lines.items():
+            lines += [f"# TYPE {metric} counter"] + metric_lines
+        return "\n".join(lines) + "\n"
+
+    def save_prometheus(self, path, prefix='routing_'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus(prefix))
+
+    def _problem_label(self):
+        return {'problem': self.name} if self.name is not None else {}
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{_metric_name(key)}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+_recorder = Recorder()
+
+
+def get_recorder():
+    """The recorder the spans and counters currently go to."""
+    return _recorder
+
+
+@contextmanager
+def problem_report(name):
+    """Records the spans and counters of the block in a new Recorder, yields it and restores the previous one."""
+    global _recorder
+    previous_recorder = _recorder
+    _recorder = Recorder(name)
+    try:
+        yield _recorder
+    finally:
+        _recorder = previous_recorder
+
+
+class _Span:
+
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _recorder.add_span(self.name, time.perf_counter() - self.start, self.labels)
+        if exc_type is not None:
+            _recorder.add_count(self.name + '.errors', 1, self.labels)
+
+
+class _NullSpan:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **labels):
+    """Context manager that times the block as span name (a failing block also counts <name>.errors)."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, tuple(sorted(labels.items())))
+
+
+def add_span(name, seconds, **labels):
+    """Records a span that was timed by the caller."""
+    if _enabled:
+        _recorder.add_span(name, seconds, tuple(sorted(labels.items())))
+
+
+def count(name, value=1, **labels):
+    """Adds value to counter name."""
+    if _enabled:
+        _recorder.add_count(name, value, tuple(sorted(labels.items())))
+
+
+def timed(name):
+    """Decorator that times every call of the function as span name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Span(name, ()):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,6 +1,9 @@
-import webbrowser
-import plotly.express as px
-import folium
+"""
+Plotting helpers for single routes (plotly) and layered route maps (folium).
+plotly and folium are imported on first use, importing this module does not load them.
+"""
+from RouteGeometry import as_coordinate_array
+
 
 class RoutePlotter:
      
@@ -17,6 +20,7 @@ class RoutePlotter:
         Plots the route using Plotly based on the DataFrame provided during initialization.
         This function uses Mapbox to visualize the route. 
         """
+        import plotly.express as px
         fig = px.line_mapbox(self.route_df, lat='latitude', lon='longitude', zoom=13)
         fig.update_layout(mapbox_style="open-street-map")
         fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
@@ -25,13 +29,20 @@ class RoutePlotter:
 class MultiRoutePlotter:
 
     def __init__(self, center_coords):
+        import folium
         self.map = folium.Map(location=center_coords, tiles="CartoDB Positron", zoom_start=13, control_scale=True)
     
     def add_route(self, coordinates, route_name, color='Red'):
+        """
+        coordinates: the (latitude, longitude) points of the route, a list of pairs, an (n, 2) array or a RouteGeometry
+        (e.g. from RoutingProblem.get_route_geometry)
+        """
+        import folium
         fg = folium.FeatureGroup(name=route_name, show=True).add_to(self.map)
-        folium.PolyLine(coordinates, color=color, weight=2.0, opacity=1).add_to(fg)
+        folium.PolyLine(as_coordinate_array(coordinates).tolist(), color=color, weight=2.0, opacity=1).add_to(fg)
 
     def show(self):
+        import folium
         folium.LayerControl().add_to(self.map)
         return self.map
     
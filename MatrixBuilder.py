@@ -0,0 +1,185 @@
+"""
+Resumable build of large OSRM distance and time matrices.
+
+build_osrm_matrix fetches the N x N matrices in tiles of tile_size sources x tile_size destinations with the tiled fetch
+of OSRM.osrm_get_matrix_tiled (one table request per tile, see OSRM.fetch_table_tile), with at most max_workers requests
+in flight and at most max_requests_per_second requests started per second, e.g. to stay within the limits of a shared
+OSRM server. The checkpoints and the progress lines are hooks of that fetch.
+
+With a checkpoint directory the matrices are written into memory-mapped .npy files as the tiles arrive and the finished
+tiles are recorded next to them. A build that is interrupted (crash, Ctrl-C, failing server) continues from the
+finished tiles when it is started again with the same coordinates, tile size, OSRM server and profile:
+
+    distance_matrix, time_matrix = build_osrm_matrix(coordinates, checkpoint_directory='./checkpoints/day_1')
+
+Progress (finished tiles, pairs per second and the estimated time left) is printed every progress_interval seconds.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+from OSRM import DEFAULT_TILE_SIZE, get_table_tiles, osrm_get_matrix_tiled
+from OSRMClient import OSRMError, get_client
+from Instrumentation import count, timed
+
+DEFAULT_MAX_WORKERS = 4
+PROGRESS_INTERVAL = 10  # seconds
+CHECKPOINT_INTERVAL = 30  # seconds
+
+
+class RateLimiter:
+
+    """Spaces the calls of wait() over all threads so at most rate calls start per second (no limit for None)."""
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(now, self._next_time)
+            self._next_time = start_time + self.interval
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+def _get_coordinates_key(coordinate_list):
+    coordinates = ";".join(f"{latitude:.6f},{longitude:.6f}" for latitude, longitude in coordinate_list)
+    return hashlib.sha1(coordinates.encode('utf-8')).hexdigest()
+
+
+class MatrixCheckpoint:
+
+    """
+    The partial matrices of a build in a directory: distances.npy and durations.npy (memory-mapped, NaN until fetched),
+    tiles_done.npy (a flag per tile) and checkpoint.json (what is being built, to recognize the build on a restart).
+    """
+
+    def __init__(self, directory, coordinate_list, tile_size, base_url=None, profile=None):
+        """base_url and profile: OSRM server and profile of the build, a checkpoint of another server is not resumed"""
+        self.directory = directory
+        n = len(coordinate_list)
+        nb_blocks = -(-n // tile_size)
+        metadata = {'size': n, 'tile_size': tile_size, 'coordinates': _get_coordinates_key(coordinate_list),
+                    'base_url': base_url, 'profile': profile}
+        metadata_path = os.path.join(directory, 'checkpoint.json')
+        resumed = False
+        if os.path.isfile(metadata_path):
+            with open(metadata_path, 'r') as inp:
+                resumed = json.load(inp) == metadata
+            if not resumed:
+                print(f"checkpoint in {directory} is of other coordinates, another tile size or another OSRM server or "
+                      f"profile, starting over")
+        os.makedirs(directory, exist_ok=True)
+        if resumed:
+            self.distances = np.load(self._path('distances.npy'), mmap_mode='r+')
+            self.durations = np.load(self._path('durations.npy'), mmap_mode='r+')
+            self.tiles_done = np.load(self._path('tiles_done.npy'))
+        else:
+            self.distances = np.lib.format.open_memmap(self._path('distances.npy'), mode='w+', dtype=np.float64,
+                                                       shape=(n, n))
+            self.durations = np.lib.format.open_memmap(self._path('durations.npy'), mode='w+', dtype=np.float64,
+                                                       shape=(n, n))
+            self.distances[:] = np.nan
+            self.durations[:] = np.nan
+            self.tiles_done = np.zeros(nb_blocks * nb_blocks, dtype=bool)
+            self.flush()
+            with open(metadata_path, 'w') as output_file:
+                json.dump(metadata, output_file)
+
+    def _path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def flush(self):
+        """Writes the matrices to disk before the tile flags, so a flagged tile is always on disk."""
+        self.distances.flush()
+        self.durations.flush()
+        temporary_path = self._path('tiles_done.tmp.npy')
+        np.save(temporary_path, self.tiles_done)
+        os.replace(temporary_path, self._path('tiles_done.npy'))
+
+
+def _format_seconds(seconds):
+    hours, seconds = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+@timed('matrix.osrm_build')
+def build_osrm_matrix(coordinate_list, checkpoint_directory=None, tile_size=DEFAULT_TILE_SIZE,
+                      max_workers=DEFAULT_MAX_WORKERS, max_requests_per_second=None, max_retries=3, retry_delay=1.0,
+                      progress_interval=PROGRESS_INTERVAL, checkpoint_interval=CHECKPOINT_INTERVAL, local=True,
+                      client=None):
+    """
+    Returns the distance matrix and the time matrix (NaN for unreachable pairs) of the coordinates.
+    checkpoint_directory: directory of the partial matrices to resume from (see MatrixCheckpoint), the returned matrices
+        are then read-only memory maps of the files in it. Without it the build is kept in memory.
+    max_workers: maximum number of tile requests in flight
+    max_requests_per_second: maximum number of tile requests started per second (None for no limit)
+    max_retries: rounds in which the failed tiles are fetched again (waiting retry_delay * 2^round seconds), after
+        that an OSRMError is raised; the finished tiles stay in the checkpoint
+    progress_interval: seconds between the progress lines (None for no progress)
+    checkpoint_interval: seconds between writes of the checkpoint
+    """
+    client = client or get_client(local)
+    n = len(coordinate_list)
+    nb_tiles = len(get_table_tiles(n, tile_size))
+    matrices = None
+    if checkpoint_directory is not None:
+        matrices = MatrixCheckpoint(checkpoint_directory, coordinate_list, tile_size, base_url=client.base_url,
+                                    profile=client.profile)
+        nb_resumed = int(matrices.tiles_done.sum())
+        if nb_resumed:
+            print(f"resuming the matrix build: {nb_resumed} of {nb_tiles} tiles were already fetched")
+    else:
+        nb_resumed = 0
+
+    start_time = time.monotonic()
+    progress = {'pairs': 0, 'last_progress': start_time, 'last_checkpoint': start_time}
+
+    def on_tile(tile_matrices, nb_pairs):
+        progress['pairs'] += nb_pairs
+        count('matrix.osrm_build.tiles')
+        now = time.monotonic()
+        if matrices is not None and now - progress['last_checkpoint'] >= checkpoint_interval:
+            matrices.flush()
+            progress['last_checkpoint'] = now
+        if progress_interval is not None and now - progress['last_progress'] >= progress_interval:
+            _print_progress(tile_matrices.tiles_done, nb_resumed, progress['pairs'], now - start_time, n)
+            progress['last_progress'] = now
+
+    try:
+        distances, durations = osrm_get_matrix_tiled(
+            coordinate_list, tile_size=tile_size, max_retries=max_retries, retry_delay=retry_delay, client=client,
+            max_workers=max_workers, before_request=RateLimiter(max_requests_per_second).wait, matrices=matrices,
+            on_tile=on_tile)
+    except OSRMError as e:
+        if checkpoint_directory is None:
+            raise
+        raise OSRMError(f"{e}, the other tiles are kept in {checkpoint_directory}") from e
+    finally:
+        if matrices is not None:
+            matrices.flush()
+
+    if progress_interval is not None:
+        _print_progress(np.ones(nb_tiles, dtype=bool), nb_resumed, progress['pairs'], time.monotonic() - start_time, n)
+    if checkpoint_directory is None:
+        return distances, durations
+    return (np.load(os.path.join(checkpoint_directory, 'distances.npy'), mmap_mode='r'),
+            np.load(os.path.join(checkpoint_directory, 'durations.npy'), mmap_mode='r'))
+
+
+def _print_progress(tiles_done, nb_resumed, nb_pairs, seconds, n):
+    nb_done = int(tiles_done.sum())
+    pairs_per_second = nb_pairs / seconds if seconds > 0 else 0
+    # Estimated from the pairs per tile of a full matrix, the last tiles of a row or column are smaller
+    pairs_left = (len(tiles_done) - nb_done) * n * n / len(tiles_done)
+    time_left = _format_seconds(pairs_left / pairs_per_second) if pairs_per_second else '?'
+    print(f"matrix build: {nb_done}/{len(tiles_done)} tiles ({100 * nb_done / len(tiles_done):.1f}%, "
+          f"{nb_resumed} resumed), {pairs_per_second:.0f} pairs/s, {time_left} left")
@@ -0,0 +1,87 @@
+"""
+Functions to score the solutions of a routing problem against distance matrices.
+
+All the routes of all the solutions are flattened into one array of consecutive (from, to) index pairs, so scoring every
+solution on a matrix is one array lookup and one bincount instead of a Python loop per edge.
+"""
+import numpy as np
+import pandas as pd
+from DistanceMatrix import DistanceMatrix
+
+ROUTE_METRICS_HEADER = ['Routing Problem', 'Solution', 'Route', 'Metric', 'Total']
+
+
+class RouteIndex:
+
+    """The (from, to) index pairs of a set of routes, built once and reused for every matrix."""
+
+    def __init__(self, solutions):
+        """solutions is a dict solution_name -> {route_name: [indices in visiting order]}"""
+        self.solution_names = []
+        self.route_names = []
+        from_indices = []
+        to_indices = []
+        route_ids = []
+        for solution_name, solution in solutions.items():
+            for route_name, indices in solution.items():
+                indices = np.asarray(indices, dtype=np.int64)
+                route_id = len(self.route_names)
+                self.solution_names.append(solution_name)
+                self.route_names.append(route_name)
+                if len(indices) > 1:
+                    from_indices.append(indices[:-1])
+                    to_indices.append(indices[1:])
+                    route_ids.append(np.full(len(indices) - 1, route_id, dtype=np.int64))
+        self.from_indices = np.concatenate(from_indices) if from_indices else np.empty(0, dtype=np.int64)
+        self.to_indices = np.concatenate(to_indices) if to_indices else np.empty(0, dtype=np.int64)
+        self.route_ids = np.concatenate(route_ids) if route_ids else np.empty(0, dtype=np.int64)
+
+    def get_route_totals(self, matrix):
+        """Returns the total of every route on the matrix (in the order of route_names)."""
+        if isinstance(matrix, DistanceMatrix):
+            # Looked up in the stored array, a condensed matrix is not expanded
+            edge_values = matrix.take(self.from_indices, self.to_indices)
+        else:
+            edge_values = np.asarray(matrix, dtype=np.float64)[self.from_indices, self.to_indices]
+        return np.bincount(self.route_ids, weights=edge_values, minlength=len(self.route_names))
+
+
+def get_route_metrics(problem_name, solutions, matrices):
+    """
+    Returns a tidy DataFrame with the total of every route of every solution on every matrix.
+    matrices is a dict matrix_name -> matrix (DistanceMatrix, nested lists or array, None entries count as NaN).
+    """
+    route_index = RouteIndex(solutions)
+    frames = []
+    for matrix_name, matrix in matrices.items():
+        frames.append(pd.DataFrame({
+            'Routing Problem': problem_name,
+            'Solution': route_index.solution_names,
+            'Route': route_index.route_names,
+            'Metric': matrix_name,
+            'Total': route_index.get_route_totals(matrix),
+        }, columns=ROUTE_METRICS_HEADER))
+    if not frames:
+        return pd.DataFrame(columns=ROUTE_METRICS_HEADER)
+    return pd.concat(frames, ignore_index=True)
+
+
+def get_solution_metrics(route_metrics, original_solution_name=None):
+    """
+    Sums the route metrics per solution and metric and adds the improvement relative to the original solution, whose
+    total is computed once per metric. Returns the columns of RoutingProblem.get_metrics.
+    """
+    keys = ['Routing Problem', 'Solution', 'Metric']
+    totals = route_metrics.groupby(keys, sort=False, as_index=False)['Total'].sum()
+    # A solution with a route without total (e.g. an OSRM route that could not be fetched) has no total either
+    unknown = route_metrics['Total'].isna().groupby([route_metrics[key] for key in keys], sort=False).any()
+    totals.loc[unknown.to_numpy(), 'Total'] = np.nan
+    if original_solution_name is not None:
+        original_totals = totals[totals['Solution'] == original_solution_name].set_index('Metric')['Total']
+        original_total = totals['Metric'].map(original_totals)
+        totals['Improvment'] = (original_total - totals['Total']) / original_total
+    else:
+        totals['Improvment'] = 0.0
+    # One block of rows per solution, in the order of the solutions
+    solution_order = pd.factorize(totals['Solution'])[0]
+    return totals.iloc[np.argsort(solution_order, kind='stable')].reset_index(drop=True)
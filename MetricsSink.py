@@ -0,0 +1,134 @@
+"""
+Streams the metrics of many routing problems to disk instead of concatenating them in memory.
+
+The metrics DataFrames (RoutingProblem.get_metrics) are buffered and appended to the output in batches, so memory only
+holds the last batch no matter how many routes are processed:
+- CSV: rows are appended to one file (';' separated, like the metrics files of TSPTests.py and VRPTests.py),
+- Parquet: every batch is a new part file in a directory, read back as one dataset with pandas.read_parquet
+  (needs pyarrow, imported on the first write).
+
+A batch only holds complete problems. When a run crashes, the problems that were written stay written and
+is_done(problem_name) tells which ones can be skipped by the next run:
+
+    with MetricsSink('solution_metrics.csv') as sink:
+        for problem_name in problem_names:
+            if sink.is_done(problem_name):
+                continue
+            ...
+            sink.write(routing_problem.get_metrics(original_solution_name='ORIGINAL'))
+"""
+import os
+import pandas as pd
+
+
+class MetricsSink:
+
+    def __init__(self, path, file_format=None, batch_size=10, key_column='Routing Problem', sep=';'):
+        """
+        path: the CSV file or the Parquet directory
+        file_format: 'csv' or 'parquet', default from the extension of path ('.parquet' for Parquet, otherwise CSV)
+        batch_size: number of problems buffered before they are appended
+        key_column: column that names the problem of a row, used to resume
+        """
+        self.path = path
+        self.file_format = file_format or ('parquet' if path.endswith('.parquet') else 'csv')
+        if self.file_format not in ('csv', 'parquet'):
+            raise ValueError(f"unknown metrics file format {self.file_format}, use 'csv' or 'parquet'")
+        self.batch_size = batch_size
+        self.key_column = key_column
+        self.sep = sep
+        self._buffer = []
+        self._nb_parts = 0
+        self.done = self._read_done()
+
+    def _read_done(self):
+        """The problems already in the output, only the key column is read."""
+        if self.file_format == 'csv':
+            if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+                return set()
+            self._drop_partial_line()
+            keys = pd.read_csv(self.path, sep=self.sep, usecols=[self.key_column])[self.key_column]
+            return set(keys.astype(str))
+        if not os.path.isdir(self.path):
+            return set()
+        parts = sorted(name for name in os.listdir(self.path) if name.endswith('.parquet'))
+        self._nb_parts = len(parts)
+        if not parts:
+            return set()
+        keys = pd.read_parquet(self.path, columns=[self.key_column])[self.key_column]
+        return set(keys.astype(str))
+
+    def _drop_partial_line(self):
+        """Cuts a last line that was only partly written (a crash during an append)."""
+        with open(self.path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(size - 1, 0))
+            if f.read(1) == b'\n':
+                return
+            # Look back for the last complete line
+            position = size
+            while position > 0:
+                step = min(65536, position)
+                position -= step
+                f.seek(position)
+                chunk = f.read(step)
+                newline = chunk.rfind(b'\n')
+                if newline >= 0:
+                    f.truncate(position + newline + 1)
+                    return
+            f.truncate(0)
+
+    def is_done(self, problem_name):
+        """True if the metrics of the problem were written (in this run or an earlier one)."""
+        return str(problem_name) in self.done
+
+    def write(self, metrics_df):
+        """Buffers the metrics of one problem, appends the buffer once it holds batch_size problems."""
+        self._buffer.append(metrics_df)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Appends the buffered metrics to the output."""
+        if not self._buffer:
+            return
+        batch = pd.concat(self._buffer, ignore_index=True)
+        if self.file_format == 'csv':
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            write_header = not os.path.isfile(self.path) or os.path.getsize(self.path) == 0
+            # One write per batch, a crash does not leave half a problem behind
+            with open(self.path, 'a', newline='') as f:
+                f.write(batch.to_csv(sep=self.sep, index=False, header=write_header))
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            part_name = f"part-{self._nb_parts:05d}.parquet"
+            # Written under a hidden temporary name first (ignored by read_parquet), so a crash leaves no broken part
+            temporary_path = os.path.join(self.path, '.' + part_name + '.tmp')
+            batch.to_parquet(temporary_path, index=False)
+            os.replace(temporary_path, os.path.join(self.path, part_name))
+            self._nb_parts += 1
+        self.done.update(batch[self.key_column].astype(str))
+        self._buffer = []
+
+    def read(self):
+        """Reads all the written metrics back as one DataFrame (None when nothing was written)."""
+        self.flush()
+        if self.file_format == 'csv':
+            if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+                return None
+            return pd.read_csv(self.path, sep=self.sep)
+        if not self._nb_parts:
+            return None
+        return pd.read_parquet(self.path)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
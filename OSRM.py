@@ -1,56 +1,316 @@
-import requests
-import polyline
-from Distances import get_straight_line_distance
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+import numpy as np
+from Distances import get_straight_line_distance, get_straight_line_distance_array, get_straight_line_distance_pairs
+from DistanceMatrix import SparseDistanceMatrix
+from OSRMClient import OSRMError, get_client
+from SpatialIndex import SpatialIndex
+from Instrumentation import timed, count
+from RouteGeometry import RouteGeometry
 
-def osrm_get_route(coordinate_list, local=True):
+# Largest table the OSRM server answers in one request (the --max-table-size default of osrm-routed)
+MAX_TABLE_SIZE = 100
+DEFAULT_TILE_SIZE = 50
 
-    if local:
-        url = "http://127.0.0.1:5000/"
-    else:
-        url = "http://router.project-osrm.org/"
-    endpoint = url + "route/v1/car/"
-
-        # Convert list of points to a semicolon-separated string
-    points_str = ";".join([f"{point[1]},{point[0]}" for point in coordinate_list])
-    request = f"{endpoint}{points_str}?overview=full&steps=true"
-    response = requests.get(request)
-    if response.status_code == 200:
-        legs = response.json()['routes'][0]['legs']
-        distance = response.json()['routes'][0]['distance']
-        segmented_route = []
-        for leg in legs:
-            leg_geometry = []
-            for step in leg['steps']:
-                leg_geometry += polyline.decode(step['geometry'])
-            segmented_route.append(leg_geometry)
-        return segmented_route, distance
-    else:
-        print('OSRM request failed')
-        exit()    
 
-def osrm_get_matrix(coordinate_list, local=True, curb=True):
+def osrm_get_route(coordinate_list, local=True, client=None, road_network=None):
     """
-    Returns the distance matrix and the time matrix
+    Returns the route geometry per leg (a RouteGeometry, its legs are (latitude, longitude) arrays per pair of
+    consecutive stops) and the total distance of the route that visits the coordinates in the given order.
+    road_network: RoadNetwork that computes the route offline when the OSRM server cannot be reached
+    Raises an OSRMError when the route could not be fetched (and there is no road network).
     """
-    if local:
-        url = "http://127.0.0.1:5000/"
-    else:
-        url = "http://router.project-osrm.org/"
-    endpoint = url + "table/v1/car/"
-
-    # Convert list of points to a semicolon-separated string
-    coordinates = ";".join([f"{point[1]},{point[0]}" for point in coordinate_list])+"?annotations=duration,distance"
-    if curb:
-        coordinates = coordinates
-    #print(len(coordinate_list))
-    # Build the request url
-    request = f"{endpoint}{coordinates}"
-    #print(request)
-    response = requests.get(request)
-    if response.status_code == 200:
-        distance_matrix = response.json()['distances']
-        time_matrix = response.json()['durations']
-        return distance_matrix, time_matrix
+    client = client or get_client(local)
+    try:
+        response_json = client.route(coordinate_list, overview='full', steps=True)
+    except OSRMError as e:
+        if road_network is None:
+            raise
+        print(e)
+        print("using the offline road network")
+        return road_network.get_route(coordinate_list)
+    legs = response_json['routes'][0]['legs']
+    distance = response_json['routes'][0]['distance']
+    leg_steps = [[step['geometry'] for step in leg['steps']] for leg in legs]
+    return RouteGeometry.from_step_polylines(leg_steps, distance), distance
+
+@timed('matrix.osrm')
+def osrm_get_matrix(coordinate_list, local=True, curb=True, tile_size=None, max_retries=3, client=None,
+                    road_network=None):
+    """
+    Returns the distance matrix and the time matrix as float NumPy arrays, NaN for unreachable pairs.
+
+    Large coordinate lists do not fit in one table request (URL length and the max-table-size of the server, 100 by
+    default), they are fetched in tiles instead (see osrm_get_matrix_tiled). This happens when tile_size is given or when
+    there are more than MAX_TABLE_SIZE coordinates.
+    road_network: RoadNetwork that computes the matrices offline when the OSRM server cannot be reached
+    Raises an OSRMError when the matrices could not be fetched (and there is no road network), for one request and
+    for tiles alike.
+    """
+    client = client or get_client(local)
+    tiled = tile_size is not None or len(coordinate_list) > MAX_TABLE_SIZE
+    try:
+        if tiled:
+            return osrm_get_matrix_tiled(coordinate_list, tile_size=tile_size or DEFAULT_TILE_SIZE,
+                                         max_retries=max_retries, client=client)
+        response_json = client.table(coordinate_list, annotations=('duration', 'distance'))
+    except OSRMError as e:
+        if road_network is None:
+            raise
+        print(e)
+        print("using the offline road network")
+        return road_network.get_matrix(coordinate_list)
+    # Unreachable pairs are null in the response, they become NaN like in the tiled matrices
+    return (np.array(response_json['distances'], dtype=np.float64),
+            np.array(response_json['durations'], dtype=np.float64))
+
+
+def fetch_table_tile(coordinate_list, sources, destinations, client):
+    """
+    Fetches the block sources x destinations of the distance and time matrix with the sources/destinations parameters
+    of the OSRM table service. Only the coordinates of the tile are sent, so the request stays small.
+    """
+    if sources == destinations:
+        tile_indices = list(sources)
+        source_positions = destination_positions = range(len(sources))
     else:
-        return None, None
-    
\ No newline at end of file
+        tile_indices = list(sources) + list(destinations)
+        source_positions = range(len(sources))
+        destination_positions = range(len(sources), len(tile_indices))
+    tile_coordinates = [coordinate_list[index] for index in tile_indices]
+    response_json = client.table(tile_coordinates, sources=source_positions, destinations=destination_positions,
+                                 annotations=('duration', 'distance'))
+    # Unreachable pairs are null in the response, they become NaN
+    distances = np.array(response_json['distances'], dtype=np.float64)
+    durations = np.array(response_json['durations'], dtype=np.float64)
+    return distances, durations
+
+
+class _TileMatrices:
+
+    """The matrices of a tiled fetch kept in memory, NaN until their tile is fetched."""
+
+    def __init__(self, n, nb_tiles):
+        self.distances = np.full((n, n), np.nan)
+        self.durations = np.full((n, n), np.nan)
+        self.tiles_done = np.zeros(nb_tiles, dtype=bool)
+
+
+def get_table_tiles(n, tile_size=DEFAULT_TILE_SIZE):
+    """The (sources, destinations) tiles of an n x n matrix, row by row."""
+    blocks = [list(range(start, min(start + tile_size, n))) for start in range(0, n, tile_size)]
+    return [(sources, destinations) for sources in blocks for destinations in blocks]
+
+
+def osrm_get_matrix_tiled(coordinate_list, tile_size=DEFAULT_TILE_SIZE, local=True, max_retries=3, retry_delay=1.0,
+                          client=None, max_workers=None, before_request=None, matrices=None, on_tile=None):
+    """
+    Returns the distance matrix and the time matrix (NumPy arrays, NaN for unreachable pairs) of a large coordinate list.
+
+    The N x N matrix is split in blocks of tile_size sources x tile_size destinations (see get_table_tiles) that are
+    fetched concurrently on the OSRM client and written into preallocated arrays. A tile that fails is retried on its own
+    (up to max_retries times, waiting retry_delay * 2^attempt seconds in between) without fetching the other tiles
+    again. An OSRMError is raised when some tiles still failed after the retries.
+
+    Hooks of long builds (see MatrixBuilder.build_osrm_matrix):
+    max_workers: maximum number of tile requests in flight (default the number of workers of the client)
+    before_request: called before every tile request, e.g. RateLimiter.wait
+    matrices: the arrays to fill instead of new ones, an object with distances and durations (N x N, e.g. memory maps)
+        and tiles_done (a flag per tile of get_table_tiles); the tiles that are flagged already are not fetched
+    on_tile: called with matrices and the number of pairs of the tile after every fetched tile (progress, checkpoints)
+    """
+    client = client or get_client(local)
+    max_workers = max_workers or client.max_workers
+    n = len(coordinate_list)
+    tiles = get_table_tiles(n, tile_size)
+    if matrices is None:
+        matrices = _TileMatrices(n, len(tiles))
+
+    def fetch_tile(tile_index):
+        if before_request is not None:
+            before_request()
+        sources, destinations = tiles[tile_index]
+        return fetch_table_tile(coordinate_list, sources, destinations, client)
+
+    pending_tiles = [tile_index for tile_index in range(len(tiles)) if not matrices.tiles_done[tile_index]]
+    for attempt in range(max_retries + 1):
+        failed_tiles = []
+        queue = iter(pending_tiles)
+        running = {}
+        while True:
+            # At most max_workers tiles are submitted at a time, an interrupt does not wait for a long queue
+            while len(running) < max_workers:
+                tile_index = next(queue, None)
+                if tile_index is None:
+                    break
+                running[client.submit(fetch_tile, tile_index)] = tile_index
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                tile_index = running.pop(future)
+                try:
+                    distances, durations = future.result()
+                except Exception as e:
+                    print(f"OSRM tile request failed: {e}")
+                    count('osrm.tile_failures')
+                    failed_tiles.append(tile_index)
+                    continue
+                sources, destinations = tiles[tile_index]
+                rows = slice(sources[0], sources[-1] + 1)
+                columns = slice(destinations[0], destinations[-1] + 1)
+                matrices.distances[rows, columns] = distances
+                matrices.durations[rows, columns] = durations
+                matrices.tiles_done[tile_index] = True
+                if on_tile is not None:
+                    on_tile(matrices, len(sources) * len(destinations))
+        if not failed_tiles:
+            return matrices.distances, matrices.durations
+        pending_tiles = failed_tiles
+        if attempt < max_retries:
+            time.sleep(retry_delay * 2 ** attempt)
+
+    raise OSRMError(f"{len(pending_tiles)} of {len(tiles)} OSRM table tiles failed after {max_retries} retries")
+
+
+@timed('matrix.osrm_rows_and_columns')
+def osrm_get_rows_and_columns(coordinate_list, indices, tile_size=DEFAULT_TILE_SIZE, local=True, client=None):
+    """
+    Fetches only the rows and the columns of the stops indices of the distance and time matrix of coordinate_list,
+    e.g. for stops that were just added to a problem: O(len(indices) * N) pairs instead of N x N.
+    Returns (row_distances, row_durations, column_distances, column_durations) as NumPy arrays (NaN for unreachable
+    pairs), the rows are len(indices) x N and the columns N x len(indices).
+    Raises an OSRMError when a tile could not be fetched.
+    """
+    client = client or get_client(local)
+    n = len(coordinate_list)
+    indices = list(indices)
+    k = len(indices)
+    row_distances = np.empty((k, n))
+    row_durations = np.empty((k, n))
+    column_distances = np.empty((n, k))
+    column_durations = np.empty((n, k))
+    index_blocks = [(start, indices[start:start + tile_size]) for start in range(0, k, tile_size)]
+    all_blocks = [list(range(start, min(start + tile_size, n))) for start in range(0, n, tile_size)]
+    row_tiles = [(start, sources, destinations) for start, sources in index_blocks for destinations in all_blocks]
+    column_tiles = [(start, sources, destinations) for start, destinations in index_blocks for sources in all_blocks]
+    row_results = client.batch(fetch_table_tile, [(coordinate_list, sources, destinations, client)
+                                                   for _, sources, destinations in row_tiles])
+    column_results = client.batch(fetch_table_tile, [(coordinate_list, sources, destinations, client)
+                                                      for _, sources, destinations in column_tiles])
+    for (start, sources, destinations), (distances, durations) in zip(row_tiles, row_results):
+        rows = slice(start, start + len(sources))
+        columns = slice(destinations[0], destinations[-1] + 1)
+        row_distances[rows, columns] = distances
+        row_durations[rows, columns] = durations
+    for (start, sources, destinations), (distances, durations) in zip(column_tiles, column_results):
+        rows = slice(sources[0], sources[-1] + 1)
+        columns = slice(start, start + len(destinations))
+        column_distances[rows, columns] = distances
+        column_durations[rows, columns] = durations
+    return row_distances, row_durations, column_distances, column_durations
+
+
+@timed('matrix.osrm_sparse')
+def osrm_get_sparse_matrix(coordinate_list, k=20, local=True, client=None):
+    """
+    Fetches the real distances and times of every stop to its k nearest stops only (found with a SpatialIndex), so the
+    number of fetched pairs and the memory grow linearly with the number of stops.
+    The stops are fetched in groups of spatially close sources (consecutive in the grid order of the index) with the
+    union of their neighbors as destinations, which keeps the number of requests about N / DEFAULT_TILE_SIZE.
+    Returns (neighbors, distances, durations), N x k arrays: neighbors[i] are the indices of the k nearest stops of i and
+    distances[i]/durations[i] the OSRM values from i to them (NaN for unreachable pairs).
+    See densify_sparse_matrix to turn them into a full matrix.
+    """
+    client = client or get_client(local)
+    index = SpatialIndex(coordinate_list)
+    neighbors = index.k_nearest_neighbors(k)
+    n, k = neighbors.shape
+    distances = np.full((n, k), np.nan)
+    durations = np.full((n, k), np.nan)
+    # Sources that are close in space have overlapping neighbors, group them in the grid order of the index
+    source_groups = []
+    for start in range(0, n, max(DEFAULT_TILE_SIZE // 2, 1)):
+        sources = sorted(index.order[start:start + max(DEFAULT_TILE_SIZE // 2, 1)].tolist())
+        destinations = sorted(set(neighbors[sources].ravel().tolist()))
+        for destination_start in range(0, len(destinations), DEFAULT_TILE_SIZE):
+            source_groups.append((sources, destinations[destination_start:destination_start + DEFAULT_TILE_SIZE]))
+    results = client.batch(fetch_table_tile, [(coordinate_list, sources, destinations, client)
+                                               for sources, destinations in source_groups])
+    for (sources, destinations), (tile_distances, tile_durations) in zip(source_groups, results):
+        destination_position = {destination: position for position, destination in enumerate(destinations)}
+        for row, source in enumerate(sources):
+            for column, neighbor in enumerate(neighbors[source]):
+                position = destination_position.get(neighbor)
+                if position is not None:
+                    distances[source, column] = tile_distances[row, position]
+                    durations[source, column] = tile_durations[row, position]
+    return neighbors, distances, durations
+
+
+def _get_detour_factor(coordinate_list, rows, columns, values):
+    """Median ratio of the known values of the pairs (rows, columns) to their straight-line distance, 1 without any."""
+    coordinates = np.asarray(coordinate_list, dtype=np.float64)
+    straight_line = get_straight_line_distance_pairs(coordinates[rows], coordinates[columns])
+    known = np.isfinite(values) & (straight_line > 0)
+    return float(np.median(values[known] / straight_line[known])) if known.any() else 1.0
+
+
+def get_sparse_distance_matrix(coordinate_list, neighbors, values, depot=0, detour_factor=None, units='m'):
+    """
+    Keeps the sparse form of osrm_get_sparse_matrix up to the solver: returns a SparseDistanceMatrix with only the arcs
+    a solver restricted to the neighbor lists uses (see Solvers.restrict_to_neighbors), O(N * k) pairs:
+    - the arcs from every stop to its neighbors and back (the neighbor lists are made symmetric by the solver),
+    - the arcs from the depot to every stop and back.
+    The known values are used as they are, the other arcs get the estimate of densify_sparse_matrix (straight-line
+    distance times the detour factor), computed for those pairs only. Pairs outside these arcs are estimated when they
+    are asked for (with the cheaper haversine distance, e.g. when a solver has to leave the neighbor arcs), they are not
+    stored.
+    """
+    n, k = neighbors.shape
+    known_rows = np.repeat(np.arange(n), k)
+    known_columns = neighbors.ravel().astype(np.int64)
+    known_values = np.asarray(values, dtype=np.float64).ravel()
+    valid = (known_columns >= 0) & (known_columns != known_rows)
+    known_rows, known_columns, known_values = known_rows[valid], known_columns[valid], known_values[valid]
+    if detour_factor is None:
+        detour_factor = _get_detour_factor(coordinate_list, known_rows, known_columns, known_values)
+
+    stops = np.arange(n)
+    stops = stops[stops != depot]
+    rows = np.concatenate([known_rows, known_columns, np.full(len(stops), depot), stops])
+    columns = np.concatenate([known_columns, known_rows, stops, np.full(len(stops), depot)])
+    values = np.concatenate([known_values, np.full(len(rows) - len(known_values), np.nan)])
+    # A pair that is known in one place and estimated in another keeps the known value
+    order = np.argsort(np.isnan(values), kind='stable')
+    coordinates = np.asarray(coordinate_list, dtype=np.float64)
+
+    def estimate(from_stops, to_stops):
+        # Haversine is precise enough for an estimate and a lot cheaper for the single arcs a solver asks for
+        return detour_factor * get_straight_line_distance_pairs(coordinates[from_stops], coordinates[to_stops],
+                                                                method='haversine')
+
+    matrix = SparseDistanceMatrix(n, rows[order], columns[order], values[order], units=units, estimate=estimate)
+    estimated = np.isnan(matrix.values)
+    matrix.values[estimated] = estimate(*np.divmod(matrix.keys[estimated], n))
+    return matrix
+
+
+def densify_sparse_matrix(coordinate_list, neighbors, values, detour_factor=None):
+    """
+    Builds a full matrix from the values to the k nearest neighbors (see osrm_get_sparse_matrix). The other pairs get a
+    cheap estimate: the straight-line distance times a detour factor, by default the median ratio of the known values to
+    their straight-line distance (so it also works for times: seconds per straight-line meter).
+    This is the dense step of the sparse pipeline: the straight-line matrix and the result are N x N. To stay linear in
+    the number of stops, give get_sparse_distance_matrix (only the arcs the solver uses) to the solvers instead.
+    """
+    straight_line = get_straight_line_distance_array(coordinate_list)
+    rows = np.repeat(np.arange(len(neighbors)), neighbors.shape[1])
+    columns = neighbors.ravel()
+    known_values = np.asarray(values, dtype=np.float64).ravel()
+    if detour_factor is None:
+        detour_factor = _get_detour_factor(coordinate_list, rows, columns, known_values)
+    matrix = straight_line * detour_factor
+    known = np.isfinite(known_values)
+    matrix[rows[known], columns[known]] = known_values[known]
+    return matrix
@@ -0,0 +1,173 @@
+"""
+Persistent on-disk cache for OSRM responses.
+
+Responses of the route and table services are stored in a SQLite file, keyed by the service, the profile, the coordinates
+(rounded to a fixed number of decimals) and the request options (annotations, overview, ...). Re-running a routing problem
+with the same stops then becomes a local lookup instead of an HTTP round-trip.
+
+- The cache is bounded in size: when it grows over max_bytes the least recently used entries are evicted.
+- Entries can optionally expire after ttl seconds (e.g. after an update of the road network on the OSRM server).
+- The hit and miss counters are available through stats().
+- Several processes (e.g. the workers of BatchRunner.py) can share the file: it is in WAL mode, so readers do not wait
+  for a writer, and a writer waits up to busy_timeout seconds for another one.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_CACHE_PATH = './cache/osrm_cache.sqlite'
+
+
+class OSRMCache:
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=512 * 1024 * 1024, ttl=None, precision=6, busy_timeout=30):
+        """
+        path: SQLite file of the cache (':memory:' for a cache that only lives in this process)
+        max_bytes: maximum total size of the stored (compressed) responses
+        ttl: number of seconds an entry stays valid, None to keep entries until they are evicted
+        precision: number of decimals the coordinates are rounded to in the key (6 decimals is about 0.1 m)
+        busy_timeout: seconds a request waits for the lock of another process before sqlite3.OperationalError
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        if path != ':memory:':
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+
+    def make_key(self, service, profile, coordinate_list, annotations=(), options=None):
+        """
+        Builds the cache key of a request.
+        coordinate_list is a list of (latitude, longitude), annotations an iterable of annotation names (order does not
+        matter) and options a dict with any other request parameter that changes the response.
+        """
+        coordinates = [[round(float(latitude), self.precision), round(float(longitude), self.precision)]
+                       for latitude, longitude in coordinate_list]
+        description = json.dumps({
+            'service': service,
+            'profile': profile,
+            'coordinates': coordinates,
+            'annotations': sorted(annotations),
+            'options': options or {},
+        }, sort_keys=True)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached response for the key or None when it is not cached (or expired)."""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                with self._connection:
+                    self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            with self._connection:
+                self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def set(self, key, response):
+        """Stores a (JSON serializable) response and evicts the least recently used entries if the cache is too large."""
+        value = zlib.compress(json.dumps(response).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now, now)
+                )
+            self._evict()
+
+    def _evict(self):
+        total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        # Evict down to 90% of the limit so we do not evict on every insert once the cache is full
+        target_size = 0.9 * self.max_bytes
+        evicted_keys = []
+        for key, size in self._connection.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if total_size <= target_size:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        with self._connection:
+            self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        self.evictions += len(evicted_keys)
+
+    def purge_expired(self):
+        """Removes all the expired entries, returns the number of removed entries."""
+        if self.ttl is None:
+            return 0
+        with self._lock, self._connection:
+            cursor = self._connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def clear(self):
+        """Removes all the entries and resets the counters."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Returns the hit/miss counters and the current size of the cache."""
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': size,
+        }
+
+    def close(self):
+        self._connection.close()
+
+    def __str__(self):
+        return "OSRMCache({path}): {stats}".format(path=self.path, stats=self.stats())
+
+
+_default_cache = None
+_default_cache_disabled = False
+
+
+def get_default_cache():
+    """Returns the cache shared by the OSRM functions (created on first use), or None when caching is disabled."""
+    global _default_cache
+    if _default_cache is None and not _default_cache_disabled:
+        _default_cache = OSRMCache()
+    return _default_cache
+
+
+def set_default_cache(cache):
+    """Replaces the cache shared by the OSRM functions, None disables caching."""
+    global _default_cache, _default_cache_disabled
+    _default_cache = cache
+    _default_cache_disabled = cache is None
+
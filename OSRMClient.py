@@ -0,0 +1,209 @@
+"""
+HTTP client for the OSRM API shared by OSRM.py and Distances.py.
+
+- One requests.Session per server, so connections are pooled and reused instead of opened for every request.
+- Every request has a timeout and is retried with exponential backoff on connection errors, timeouts, 429 and 5xx.
+- Requests can be submitted in batches, they run on a thread pool so the number of concurrent requests is bounded.
+- Responses go through the OSRM cache (see OSRMCache.py). A cache that fails (e.g. locked by another process) is a
+  miss and the response is not stored, the request itself does not fail.
+
+The server is given as a base url, so the client can be pointed to a local stand-in HTTP server as well.
+"""
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from OSRMCache import get_default_cache
+from Instrumentation import span, count
+
+LOCAL_OSRM_URL = "http://127.0.0.1:5000/"
+REMOTE_OSRM_URL = "http://router.project-osrm.org/"
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class OSRMError(Exception):
+    """Raised when the OSRM server could not answer a request."""
+
+
+def osrm_base_url(local=True):
+    """Returns the url of the local OSRM server (Docker) or the public demo server."""
+    return LOCAL_OSRM_URL if local else REMOTE_OSRM_URL
+
+
+class OSRMClient:
+
+    def __init__(self, base_url=LOCAL_OSRM_URL, profile='car', timeout=30, max_retries=3, backoff=0.5, max_workers=8,
+                 use_cache=True):
+        """
+        base_url: url of the OSRM server, e.g. 'http://127.0.0.1:5000/'
+        profile: default routing profile of the requests
+        timeout: seconds before a request is abandoned (and retried)
+        max_retries: number of retries of a failed request, waiting backoff * 2^attempt seconds before each retry
+        max_workers: maximum number of concurrent requests (size of the thread pool and of the connection pool)
+        use_cache: look up and store the responses in the default OSRM cache
+        """
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.profile = profile
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def build_url(self, service, coordinate_list, params=None, profile=None):
+        """Builds the request url, coordinate_list is a list of (latitude, longitude)."""
+        points_str = ";".join([f"{point[1]},{point[0]}" for point in coordinate_list])
+        url = f"{self.base_url}{service}/v1/{profile or self.profile}/{points_str}"
+        if params:
+            url += "?" + "&".join(f"{key}={_format_param(value)}" for key, value in params.items())
+        return url
+
+    def get(self, service, coordinate_list, params=None, profile=None, use_cache=None):
+        """
+        Sends a request to an OSRM service ('route', 'table', ...) and returns the JSON response.
+        Raises an OSRMError when the server answers with an error or does not answer after the retries.
+        """
+        params = params or {}
+        profile = profile or self.profile
+        use_cache = self.use_cache if use_cache is None else use_cache
+        cache = get_default_cache() if use_cache else None
+        if cache is not None:
+            options = {key: _format_param(value) for key, value in params.items() if key != 'annotations'}
+            options['server'] = self.base_url
+            annotations = str(params.get('annotations', '')).split(',') if 'annotations' in params else ()
+            cache_key = cache.make_key(service, profile, coordinate_list, annotations, options)
+            try:
+                response_json = cache.get(cache_key)
+            except sqlite3.Error as e:
+                print(f"OSRM cache lookup failed: {e}")
+                count('osrm.cache_errors', service=service)
+                response_json = None
+            if response_json is not None:
+                count('osrm.cache_hits', service=service)
+                return response_json
+
+        try:
+            with span('osrm.request', service=service):
+                response_json = self._get_with_retries(self.build_url(service, coordinate_list, params, profile))
+        except OSRMError:
+            count('osrm.failures', service=service)
+            raise
+        count('osrm.requests', service=service)
+        if cache is not None:
+            try:
+                cache.set(cache_key, response_json)
+            except sqlite3.Error as e:
+                print(f"OSRM cache store failed: {e}")
+                count('osrm.cache_errors', service=service)
+        return response_json
+
+    def _get_with_retries(self, url):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = OSRMError(f"OSRM request failed: {e}")
+            else:
+                count('osrm.bytes', len(response.content))
+                if response.status_code == 200:
+                    try:
+                        response_json = response.json()
+                    except ValueError:
+                        response_json = None
+                    if not isinstance(response_json, dict):
+                        raise OSRMError(f"OSRM request failed: the response is not an OSRM JSON object: "
+                                        f"{response.text[:200]}")
+                    if response_json.get('code') == 'Ok':
+                        return response_json
+                    raise OSRMError(f"OSRM request failed: {response_json.get('code')} {response_json.get('message')}")
+                error = OSRMError(f"OSRM request failed with status {response.status_code}: {response.text[:200]}")
+                if response.status_code not in RETRY_STATUS_CODES:
+                    # The request itself is wrong (e.g. TooBig, NoRoute), retrying will not help
+                    raise error
+            if attempt < self.max_retries:
+                count('osrm.retries')
+                time.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    def route(self, coordinate_list, overview='full', steps=False, profile=None, **params):
+        """Route service: the fastest route that visits the coordinates in the given order."""
+        return self.get('route', coordinate_list, {'overview': overview, 'steps': steps, **params}, profile=profile)
+
+    def table(self, coordinate_list, sources=None, destinations=None, annotations=('duration', 'distance'),
+              profile=None, **params):
+        """Table service: durations and/or distances between the sources and the destinations (default all)."""
+        params = {'annotations': ",".join(annotations), **params}
+        if sources is not None:
+            params['sources'] = sources
+        if destinations is not None:
+            params['destinations'] = destinations
+        return self.get('table', coordinate_list, params, profile=profile)
+
+    def submit(self, method, *args, **kwargs):
+        """Runs a client method (e.g. client.route) on the thread pool of the client, returns a Future."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor.submit(method, *args, **kwargs)
+
+    def batch(self, method, argument_list, return_exceptions=False):
+        """
+        Runs method(*arguments) for every arguments tuple of argument_list concurrently (at most max_workers at a time)
+        and returns the results in the same order. When return_exceptions is True a failed request returns its
+        exception instead of raising it.
+        """
+        futures = [self.submit(method, *arguments) for arguments in argument_list]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.session.close()
+
+
+def _format_param(value):
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (list, tuple, range)):
+        return ";".join(str(item) for item in value)
+    return str(value)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(local=True, base_url=None):
+    """Returns the shared client of the local server, the public server or a given base url."""
+    base_url = base_url or osrm_base_url(local)
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = OSRMClient(base_url)
+        return _clients[base_url]
+
+
+def set_client(client, base_url=None):
+    """
+    Replaces the shared client of base_url (default client.base_url), e.g. with other timeouts, or with a client of a
+    stand-in server for base_url osrm_base_url(local=True) so every local request goes to the stand-in.
+    """
+    with _clients_lock:
+        _clients[base_url or client.base_url] = client
@@ -0,0 +1,178 @@
+"""
+Local stand-in for an OSRM server, for benchmarks and offline runs.
+
+Serves the table and route services on a local port with the response format of OSRM (the parts used in this project).
+The "road" distance of a pair of coordinates is the haversine distance times a detour factor and the duration is that
+distance at a constant speed, so answers are deterministic and need no map data. An optional latency per request and a
+maximum table size (answered with TooBig, like osrm-routed --max-table-size) mimic a real server, and add_failures
+makes the next requests fail (e.g. with a 503 or a page that is not JSON) to test the retries of a client.
+
+Example:
+    with OSRMStandIn() as stand_in:
+        client = OSRMClient(stand_in.url, use_cache=False)
+        distances, durations = osrm_get_matrix(coordinates, client=client)
+"""
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import polyline
+from Distances import get_straight_line_distance_block
+from OSRM import MAX_TABLE_SIZE
+
+
+class OSRMStandIn:
+
+    def __init__(self, host='127.0.0.1', port=0, detour_factor=1.3, speed=30 / 3.6, latency=0.0,
+                 max_table_size=MAX_TABLE_SIZE):
+        """
+        port: port to listen on, 0 for any free port (see url)
+        detour_factor: road distance / straight-line distance of every pair
+        speed: driving speed in m/s used for the durations
+        latency: seconds every request waits before it is answered
+        max_table_size: a table request with more than max_table_size^2 pairs is answered with TooBig, None for no limit
+        """
+        self.detour_factor = detour_factor
+        self.speed = speed
+        self.latency = latency
+        self.max_table_size = max_table_size
+        self.request_count = 0
+        self._failures = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add_failures(self, nb_requests, status=503, body=None):
+        """
+        Answers the next nb_requests requests with status and body instead of the service: body is the response JSON
+        (default an OSRM error) or a str sent as it is (e.g. the HTML page of a proxy).
+        """
+        if body is None:
+            body = {'code': 'ServiceUnavailable', 'message': 'Service temporarily unavailable'}
+        with self._lock:
+            self._failures.extend([(status, body)] * nb_requests)
+
+    def get_distances(self, from_coordinates, to_coordinates):
+        """Road distances (m) from every from coordinate to every to coordinate."""
+        distances = get_straight_line_distance_block(from_coordinates, to_coordinates, method="haversine")
+        return distances * self.detour_factor
+
+    def table(self, coordinate_list, params):
+        sources = _parse_indices(params.get('sources'), len(coordinate_list))
+        destinations = _parse_indices(params.get('destinations'), len(coordinate_list))
+        if self.max_table_size is not None and len(sources) * len(destinations) > self.max_table_size ** 2:
+            return 400, {'code': 'TooBig', 'message': 'Too many table coordinates'}
+        distances = self.get_distances([coordinate_list[source] for source in sources],
+                                       [coordinate_list[destination] for destination in destinations])
+        response_json = {'code': 'Ok'}
+        annotations = params.get('annotations', 'duration').split(',')
+        if 'distance' in annotations:
+            response_json['distances'] = distances.round(1).tolist()
+        if 'duration' in annotations:
+            response_json['durations'] = (distances / self.speed).round(1).tolist()
+        return 200, response_json
+
+    def route(self, coordinate_list, params):
+        if len(coordinate_list) < 2:
+            return 400, {'code': 'InvalidQuery', 'message': 'Query string malformed close to position 0'}
+        legs = []
+        for from_node, to_node in zip(coordinate_list[:-1], coordinate_list[1:]):
+            distance = float(self.get_distances([from_node], [to_node])[0, 0])
+            middle = ((from_node[0] + to_node[0]) / 2, (from_node[1] + to_node[1]) / 2)
+            leg = {'distance': round(distance, 1), 'duration': round(distance / self.speed, 1), 'summary': '',
+                   'weight': round(distance / self.speed, 1)}
+            if params.get('steps') == 'true':
+                # Two steps per leg, the way to the middle and on to the next stop
+                leg['steps'] = [
+                    {'geometry': polyline.encode([from_node, middle]), 'distance': round(distance / 2, 1),
+                     'duration': round(distance / 2 / self.speed, 1), 'mode': 'driving'},
+                    {'geometry': polyline.encode([middle, to_node]), 'distance': round(distance / 2, 1),
+                     'duration': round(distance / 2 / self.speed, 1), 'mode': 'driving'},
+                ]
+            else:
+                leg['steps'] = []
+            legs.append(leg)
+        route = {'distance': round(sum(leg['distance'] for leg in legs), 1),
+                 'duration': round(sum(leg['duration'] for leg in legs), 1), 'legs': legs, 'weight_name': 'routability'}
+        if params.get('overview', 'simplified') != 'false':
+            route['geometry'] = polyline.encode(coordinate_list)
+        waypoints = [{'location': [point[1], point[0]], 'name': ''} for point in coordinate_list]
+        return 200, {'code': 'Ok', 'routes': [route], 'waypoints': waypoints}
+
+    def handle(self, path):
+        """Answers a request path, returns (status code, response JSON or str body)."""
+        with self._lock:
+            self.request_count += 1
+            failure = self._failures.pop(0) if self._failures else None
+        if failure is not None:
+            return failure
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlsplit(path)
+        parts = url.path.strip('/').split('/')
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if len(parts) != 4 or parts[1] != 'v1':
+            return 400, {'code': 'InvalidUrl', 'message': f'URL string malformed: {path}'}
+        try:
+            coordinate_list = [(float(latitude), float(longitude)) for longitude, latitude in
+                               (point.split(',') for point in parts[3].split(';'))]
+        except ValueError:
+            return 400, {'code': 'InvalidQuery', 'message': 'Query string malformed'}
+        if parts[0] == 'table':
+            return self.table(coordinate_list, params)
+        if parts[0] == 'route':
+            return self.route(coordinate_list, params)
+        return 400, {'code': 'InvalidService', 'message': f'Service {parts[0]} not found!'}
+
+
+def _parse_indices(value, n):
+    if value is None or value == 'all':
+        return list(range(n))
+    return [int(index) for index in value.split(';')]
+
+
+def _make_handler(stand_in):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            status, response_json = stand_in.handle(self.path)
+            if isinstance(response_json, str):
+                body, content_type = response_json.encode(), 'text/html; charset=UTF-8'
+            else:
+                body, content_type = json.dumps(response_json).encode(), 'application/json; charset=UTF-8'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
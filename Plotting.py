@@ -0,0 +1,332 @@
+"""
+Map plots of the solutions of a RoutingProblem.
+
+The visualization stack (folium, plotly) is only imported when a plot is made, so importing RoutingProblem for solving
+and scoring (e.g. in the BatchRunner worker processes) does not load it.
+
+plot_folium draws every leg and every stop marker as its own map element with the full OSRM geometry, which makes big
+HTML files for days with many routes. export_folium_map makes a compact map instead: every layer is one GeoJSON
+feature collection, the routes are simplified (Douglas-Peucker, tolerance in meters), the stops are clustered and the
+tolerance is raised until the file fits in max_size. export_folium_maps exports many saved problems in parallel:
+
+    paths = export_folium_maps(['BA_DI_RES1', 'BA_DI_RES2'], tolerance=5, max_size=2 * 2**20)
+"""
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from RouteGeometry import as_coordinate_array
+
+MAPS_DIRECTORY = './maps/'
+COLORS = ['#174EA6', '#A50E0E', '#E37400', '#0D652D', '#34A853', '#4285F4', '#EA4335', '#FBBC04', '#9AA0A6', '#202124']
+DEFAULT_SIMPLIFY_TOLERANCE = 5  # meters
+DEFAULT_MAX_MAP_SIZE = 5 * 2**20  # bytes
+# The tolerance is doubled until the map fits in max_size, but not above this
+MAX_SIMPLIFY_TOLERANCE = 200
+METERS_PER_DEGREE_LATITUDE = 111320.0
+# Marker of a stop in the clustered stop layers (row: latitude, longitude, label)
+STOP_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+                                {radius: 6, color: '#cc7a00', fillColor: '#ff9900', fillOpacity: 1, weight: 1});
+    marker.bindTooltip(row[2]);
+    return marker;
+}
+"""
+
+
+def plot_folium(routing_problem):
+    """Saves the solutions of the routing problem on an interactive folium map in ./maps/map_<name>.html."""
+    import folium
+    import folium.plugins
+    # Create the map
+    colors = COLORS
+    map = folium.Map(location=routing_problem.get_depot(), zoom_start=13, control_scale=True)
+    folium.TileLayer('openstreetmap').add_to(map)
+    folium.TileLayer('CartoDB Positron').add_to(map)
+
+    color_index = 0
+    for solution_name, solution in routing_problem.get_solutions().items():
+        for route_name, index_list in solution.items():
+            
+            # Create a new layer with real route
+            color_index += 1
+            if color_index == len(colors):
+                color_index = 0
+            real_layer = folium.FeatureGroup(name=solution_name+" "+"ON ROAD", show=False).add_to(map)
+            coordinate_list = [routing_problem.get_coordinates()[index] for index in index_list]
+            segmented_route_coordinates, distance = routing_problem.get_route_geometry(index_list)
+            # Add the stops and walking lines
+            for stop_index, segment_coordinates in enumerate(segmented_route_coordinates):
+                folium.PolyLine(locations=segment_coordinates, color=colors[color_index]).add_to(real_layer)
+                """
+                folium.PolyLine(locations=[segment_coordinates[0], coordinate_list[stop_index]], color='#202124').add_to(real_layer)
+                folium.CircleMarker(location=segment_coordinates[0], radius=2, color=colors[color_index], fill_color='white', fill_opacity=1).add_to(real_layer)
+                """
+
+            # Create a new layer with direct route
+            color_index += 1
+            if color_index == len(colors):
+                color_index = 0
+            direct_layer = folium.FeatureGroup(name=solution_name+" "+"DIRECT", show=False).add_to(map)
+            coordinate_list = [routing_problem.get_coordinates()[index] for index in index_list]
+            folium.PolyLine(locations=coordinate_list, color=colors[color_index]).add_to(direct_layer)
+
+            # Create a new layer with markers
+            marker_layer = folium.FeatureGroup(name=solution_name+" "+"MARKERS", show=False).add_to(map)
+            coordinate_list = [routing_problem.get_coordinates()[index] for index in index_list]
+            # Add stops as Markers with the number
+            for index, stop_coordinate in enumerate(coordinate_list):
+                folium.Marker(location=stop_coordinate,
+                              icon=folium.plugins.BeautifyIcon(
+                                icon="arrow-down", 
+                                icon_shape="marker", 
+                                border_color='#cc7a00', 
+                                background_color='#ff9900',
+                                number=str(index))).add_to(marker_layer)
+
+    # Create demo layer
+    index_from = 0
+    index_to = 25
+    current_index = 20
+    solution_name = 'OPTIMAL (REAL)'
+    # The demo layer follows the optimal TSP route, maps of other problems have no demo layer
+    if solution_name in routing_problem.get_solutions():
+        # Create a new layer with real route
+        demo_layer = folium.FeatureGroup(name="DEMO", show=False).add_to(map)
+        index_list = routing_problem.get_solution(solution_name)['TSP_1']
+        segmented_route_coordinates, distance = routing_problem.get_route_geometry(index_list)
+        # Add the stops and walking lines
+        for stop_index, segment_coordinates in enumerate(segmented_route_coordinates):
+            if stop_index <= current_index:
+                folium.PolyLine(locations=segment_coordinates, color='#9AA0A6').add_to(demo_layer)
+                folium.Marker(location=segment_coordinates[-1],
+                                  icon=folium.plugins.BeautifyIcon(
+                                    icon="arrow-down", 
+                                    icon_shape="marker", 
+                                    border_color='#9AA0A6', 
+                                    background_color='#9AA0A6',
+                                    number=str(stop_index))).add_to(demo_layer)
+            elif stop_index <= index_to:
+                folium.PolyLine(locations=segment_coordinates, color=colors[0]).add_to(demo_layer)
+                folium.Marker(location=segment_coordinates[-1],
+                                  icon=folium.plugins.BeautifyIcon(
+                                    icon="arrow-down", 
+                                    icon_shape="marker", 
+                                    border_color=colors[0], 
+                                    background_color=colors[0],
+                                    number=str(stop_index))).add_to(demo_layer)
+
+    # Add layer control and open map
+    folium.LayerControl().add_to(map)
+    map.fit_bounds(map.get_bounds())
+    map_name = './maps/map'+'_'+routing_problem.name+".html"
+    map.save(map_name)
+    #webbrowser.open(map_name, new=2)
+
+
+def plot(routing_problem, real=False):
+    """Shows the solutions of the routing problem on a plotly map, with real the OSRM route geometry."""
+    import plotly.graph_objects as go
+    # Depot
+    fig = go.Figure()
+    
+    # Routes
+    for solution_name, solution in routing_problem.get_solutions().items():
+        for route_name, index_list in solution.items():
+            coordinate_list = [routing_problem.get_coordinates()[index] for index in index_list]
+            if real:
+                segmented_route_coordinates, distance = routing_problem.get_route_geometry(index_list)
+                plot_coordinate_list = segmented_route_coordinates.to_array()
+            else:
+                plot_coordinate_list = coordinate_list
+            latitude, longitude = as_coordinate_array(plot_coordinate_list).T
+            fig.add_trace(go.Scattermapbox(
+                name= solution_name+' '+route_name,
+                mode = 'lines',
+                line=go.scattermapbox.Line(
+                    width=3,
+                    color='rgb(120, 120, 120)',
+                ),
+                lon = longitude,
+                lat = latitude))
+        
+            # Markers
+            latitude, longitude = [list(x) for x in zip(*coordinate_list)]
+            fig.add_trace(go.Scattermapbox(
+                name= solution_name+' '+route_name,
+                mode = 'markers+text',
+                marker=go.scattermapbox.Marker(
+                    size=30,
+                    color='rgb(255, 255, 255)',
+                    opacity=1.0
+                ),
+                text= [i for i in range(len(latitude))],
+                lon = longitude,
+                lat = latitude))
+            fig.add_trace(go.Scattermapbox(
+                name= solution_name+' '+route_name,
+                mode = 'markers+text',
+                marker=go.scattermapbox.Marker(
+                    size=25,
+                    color='rgb(230, 96, 14)',
+                    opacity=1.0
+                ),
+                text= [i for i in range(len(latitude))],
+                lon = longitude,
+                lat = latitude))
+
+            
+
+
+    fig.update_layout(
+        margin ={'l':0,'t':0,'b':0,'r':0},
+        mapbox = {
+            'style': 'open-street-map',
+            #'style': 'carto-positron',
+            'zoom': 10,
+            'center': go.layout.mapbox.Center(lat=routing_problem.get_depot()[0], lon=routing_problem.get_depot()[1])
+            }
+        )
+
+    fig.show()
+
+
+def simplify_line(coordinates, tolerance=DEFAULT_SIMPLIFY_TOLERANCE):
+    """
+    Douglas-Peucker simplification of a line of (latitude, longitude) points: keeps the points that are more than
+    tolerance meters away from the simplified line. Returns an (n, 2) array, the first and last point are always kept.
+    """
+    points = as_coordinate_array(coordinates)
+    if len(points) < 3 or not tolerance or tolerance <= 0:
+        return points
+    # Local equirectangular projection in meters, accurate enough at city scale
+    meters_per_degree_longitude = METERS_PER_DEGREE_LATITUDE * math.cos(math.radians(points[0, 0]))
+    xy = np.column_stack([(points[:, 1] - points[0, 1]) * meters_per_degree_longitude,
+                          (points[:, 0] - points[0, 0]) * METERS_PER_DEGREE_LATITUDE])
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = xy[end] - xy[start]
+        offsets = xy[start + 1:end] - xy[start]
+        segment_length = segment @ segment
+        if segment_length > 0:
+            # Distance to the segment (not the infinite line), a route that returns to its start is a zero segment
+            positions = np.clip(offsets @ segment / segment_length, 0, 1)
+            offsets = offsets - positions[:, None] * segment
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack += [(start, middle), (middle, end)]
+    return points[keep]
+
+
+def _line_feature(coordinates, properties):
+    """GeoJSON LineString feature of (latitude, longitude) points, rounded to 5 decimals (about 1 m)."""
+    points = np.round(as_coordinate_array(coordinates)[:, ::-1], 5)
+    return {'type': 'Feature', 'properties': properties,
+            'geometry': {'type': 'LineString', 'coordinates': points.tolist()}}
+
+
+def _route_style(feature):
+    return {'color': feature['properties']['color'], 'weight': 3, 'opacity': 0.9}
+
+
+def _build_compact_map(routing_problem, tolerance, real=True):
+    import folium
+    import folium.plugins
+    map = folium.Map(location=routing_problem.get_depot(), zoom_start=13, control_scale=True, prefer_canvas=True)
+    folium.TileLayer('CartoDB Positron').add_to(map)
+    coordinates = routing_problem.get_coordinates()
+
+    for solution_name, solution in routing_problem.get_solutions().items():
+        real_features, direct_features, stops = [], [], []
+        for route_index, (route_name, index_list) in enumerate(solution.items()):
+            if len(index_list) < 2:
+                continue
+            properties = {'route': solution_name + ' ' + route_name, 'color': COLORS[route_index % len(COLORS)]}
+            coordinate_list = [coordinates[index] for index in index_list]
+            if real:
+                route_geometry, distance = routing_problem.get_route_geometry(index_list)
+                # A route that could not be fetched has no points
+                if route_geometry.nb_points:
+                    real_features.append(_line_feature(simplify_line(route_geometry.to_array(), tolerance),
+                                                       {**properties, 'distance': round(distance)}))
+            direct_features.append(_line_feature(coordinate_list, properties))
+            # The return to the depot is not a stop of its own
+            nb_stops = len(index_list) - 1 if index_list[0] == index_list[-1] else len(index_list)
+            stops += [[coordinate[0], coordinate[1], route_name + ' ' + str(position)]
+                      for position, coordinate in enumerate(coordinate_list[:nb_stops])]
+
+        tooltip_fields = ['route', 'distance'] if real else ['route']
+        if real_features:
+            folium.GeoJson({'type': 'FeatureCollection', 'features': real_features}, name=solution_name+" ON ROAD",
+                           show=False, style_function=_route_style,
+                           tooltip=folium.GeoJsonTooltip(tooltip_fields)).add_to(map)
+        folium.GeoJson({'type': 'FeatureCollection', 'features': direct_features}, name=solution_name+" DIRECT",
+                       show=False, style_function=_route_style, tooltip=folium.GeoJsonTooltip(['route'])).add_to(map)
+        folium.plugins.FastMarkerCluster(stops, callback=STOP_MARKER_CALLBACK, name=solution_name+" MARKERS",
+                                         show=False).add_to(map)
+
+    folium.LayerControl().add_to(map)
+    map.fit_bounds(map.get_bounds())
+    return map
+
+
+def export_folium_map(routing_problem, path=None, tolerance=DEFAULT_SIMPLIFY_TOLERANCE, max_size=DEFAULT_MAX_MAP_SIZE,
+                      real=True):
+    """
+    Saves a compact folium map of the solutions of the routing problem, by default in ./maps/map_<name>.html.
+    Per solution there is one GeoJSON layer with the OSRM routes (real, simplified with tolerance meters), one with the
+    direct lines between the stops and a clustered stop layer. When the HTML is larger than max_size bytes, the map is
+    made again with a doubled tolerance (up to MAX_SIMPLIFY_TOLERANCE). Returns the path of the map.
+    """
+    path = path or os.path.join(MAPS_DIRECTORY, 'map_' + routing_problem.name + '.html')
+    while True:
+        html = _build_compact_map(routing_problem, tolerance, real).get_root().render()
+        size = len(html.encode('utf-8'))
+        if max_size is None or size <= max_size or not real or tolerance >= MAX_SIMPLIFY_TOLERANCE:
+            break
+        tolerance = min(max(tolerance, 1) * 2, MAX_SIMPLIFY_TOLERANCE)
+    if max_size is not None and size > max_size:
+        print(f"map of {routing_problem.name} is {size} bytes, more than the limit of {max_size} bytes")
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as output_file:
+        output_file.write(html)
+    return path
+
+
+def _export_problem_map(task):
+    """Worker of export_folium_maps: loads the saved routing problem and exports its map."""
+    from RoutingProblem import RoutingProblem
+    problem_name, options = task
+    routing_problem = RoutingProblem(problem_name)
+    routing_problem.load()
+    return export_folium_map(routing_problem, **options)
+
+
+def export_folium_maps(problem_names, max_workers=None, **options):
+    """
+    Exports the compact maps (see export_folium_map for the options) of the saved routing problems problem_names,
+    spread over max_workers processes (default the number of CPUs). Returns {problem name: path}, the path is None when
+    the export of the problem failed.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    paths = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_export_problem_map, (problem_name, options)): problem_name
+                   for problem_name in problem_names}
+        for future in as_completed(futures):
+            problem_name = futures[future]
+            try:
+                paths[problem_name] = future.result()
+            except Exception as e:
+                print(f"map export of {problem_name} failed: {e}")
+                paths[problem_name] = None
+    return paths
@@ -0,0 +1,400 @@
+"""
+Offline road-network routing, an in-process alternative to the OSRM server.
+
+The road network is loaded from a preprocessed edge list (CSV) or from an OSM extract (.osm.pbf, needs the osmium
+package, imported only by from_osm) into a compact CSR graph: for every node the outgoing edges are a contiguous slice
+of the arrays heads / lengths / durations. The graph can be saved as one .npz file and loaded again without parsing.
+
+get_matrix snaps the stops to their nearest graph node (SpatialIndex) and runs one Dijkstra per stop on the travel
+times. Like OSRM the matrices are the durations of the fastest routes and the lengths of those same routes, returned in
+the (distance_matrix, time_matrix) shape of osrm_get_matrix with NaN for unreachable pairs. With scipy installed the
+Dijkstra runs in scipy.sparse.csgraph on the CSR arrays, without it a Python Dijkstra that stops as soon as every stop
+is reached runs in a pool of processes (which get the NumPy arrays of the graph, not Python lists).
+get_route returns the fastest route through the stops in the (RouteGeometry, distance) shape of osrm_get_route.
+
+    network = RoadNetwork.from_edge_list('ghent_edges.csv')
+    network.save('ghent_network.npz')
+    distance_matrix, time_matrix = RoadNetwork.load('ghent_network.npz').get_matrix(coordinate_list)
+"""
+import heapq
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from Distances import MEAN_EARTH_RADIUS
+from Instrumentation import timed
+from RouteGeometry import RouteGeometry
+from SpatialIndex import SpatialIndex
+
+DEFAULT_SPEED = 30  # km/h
+# Speeds (km/h) of the OSM highway types that are driven on, used when a way has no maxspeed
+HIGHWAY_SPEEDS = {
+    'motorway': 100, 'motorway_link': 60, 'trunk': 80, 'trunk_link': 50, 'primary': 60, 'primary_link': 40,
+    'secondary': 50, 'secondary_link': 40, 'tertiary': 40, 'tertiary_link': 30, 'unclassified': 30,
+    'residential': 30, 'living_street': 10, 'service': 15, 'road': 30,
+}
+# Speed (km/h) of the straight line between a stop and the graph node it is snapped to
+SNAP_SPEED = 15
+# Sources per scipy Dijkstra call, the call returns len(sources) x nb_nodes arrays
+SCIPY_CHUNK_SIZE = 64
+
+
+def _haversine(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    """Great-circle distance in meters between the points of two equally long arrays, pair by pair."""
+    latitudes_1, longitudes_1, latitudes_2, longitudes_2 = map(np.radians, (latitudes_1, longitudes_1, latitudes_2,
+                                                                             longitudes_2))
+    h = (np.sin((latitudes_2 - latitudes_1) / 2) ** 2 +
+         np.cos(latitudes_1) * np.cos(latitudes_2) * np.sin((longitudes_2 - longitudes_1) / 2) ** 2)
+    return 2 * MEAN_EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+class RoadNetwork:
+
+    def __init__(self, latitudes, longitudes, offsets, heads, lengths, durations):
+        """
+        CSR graph: the edges out of node u are offsets[u]:offsets[u + 1] of heads (the node the edge goes to), lengths
+        (meters) and durations (seconds). Use from_edges, from_edge_list, from_osm or load to build one.
+        """
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.heads = np.asarray(heads, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.durations = np.asarray(durations, dtype=np.float32)
+        self._index = None
+        self._scipy_graph = None
+
+    @property
+    def nb_nodes(self):
+        return len(self.latitudes)
+
+    @property
+    def nb_edges(self):
+        return len(self.heads)
+
+    @classmethod
+    def from_edges(cls, from_latitudes, from_longitudes, to_latitudes, to_longitudes, lengths=None, speeds=None,
+                   oneway=None, default_speed=DEFAULT_SPEED):
+        """
+        Builds the graph from edge arrays. Nodes are the distinct edge end points (rounded to 7 decimals, about 1 cm).
+        lengths: meters, default the great-circle distance of the end points
+        speeds: km/h, default default_speed
+        oneway: True for an edge that is only driven from -> to, default every edge goes both ways
+        """
+        from_points = np.column_stack([from_latitudes, from_longitudes]).astype(np.float64)
+        to_points = np.column_stack([to_latitudes, to_longitudes]).astype(np.float64)
+        nb_edges = len(from_points)
+        if lengths is None:
+            lengths = _haversine(from_points[:, 0], from_points[:, 1], to_points[:, 0], to_points[:, 1])
+        lengths = np.asarray(lengths, dtype=np.float64)
+        speeds = np.full(nb_edges, float(default_speed)) if speeds is None else np.asarray(speeds, dtype=np.float64)
+        speeds = np.where(np.isfinite(speeds) & (speeds > 0), speeds, default_speed)
+        durations = lengths / (speeds / 3.6)
+        oneway = np.zeros(nb_edges, dtype=bool) if oneway is None else np.asarray(oneway, dtype=bool)
+
+        points, node_ids = np.unique(np.round(np.vstack([from_points, to_points]), 7), axis=0, return_inverse=True)
+        node_ids = node_ids.reshape(-1)
+        tails, heads = node_ids[:nb_edges], node_ids[nb_edges:]
+        both_ways = ~oneway
+        tails, heads = np.concatenate([tails, heads[both_ways]]), np.concatenate([heads, tails[both_ways]])
+        lengths = np.concatenate([lengths, lengths[both_ways]])
+        durations = np.concatenate([durations, durations[both_ways]])
+
+        order = np.argsort(tails, kind='stable')
+        offsets = np.zeros(len(points) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails, minlength=len(points)), out=offsets[1:])
+        return cls(points[:, 0], points[:, 1], offsets, heads[order], lengths[order], durations[order])
+
+    @classmethod
+    def from_edge_list(cls, path, sep=',', default_speed=DEFAULT_SPEED):
+        """
+        Loads an edge list CSV with the columns from_latitude, from_longitude, to_latitude, to_longitude and optionally
+        length (m), speed (km/h) and oneway (1 for a one-way edge).
+        """
+        edges = pd.read_csv(path, sep=sep)
+        return cls.from_edges(edges['from_latitude'].values, edges['from_longitude'].values,
+                              edges['to_latitude'].values, edges['to_longitude'].values,
+                              edges['length'].values if 'length' in edges else None,
+                              edges['speed'].values if 'speed' in edges else None,
+                              edges['oneway'].values if 'oneway' in edges else None, default_speed)
+
+    @classmethod
+    def from_osm(cls, path, highway_speeds=None):
+        """
+        Loads the drivable ways (the highway types of highway_speeds, default HIGHWAY_SPEEDS) of an OSM extract
+        (.osm.pbf or .osm). Needs the osmium package. A maxspeed tag overrides the speed of the highway type and oneway
+        tags (and motorways and roundabouts) make the ways one-way.
+        """
+        import osmium
+        highway_speeds = highway_speeds or HIGHWAY_SPEEDS
+        edges = {key: [] for key in ('from_latitude', 'from_longitude', 'to_latitude', 'to_longitude', 'speed',
+                                     'oneway')}
+
+        class WayHandler(osmium.SimpleHandler):
+
+            def way(self, way):
+                highway = way.tags.get('highway')
+                if highway not in highway_speeds or len(way.nodes) < 2:
+                    return
+                speed = _parse_speed(way.tags.get('maxspeed'), highway_speeds[highway])
+                oneway = way.tags.get('oneway', 'no')
+                is_oneway = (oneway in ('yes', 'true', '1', '-1') or highway == 'motorway' or
+                             way.tags.get('junction') == 'roundabout') and oneway != 'no'
+                locations = [(node.lat, node.lon) for node in way.nodes if node.location.valid()]
+                if oneway == '-1':
+                    locations.reverse()
+                for (from_latitude, from_longitude), (to_latitude, to_longitude) in zip(locations[:-1], locations[1:]):
+                    edges['from_latitude'].append(from_latitude)
+                    edges['from_longitude'].append(from_longitude)
+                    edges['to_latitude'].append(to_latitude)
+                    edges['to_longitude'].append(to_longitude)
+                    edges['speed'].append(speed)
+                    edges['oneway'].append(is_oneway)
+
+        WayHandler().apply_file(path, locations=True)
+        return cls.from_edges(edges['from_latitude'], edges['from_longitude'], edges['to_latitude'],
+                              edges['to_longitude'], speeds=edges['speed'], oneway=edges['oneway'])
+
+    def save(self, path):
+        """Saves the graph as one .npz file (see load)."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez(path, latitudes=self.latitudes, longitudes=self.longitudes, offsets=self.offsets, heads=self.heads,
+                 lengths=self.lengths, durations=self.durations)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(arrays['latitudes'], arrays['longitudes'], arrays['offsets'], arrays['heads'],
+                       arrays['lengths'], arrays['durations'])
+
+    def snap(self, coordinate_list):
+        """Returns the nearest graph node of every coordinate and the distance (m) to it."""
+        if self._index is None:
+            self._index = SpatialIndex(np.column_stack([self.latitudes, self.longitudes]))
+        nodes, distances = self._index.query(coordinate_list, 1)
+        return nodes[:, 0], distances[:, 0]
+
+    @timed('matrix.road_network')
+    def get_matrix(self, coordinate_list, max_workers=None, snap_speed=SNAP_SPEED):
+        """
+        Returns the distance matrix (m) and the time matrix (s) of the coordinates as NumPy arrays, NaN for pairs that
+        are not connected in the graph. The straight line between a stop and its graph node is added at snap_speed km/h.
+        max_workers: number of processes of the Dijkstra runs, default the number of cores
+        """
+        nodes, snap_distances = self.snap(coordinate_list)
+        snap_durations = snap_distances / (snap_speed / 3.6)
+        unique_nodes, positions = np.unique(nodes, return_inverse=True)
+        positions = positions.reshape(-1)
+        node_distances, node_durations = self._get_node_matrix(unique_nodes.tolist(), max_workers)
+
+        pairs = np.ix_(positions, positions)
+        distance_matrix = snap_distances[:, None] + node_distances[pairs] + snap_distances[None, :]
+        time_matrix = snap_durations[:, None] + node_durations[pairs] + snap_durations[None, :]
+        np.fill_diagonal(distance_matrix, 0)
+        np.fill_diagonal(time_matrix, 0)
+        return distance_matrix, time_matrix
+
+    @timed('route.road_network')
+    def get_route(self, coordinate_list, snap_speed=SNAP_SPEED):
+        """
+        Returns the fastest route that visits the coordinates in the given order as (RouteGeometry, distance in m), like
+        osrm_get_route. Every leg goes from a stop over the graph nodes of the path to the next stop.
+        Raises a ValueError when two consecutive stops are not connected in the graph.
+        """
+        nodes, snap_distances = self.snap(coordinate_list)
+        paths = self._get_paths(nodes[:-1].tolist(), nodes[1:].tolist())
+        legs = []
+        distance = 0.0
+        for leg_index, path in enumerate(paths):
+            if path is None:
+                raise ValueError(f"stops {leg_index} and {leg_index + 1} are not connected in the road network")
+            path = np.asarray(path, dtype=np.int64)
+            legs.append([coordinate_list[leg_index]] +
+                        np.column_stack([self.latitudes[path], self.longitudes[path]]).tolist() +
+                        [coordinate_list[leg_index + 1]])
+            distance += float(snap_distances[leg_index] + self._get_path_length(path) + snap_distances[leg_index + 1])
+        return RouteGeometry.from_legs(legs, distance), distance
+
+    def _get_path_length(self, path):
+        """Length of the fastest edges between the consecutive nodes of a path."""
+        tails, heads, lengths, _ = self._get_fastest_edges()
+        keys = tails * self.nb_nodes + heads
+        return float(lengths[np.searchsorted(keys, path[:-1] * self.nb_nodes + path[1:])].sum())
+
+    def _get_fastest_edges(self):
+        """
+        The edges sorted by tail and head, only the fastest of parallel edges: (tails, heads, lengths, durations).
+        """
+        tails = np.repeat(np.arange(self.nb_nodes, dtype=np.int64), np.diff(self.offsets))
+        heads = self.heads.astype(np.int64)
+        order = np.lexsort((self.durations, heads, tails))
+        tails, heads = tails[order], heads[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (tails[1:] != tails[:-1]) | (heads[1:] != heads[:-1])
+        return tails[first], heads[first], self.lengths[order][first], self.durations[order][first]
+
+    def _get_scipy_graph(self):
+        """The durations as a scipy CSR matrix and the lengths of the same edges, None without scipy."""
+        if self._scipy_graph is None:
+            try:
+                from scipy.sparse import csr_matrix
+            except ImportError:
+                return None
+            tails, heads, lengths, durations = self._get_fastest_edges()
+            # An explicit zero is not an edge for csgraph, zero durations become the smallest positive float
+            durations = np.maximum(durations.astype(np.float64), np.finfo(np.float64).tiny)
+            graph = csr_matrix((durations, (tails, heads)), shape=(self.nb_nodes, self.nb_nodes))
+            self._scipy_graph = graph, tails * self.nb_nodes + heads, lengths.astype(np.float64)
+        return self._scipy_graph
+
+    def _get_node_matrix(self, nodes, max_workers=None):
+        """Lengths and durations of the fastest paths between all the given graph nodes."""
+        if self._get_scipy_graph() is not None:
+            return self._get_node_matrix_scipy(nodes)
+        max_workers = max_workers or os.cpu_count() or 1
+        graph = (self.offsets, self.heads, self.lengths, self.durations)
+        # A few chunks per process so a slow chunk does not keep the others waiting
+        chunk_size = max(1, math.ceil(len(nodes) / (max_workers * 4)))
+        chunks = [nodes[start:start + chunk_size] for start in range(0, len(nodes), chunk_size)]
+        if max_workers == 1 or len(chunks) == 1:
+            _set_graph(graph)
+            results = [_fastest_paths_chunk(chunk, nodes) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_set_graph, initargs=(graph,)) as executor:
+                results = list(executor.map(_fastest_paths_chunk, chunks, [nodes] * len(chunks)))
+        return np.vstack([lengths for lengths, _ in results]), np.vstack([durations for _, durations in results])
+
+    def _get_node_matrix_scipy(self, nodes):
+        """_get_node_matrix with scipy.sparse.csgraph.dijkstra, SCIPY_CHUNK_SIZE sources at a time."""
+        from scipy.sparse.csgraph import dijkstra
+        graph, edge_keys, edge_lengths = self._get_scipy_graph()
+        nodes = np.asarray(nodes, dtype=np.int64)
+        node_lengths = np.empty((len(nodes), len(nodes)))
+        node_durations = np.empty((len(nodes), len(nodes)))
+        for start in range(0, len(nodes), SCIPY_CHUNK_SIZE):
+            sources = nodes[start:start + SCIPY_CHUNK_SIZE]
+            durations, predecessors = dijkstra(graph, indices=sources, return_predecessors=True)
+            lengths = self._get_tree_lengths(predecessors, edge_keys, edge_lengths)
+            rows = slice(start, start + len(sources))
+            node_durations[rows] = np.where(np.isinf(durations[:, nodes]), np.nan, durations[:, nodes])
+            node_lengths[rows] = np.where(np.isinf(durations[:, nodes]), np.nan, lengths[:, nodes])
+        return node_lengths, node_durations
+
+    def _get_tree_lengths(self, predecessors, edge_keys, edge_lengths):
+        """
+        Lengths of the paths of shortest path trees (a row of predecessors per source, negative for the source and the
+        unreachable nodes), by pointer jumping: every round doubles the part of the path that is summed.
+        """
+        nb_trees, nb_nodes = predecessors.shape
+        node_ids = np.broadcast_to(np.arange(nb_nodes), predecessors.shape)
+        has_parent = predecessors >= 0
+        parents = np.where(has_parent, predecessors, node_ids)
+        lengths = np.zeros(predecessors.shape)
+        lengths[has_parent] = edge_lengths[np.searchsorted(edge_keys, parents[has_parent] * nb_nodes +
+                                                           node_ids[has_parent])]
+        rows = np.arange(nb_trees)[:, None]
+        while True:
+            grandparents = parents[rows, parents]
+            if np.array_equal(grandparents, parents):
+                return lengths
+            lengths = lengths + lengths[rows, parents]
+            parents = grandparents
+
+    def _get_paths(self, sources, targets):
+        """The nodes of the fastest path from every source to its target (None when it is not reachable)."""
+        if self._get_scipy_graph() is not None:
+            from scipy.sparse.csgraph import dijkstra
+            graph, _, _ = self._get_scipy_graph()
+            unique_sources, positions = np.unique(sources, return_inverse=True)
+            _, predecessors = dijkstra(graph, indices=unique_sources, return_predecessors=True)
+            trees = [predecessors[position] for position in positions.reshape(-1)]
+        else:
+            _set_graph((self.offsets, self.heads, self.lengths, self.durations))
+            trees = [_fastest_path_tree(source, [target])[2] for source, target in zip(sources, targets)]
+        paths = []
+        for source, target, tree in zip(sources, targets, trees):
+            path = [target]
+            while path[-1] != source:
+                predecessor = int(tree[path[-1]]) if isinstance(tree, np.ndarray) else tree.get(path[-1], -1)
+                if predecessor < 0:
+                    path = None
+                    break
+                path.append(predecessor)
+            paths.append(None if path is None else path[::-1])
+        return paths
+
+
+def _parse_speed(maxspeed, default_speed):
+    """km/h of an OSM maxspeed tag ('50', '30 mph', ...), default_speed when it is missing or not a number."""
+    if not maxspeed:
+        return default_speed
+    value = maxspeed.split(';')[0].strip()
+    try:
+        if value.endswith('mph'):
+            return float(value[:-3]) * 1.609344
+        return float(value)
+    except ValueError:
+        return default_speed
+
+
+# Graph of the process, set once per worker process by the pool initializer
+_graph = None
+
+
+def _set_graph(graph):
+    global _graph
+    _graph = graph
+
+
+def _fastest_paths_chunk(sources, targets):
+    """Runs _fastest_paths from every source, returns the len(sources) x len(targets) lengths and durations."""
+    lengths = np.empty((len(sources), len(targets)))
+    durations = np.empty((len(sources), len(targets)))
+    for row, source in enumerate(sources):
+        lengths[row], durations[row] = _fastest_paths(source, targets)
+    return lengths, durations
+
+
+def _fastest_path_tree(source, targets):
+    """
+    Dijkstra on the durations from source until every target is settled. Returns the durations, the lengths and the
+    predecessors of the reached nodes (dicts) and the set of settled nodes.
+    """
+    offsets, heads, edge_lengths, edge_durations = _graph
+    durations = {source: 0.0}
+    lengths = {source: 0.0}
+    predecessors = {}
+    settled = set()
+    remaining = set(targets)
+    heap = [(0.0, source)]
+    while heap and remaining:
+        duration, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        remaining.discard(node)
+        length = lengths[node]
+        # The edges of a node are a slice of the CSR arrays, read as lists in one go
+        start, end = int(offsets[node]), int(offsets[node + 1])
+        for head, edge_length, edge_duration in zip(heads[start:end].tolist(), edge_lengths[start:end].tolist(),
+                                                    edge_durations[start:end].tolist()):
+            head_duration = duration + edge_duration
+            if head_duration < durations.get(head, math.inf):
+                durations[head] = head_duration
+                lengths[head] = length + edge_length
+                predecessors[head] = node
+                heapq.heappush(heap, (head_duration, head))
+    return durations, lengths, predecessors, settled
+
+
+def _fastest_paths(source, targets):
+    """
+    Returns the length and the duration of the fastest path from source to every target (NaN when a target cannot be
+    reached), see _fastest_path_tree.
+    """
+    durations, lengths, _, settled = _fastest_path_tree(source, targets)
+    return ([lengths[target] if target in settled else math.nan for target in targets],
+            [durations[target] if target in settled else math.nan for target in targets])
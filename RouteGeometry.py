@@ -0,0 +1,172 @@
+"""
+Compact storage of OSRM route geometries.
+
+A RouteGeometry keeps the points of all the legs of a route in one int32 array of fixed-point coordinates (degrees
+times 1e5, the precision of OSRM polylines) with an offsets array that marks where every leg starts, instead of one
+Python tuple per point. Geometries that were loaded from a save keep their encoded polylines and are only decoded when
+they are used.
+
+Polylines are decoded and encoded with NumPy in one pass over all the characters, so the steps of a whole route are
+decoded together:
+
+    geometry = RouteGeometry.from_step_polylines(leg_steps, distance)
+    for leg in geometry:          # (n, 2) float arrays of (latitude, longitude)
+        ...
+    geometry.to_array()           # all the points of the route
+"""
+import numpy as np
+
+PRECISION = 5
+SCALE = 10 ** PRECISION
+# A 32-bit zigzag value needs at most 7 chunks of 5 bits
+_MAX_CHUNKS = 7
+
+
+def decode_polylines(polylines):
+    """
+    Decodes a list of encoded polylines in one vectorized pass.
+    Returns the fixed-point points as an (n, 2) int32 array and the offsets of the polylines (len(polylines) + 1).
+    """
+    lengths = np.fromiter((len(line) for line in polylines), dtype=np.int64, count=len(polylines))
+    characters = np.frombuffer(''.join(polylines).encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    if len(characters) == 0:
+        return np.zeros((0, 2), dtype=np.int32), np.zeros(len(polylines) + 1, dtype=np.int64)
+    # A value is a run of 5-bit chunks, the last chunk of a value has the continuation bit (0x20) unset
+    is_last = characters < 0x20
+    value_ends = np.flatnonzero(is_last)
+    value_starts = np.concatenate([[0], value_ends[:-1] + 1])
+    chunk_positions = np.arange(len(characters)) - np.repeat(value_starts, value_ends - value_starts + 1)
+    values = np.add.reduceat((characters & 0x1f) << (5 * chunk_positions), value_starts)
+    deltas = ((values >> 1) ^ -(values & 1)).reshape(-1, 2)
+
+    # Every polyline starts from (0, 0): the running sum restarts at the first point of every polyline
+    values_per_line = np.bincount(np.searchsorted(np.cumsum(lengths), value_ends, side='right'),
+                                  minlength=len(polylines))
+    offsets = np.zeros(len(polylines) + 1, dtype=np.int64)
+    np.cumsum(values_per_line // 2, out=offsets[1:])
+    points = np.cumsum(deltas, axis=0)
+    line_starts = np.zeros((len(polylines), 2), dtype=np.int64)
+    after_points = offsets[:-1] > 0
+    line_starts[after_points] = points[offsets[:-1][after_points] - 1]
+    points -= np.repeat(line_starts, np.diff(offsets), axis=0)
+    return points.astype(np.int32), offsets
+
+
+def decode_polyline(polyline, precision=PRECISION):
+    """
+    Decodes one polyline as an (n, 2) float array of (latitude, longitude) in degrees, precision is the number of
+    decimals of the polyline (6 for the polyline6 geometries of OSRM).
+    """
+    return decode_polylines([polyline])[0] / 10 ** precision
+
+
+def encode_polyline(points):
+    """Encodes fixed-point (n, 2) points (degrees times 10^precision of the polyline) as a polyline string."""
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    if len(points) == 0:
+        return ''
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).reshape(-1)
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    shifted = values[:, None] >> (5 * np.arange(_MAX_CHUNKS))
+    chunks = shifted & 0x1f
+    nb_chunks = np.maximum(1, (shifted > 0).sum(axis=1))
+    used = np.arange(_MAX_CHUNKS) < nb_chunks[:, None]
+    continued = np.arange(_MAX_CHUNKS) < (nb_chunks - 1)[:, None]
+    characters = (chunks | (continued * 0x20)) + 63
+    return characters[used].astype(np.uint8).tobytes().decode('ascii')
+
+
+class RouteGeometry:
+
+    def __init__(self, points=None, offsets=None, distance=None, polylines=None):
+        """
+        points: (n, 2) int32 fixed-point (latitude, longitude) of all the legs, offsets: start of every leg in points
+        and the end of the last leg, distance: meters. A geometry can also be made from the encoded polyline of every
+        leg (polylines), which is decoded on first use.
+        """
+        self._points = None if points is None else np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        self._offsets = None if offsets is None else np.asarray(offsets, dtype=np.int64)
+        self._polylines = polylines
+        self.distance = distance
+
+    @classmethod
+    def from_step_polylines(cls, leg_steps, distance=None):
+        """From the encoded step geometries of every leg (the steps of a leg are concatenated, like osrm_get_route)."""
+        step_polylines = [step for steps in leg_steps for step in steps]
+        points, step_offsets = decode_polylines(step_polylines)
+        step_counts = np.fromiter((len(steps) for steps in leg_steps), dtype=np.int64, count=len(leg_steps))
+        offsets = step_offsets[np.concatenate([[0], np.cumsum(step_counts)])]
+        return cls(points, offsets, distance)
+
+    @classmethod
+    def from_legs(cls, legs, distance=None):
+        """From a list of legs with (latitude, longitude) points in degrees (the format of older saves)."""
+        arrays = [np.asarray(leg, dtype=np.float64).reshape(-1, 2) for leg in legs]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(array) for array in arrays], out=offsets[1:])
+        points = np.concatenate(arrays) if arrays else np.zeros((0, 2))
+        return cls(np.round(points * SCALE), offsets, distance)
+
+    @classmethod
+    def from_dict(cls, geometry):
+        """From to_dict (or the {'legs', 'distance'} dict of older saves), the polylines are decoded on first use."""
+        if 'polylines' in geometry:
+            return cls(distance=geometry['distance'], polylines=list(geometry['polylines']))
+        return cls.from_legs(geometry['legs'], geometry['distance'])
+
+    def to_dict(self):
+        """JSON-serializable dict with the encoded polyline of every leg."""
+        if self._polylines is None:
+            self._polylines = [encode_polyline(self._points[start:end])
+                               for start, end in zip(self._offsets[:-1], self._offsets[1:])]
+        return {'polylines': self._polylines, 'distance': self.distance}
+
+    def _decode(self):
+        if self._points is None:
+            self._points, self._offsets = decode_polylines(self._polylines)
+
+    @property
+    def points(self):
+        """The fixed-point (n, 2) int32 points of all the legs."""
+        self._decode()
+        return self._points
+
+    @property
+    def offsets(self):
+        self._decode()
+        return self._offsets
+
+    @property
+    def nb_points(self):
+        return len(self.points)
+
+    def leg(self, index):
+        """The points of leg index as an (n, 2) array of (latitude, longitude) in degrees."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('leg index out of range')
+        return self.points[self.offsets[index]:self.offsets[index + 1]] / SCALE
+
+    def to_array(self):
+        """All the points of the route as an (n, 2) array of (latitude, longitude) in degrees."""
+        return self.points / SCALE
+
+    def __len__(self):
+        return len(self._polylines) if self._points is None else len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        return self.leg(index)
+
+    def __iter__(self):
+        coordinates = self.to_array()
+        offsets = self.offsets
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield coordinates[start:end]
+
+
+def as_coordinate_array(coordinates):
+    """(n, 2) float array of (latitude, longitude) of a RouteGeometry, an array or a list of coordinate pairs."""
+    if isinstance(coordinates, RouteGeometry):
+        return coordinates.to_array()
+    return np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
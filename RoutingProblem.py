@@ -1,15 +1,49 @@
+import hashlib
 import json
-import folium.plugins
-import plotly.graph_objects as go
-from IPython.display import display
+import math
 import os
-import seaborn as sns
-import folium
-from OSRM import osrm_get_route
+from OSRM import osrm_get_route, osrm_get_rows_and_columns
+from OSRMClient import OSRMError
 import pandas as pd
-import webbrowser
-from Distances import get_straight_line_distance
-from colour import Color
+from Distances import get_straight_line_distance, get_straight_line_distance_block, evaluate_routes
+import numpy as np
+import Plotting
+from Metrics import ROUTE_METRICS_HEADER, get_route_metrics, get_solution_metrics
+from Instrumentation import timed, count
+from RouteGeometry import RouteGeometry
+from DistanceMatrix import DistanceMatrix
+
+PROBLEMS_DIRECTORY = './RoutingProblems/'
+MATRIX_KINDS = ('straight_line', 'osrm_distance', 'osrm_time')
+MATRIX_UNITS = {'straight_line': 'm', 'osrm_distance': 'm', 'osrm_time': 's'}
+
+def _to_json(value):
+    """Converts the NumPy arrays and scalars (e.g. tiled OSRM matrices) that json does not know."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _to_json_values(array):
+    """Nested lists of the values of an array, None for NaN (unreachable pairs)."""
+    values = array.astype(object)
+    values[np.isnan(array)] = None
+    return values.tolist()
+
+
+def get_problem_name(name):
+    """Name a routing problem is saved under (and the file name of its results): the name with '_' for spaces."""
+    return str.replace(str(name), ' ', '_')
+
+
+def _get_mapped_file(array):
+    """Absolute path of the file an array is memory-mapped from (also for views of it), None for other arrays."""
+    while array is not None:
+        if isinstance(array, np.memmap) and array.filename is not None:
+            return os.path.abspath(array.filename)
+        array = getattr(array, 'base', None)
+    return None
+
 
 class RoutingProblem:
     
@@ -25,6 +59,18 @@ class RoutingProblem:
             'demands': None,
             'solutions': {},
         }
+        # Matrices of a binary save that are not loaded yet and the files the loaded matrices come from
+        self._pending_matrices = {}
+        self._matrix_files = {}
+        # OSRM route geometries, fetched once per distinct route (see get_route_geometry)
+        self.route_geometries = {}
+        self._pending_geometry_file = None
+        # RoadNetwork for the routes when the OSRM server cannot be reached (see set_road_network)
+        self.road_network = None
+
+    def set_road_network(self, road_network):
+        """Routes are computed on the road network (a RoadNetwork) when the OSRM server cannot be reached."""
+        self.road_network = road_network
 
     def add_coordinates(self, coordinate_list):
         self.data['coordinate_list'] = coordinate_list
@@ -55,26 +101,263 @@ class RoutingProblem:
     def get_depot(self):
         return self.get_coordinates()[self.data['depot_index']]
 
-    def add_distance_matrix(self, matrix_name, matrix):
-        self.data['distance_matrices'][matrix_name] = matrix
+    def add_distance_matrix(self, matrix_name, matrix, kind=None, condensed=False):
+        """
+        The matrix (nested lists, array or DistanceMatrix) is stored as a DistanceMatrix, arrays are not copied.
+        kind tells how the matrix was built, so it can be extended when stops are added (see add_stops):
+        'straight_line', 'osrm_distance' or 'osrm_time'. By default it is derived from the matrix name.
+        condensed: store only the upper triangle of a symmetric matrix (e.g. straight-line distances), half the memory
+        """
+        if kind is not None:
+            if kind not in MATRIX_KINDS:
+                raise ValueError(f"Unknown matrix kind '{kind}', use one of {MATRIX_KINDS}")
+            self.data.setdefault('matrix_kinds', {})[matrix_name] = kind
+        if not isinstance(matrix, DistanceMatrix):
+            matrix = DistanceMatrix(matrix, units=MATRIX_UNITS.get(self.get_matrix_kind(matrix_name)))
+        self.data['distance_matrices'][matrix_name] = matrix.condense() if condensed else matrix
+        self._pending_matrices.pop(matrix_name, None)
+        self._matrix_files.pop(matrix_name, None)
+
+    def get_matrix_kind(self, matrix_name):
+        """Returns the kind of a matrix (see add_distance_matrix), None if it is unknown."""
+        kind = self.data.get('matrix_kinds', {}).get(matrix_name)
+        if kind is not None:
+            return kind
+        name = matrix_name.lower()
+        if 'straight' in name:
+            return 'straight_line'
+        if 'osrm' in name:
+            return 'osrm_time' if 'time' in name or 'duration' in name else 'osrm_distance'
+        return None
 
     def get_all_distance_matrices(self):
+        for matrix_name in list(self._pending_matrices):
+            self._load_matrix(matrix_name)
         return self.data['distance_matrices']
     
     def get_distance_matrix(self, matrix_name):
+        if matrix_name in self._pending_matrices:
+            self._load_matrix(matrix_name)
         return self.data['distance_matrices'][matrix_name] 
 
-    def save(self, prefix=""):
-        with open('./RoutingProblems/'+prefix+self.name+'.json', 'w') as output_file:
-            json.dump(self.data, output_file)
+    def _load_matrix(self, matrix_name):
+        """Loads a matrix of a binary save (memory-mapped, read-only) on its first access."""
+        path = self._pending_matrices.pop(matrix_name)
+        # Saves from before DistanceMatrix have no matrix metadata, their units follow from the kind of the matrix
+        metadata = (self.data.get('matrix_metadata', {}).get(matrix_name) or
+                    {'units': MATRIX_UNITS.get(self.get_matrix_kind(matrix_name))})
+        storage = np.load(path, mmap_mode='r')
+        self.data['distance_matrices'][matrix_name] = DistanceMatrix.from_storage(storage, metadata)
 
+    @timed('problem.save')
+    def save(self, prefix="", binary=True):
+        """
+        Saves the problem in ./RoutingProblems/.
+        The binary format is a directory with a small problem.json (coordinates, demands, solutions, ...) and one .npy
+        typed array per distance matrix (the upper triangle of a condensed matrix), that is only read when the matrix is
+        used. With binary=False everything is written to a single JSON file (the format of older saves).
+        """
+        if not binary:
+            # The stored values of every matrix (the upper triangle of a condensed one) with its metadata, None for
+            # unreachable pairs
+            matrices = self.get_all_distance_matrices()
+            data = {**self.data,
+                    'distance_matrices': {name: _to_json_values(matrix.storage) for name, matrix in matrices.items()},
+                    'matrix_metadata': {name: matrix.get_metadata() for name, matrix in matrices.items()},
+                    'route_geometries': self._get_route_geometries_json()}
+            with open(PROBLEMS_DIRECTORY+prefix+self.name+'.json', 'w') as output_file:
+                json.dump(data, output_file, default=_to_json)
+            return
+
+        directory = PROBLEMS_DIRECTORY+prefix+self.name
+        os.makedirs(directory, exist_ok=True)
+        metadata = {key: value for key, value in self.data.items() if key != 'distance_matrices'}
+        metadata['matrix_files'] = {}
+        metadata['matrix_metadata'] = {}
+        for matrix_index, matrix_name in enumerate(self.data['distance_matrices']):
+            file_name = 'matrix_'+str(matrix_index)+'.npy'
+            path = os.path.join(directory, file_name)
+            metadata['matrix_files'][matrix_name] = file_name
+            if self._matrix_files.get(matrix_name) == os.path.abspath(path):
+                # Unchanged since it was loaded from this file (which may still be memory-mapped)
+                metadata['matrix_metadata'][matrix_name] = self.data.get('matrix_metadata', {}).get(matrix_name)
+                continue
+            matrix = self.get_distance_matrix(matrix_name)
+            metadata['matrix_metadata'][matrix_name] = matrix.get_metadata()
+            if _get_mapped_file(matrix.storage) == os.path.abspath(path):
+                # Memory-mapped from the file it would be written to (e.g. added again after a load): unchanged
+                continue
+            # Unreachable pairs (None in OSRM matrices) are stored as NaN. The matrix is written to a temporary file
+            # and renamed: the old file may still be memory-mapped (by this or another matrix) and must not be
+            # truncated while it is read.
+            temporary_path = os.path.join(directory, 'matrix_'+str(matrix_index)+'.tmp.npy')
+            np.save(temporary_path, matrix.storage)
+            os.replace(temporary_path, path)
+        with open(os.path.join(directory, 'problem.json'), 'w') as output_file:
+            json.dump(metadata, output_file, default=_to_json)
+        # Matrices that were removed since the last save
+        for file_name in os.listdir(directory):
+            if (file_name.startswith('matrix_') and file_name.endswith('.npy')
+                    and file_name not in metadata['matrix_files'].values()):
+                os.remove(os.path.join(directory, file_name))
+        geometry_path = os.path.abspath(os.path.join(directory, 'route_geometries.json'))
+        if geometry_path != self._pending_geometry_file:
+            route_geometries = self._get_route_geometries_json()
+            with open(geometry_path, 'w') as output_file:
+                json.dump(route_geometries, output_file)
+
+    @timed('problem.load')
     def load(self):
-        with open('./RoutingProblems/'+self.name+'.json', 'r') as inp:
-            self.data = json.load(inp)
-            self.name = self.data['name']
+        """Loads a binary save if there is one, otherwise the JSON file. The matrices of a binary save are loaded lazily."""
+        directory = PROBLEMS_DIRECTORY+self.name
+        self._pending_matrices = {}
+        self._matrix_files = {}
+        self.route_geometries = {}
+        self._pending_geometry_file = None
+        if os.path.isfile(os.path.join(directory, 'problem.json')):
+            with open(os.path.join(directory, 'problem.json'), 'r') as inp:
+                self.data = json.load(inp)
+            self.data['distance_matrices'] = {}
+            self.data.setdefault('matrix_metadata', {})
+            for matrix_name, file_name in self.data.pop('matrix_files').items():
+                path = os.path.abspath(os.path.join(directory, file_name))
+                self.data['distance_matrices'][matrix_name] = None
+                self._pending_matrices[matrix_name] = path
+                self._matrix_files[matrix_name] = path
+            if os.path.isfile(os.path.join(directory, 'route_geometries.json')):
+                self._pending_geometry_file = os.path.abspath(os.path.join(directory, 'route_geometries.json'))
+        else:
+            with open(PROBLEMS_DIRECTORY+self.name+'.json', 'r') as inp:
+                self.data = json.load(inp)
+            self.route_geometries = self._read_route_geometries(self.data.pop('route_geometries', {}))
+            matrix_metadata = self.data.get('matrix_metadata', {})
+            for matrix_name, matrix in list(self.data['distance_matrices'].items()):
+                if matrix_name in matrix_metadata:
+                    matrix = DistanceMatrix.from_storage(DistanceMatrix(matrix).storage, matrix_metadata[matrix_name])
+                self.add_distance_matrix(matrix_name, matrix)
+        self.name = self.data['name']
 
     def is_saved(self):
-        return os.path.isfile('./RoutingProblems/'+self.name+'.json')
+        return (os.path.isfile(os.path.join(PROBLEMS_DIRECTORY+self.name, 'problem.json'))
+                or os.path.isfile(PROBLEMS_DIRECTORY+self.name+'.json'))
+
+    def add_stops(self, coordinate_list, demands=None, local=True):
+        """
+        Adds stops to the problem and extends every distance matrix with only the rows and columns of the new stops:
+        straight-line distances are computed, OSRM distances/times are fetched for the new pairs only, so adding k stops
+        costs O(k * N) instead of rebuilding the N x N matrices. The new stops are not added to the solutions.
+        demands: demands of the new stops, required when the problem has demands.
+        Returns the indices of the new stops.
+        """
+        old_coordinates = [] if self.get_coordinates() is None else list(self.get_coordinates())
+        n = len(old_coordinates)
+        new_indices = list(range(n, n + len(coordinate_list)))
+        all_coordinates = old_coordinates + [list(coordinate) for coordinate in coordinate_list]
+        if self.get_demands() is not None:
+            if demands is None or len(demands) != len(coordinate_list):
+                raise ValueError("The problem has demands, give a demand for every new stop")
+            self.data['demands'] = list(self.get_demands()) + list(demands)
+
+        straight_line_rows = None
+        osrm_rows = None
+        for matrix_name, matrix in list(self.get_all_distance_matrices().items()):
+            kind = self.get_matrix_kind(matrix_name)
+            if kind == 'straight_line':
+                if straight_line_rows is None:
+                    straight_line_rows = get_straight_line_distance_block(coordinate_list, all_coordinates)
+                row_values, column_values = straight_line_rows, straight_line_rows.T
+            elif kind in ('osrm_distance', 'osrm_time'):
+                if osrm_rows is None:
+                    osrm_rows = osrm_get_rows_and_columns(all_coordinates, new_indices, local=local)
+                row_distances, row_durations, column_distances, column_durations = osrm_rows
+                if kind == 'osrm_distance':
+                    row_values, column_values = row_distances, column_distances
+                else:
+                    row_values, column_values = row_durations, column_durations
+            else:
+                raise ValueError(f"Cannot extend matrix '{matrix_name}', its kind is unknown (see add_distance_matrix)")
+            extended_matrix = np.empty((len(all_coordinates), len(all_coordinates)), dtype=matrix.dtype)
+            extended_matrix[:n, :n] = matrix
+            extended_matrix[n:, :] = row_values
+            extended_matrix[:, n:] = column_values
+            extended_matrix = DistanceMatrix(extended_matrix, units=matrix.units)
+            self.add_distance_matrix(matrix_name, extended_matrix,
+                                     condensed=matrix.is_condensed and extended_matrix.symmetric)
+
+        self.data['coordinate_list'] = all_coordinates
+        return new_indices
+
+    def remove_stops(self, indices):
+        """
+        Removes stops from the problem: their rows and columns are dropped from every distance matrix, the stops are
+        removed from the solutions and the remaining indices of the solutions are renumbered. The depot cannot be removed.
+        """
+        removed = set(int(index) for index in indices)
+        if self.data['depot_index'] in removed:
+            raise ValueError("The depot cannot be removed")
+        n = len(self.get_coordinates())
+        keep = np.array([index not in removed for index in range(n)])
+        new_index = np.cumsum(keep) - 1
+
+        for matrix_name, matrix in list(self.get_all_distance_matrices().items()):
+            kept_matrix = DistanceMatrix(np.asarray(matrix)[np.ix_(keep, keep)], units=matrix.units)
+            self.add_distance_matrix(matrix_name, kept_matrix, condensed=matrix.is_condensed)
+        self.data['coordinate_list'] = [coordinate for index, coordinate in enumerate(self.get_coordinates())
+                                        if keep[index]]
+        if self.get_demands() is not None:
+            self.data['demands'] = [demand for index, demand in enumerate(self.get_demands()) if keep[index]]
+        for solution in self.get_solutions().values():
+            for route_name, index_list in solution.items():
+                solution[route_name] = [int(new_index[index]) for index in index_list if index not in removed]
+        self.data['depot_index'] = int(new_index[self.data['depot_index']])
+
+    @staticmethod
+    def _route_key(coordinate_list):
+        coordinates = ";".join(f"{latitude:.6f},{longitude:.6f}" for latitude, longitude in coordinate_list)
+        return hashlib.sha1(coordinates.encode('utf-8')).hexdigest()
+
+    def get_route_geometry(self, index_list):
+        """
+        Returns the OSRM route of the stops index_list (in visiting order) as (segmented_route, distance), see
+        osrm_get_route: segmented_route is a RouteGeometry, its legs are (latitude, longitude) arrays.
+        Every distinct route is only fetched once, the plots and the metrics share the result.
+        The routes are keyed by their coordinates, so they stay valid when the stops are renumbered.
+        When the route cannot be fetched (and not computed on the road network, see set_road_network) an empty
+        geometry with a NaN distance is returned, it is fetched again on the next call.
+        """
+        coordinate_list = [self.get_coordinates()[index] for index in index_list]
+        route_geometries = self.get_route_geometries()
+        key = self._route_key(coordinate_list)
+        if key not in route_geometries:
+            count('route_geometry.fetches')
+            try:
+                segmented_route, distance = osrm_get_route(coordinate_list, road_network=self.road_network)
+            except (OSRMError, ValueError) as e:
+                print(f"no route for {len(coordinate_list)} stops of {self.name}: {e}")
+                count('route_geometry.failures')
+                return RouteGeometry(np.zeros((0, 2)), np.zeros(1), math.nan), math.nan
+            route_geometries[key] = segmented_route
+        route_geometry = route_geometries[key]
+        return route_geometry, route_geometry.distance
+
+    def get_route_geometries(self):
+        """
+        Returns the stored route geometries (RouteGeometry per route key). The route geometries of a binary save are
+        read on first use, their polylines are only decoded when a route is used.
+        """
+        if self._pending_geometry_file is not None:
+            with open(self._pending_geometry_file, 'r') as inp:
+                self.route_geometries.update(self._read_route_geometries(json.load(inp)))
+            self._pending_geometry_file = None
+        return self.route_geometries
+
+    @staticmethod
+    def _read_route_geometries(route_geometries):
+        return {key: RouteGeometry.from_dict(geometry) for key, geometry in route_geometries.items()}
+
+    def _get_route_geometries_json(self):
+        """The route geometries as encoded polylines per leg."""
+        return {key: geometry.to_dict() for key, geometry in self.get_route_geometries().items()}
 
     def add_solution(self, solution_name, solution):
         '''
@@ -93,209 +376,55 @@ class RoutingProblem:
     def get_solution(self, solution_name):
         return self.data['solutions'][solution_name]
 
+    def evaluate_routes(self, routes, matrix_name=None, method='osrm', local=True):
+        """
+        Per-leg and total distances of many routes (lists of stop indices) at once, see Distances.evaluate_routes.
+        With matrix_name the routes are costed on that stored matrix, otherwise with method ('osrm', 'ellipsoidal' or
+        'haversine') on the coordinates of the stops.
+        """
+        distance_matrix = self.get_distance_matrix(matrix_name) if matrix_name is not None else None
+        return evaluate_routes(routes, distance_matrix, self.get_coordinates(), method=method, local=local)
+
+    @timed('metrics.routes')
+    def get_route_metrics(self, add_osrm_route_metric=False):
+        """
+        Returns a tidy DataFrame with the total of every route of every solution on every distance matrix
+        (columns 'Routing Problem', 'Solution', 'Route', 'Metric', 'Total').
+        With add_osrm_route_metric the real distance of every route (OSRM route service) is added as metric 'osrm_route'.
+        """
+        route_metrics = get_route_metrics(self.name, self.get_solutions(), self.get_all_distance_matrices())
+        if add_osrm_route_metric:
+            rows = []
+            for solution_name, solution in self.get_solutions().items():
+                for route_name, indices in solution.items():
+                    segments, route_distance = self.get_route_geometry(indices)
+                    rows.append([self.name, solution_name, route_name, 'osrm_route', route_distance])
+            route_metrics = pd.concat([route_metrics, pd.DataFrame(rows, columns=ROUTE_METRICS_HEADER)],
+                                      ignore_index=True)
+        return route_metrics
+
+    @timed('metrics')
     def get_metrics(self, original_solution_name=None ,add_osrm_route_metric=False):
         """
         Calculates and compares the following metrics of every solution:
-        - Total straight line distance of all routes
-        - Total real distance of all routes (OSRM)
-        - Total real distance of all routes (openrouteservice)
+        - Total value of all routes on every distance matrix (straight line, OSRM distance, ...)
+        - Total real distance of all routes (OSRM route service), if add_osrm_route_metric
+        The improvement is relative to the solution original_solution_name.
         """
-        header = ['Routing Problem', 'Solution', 'Metric', 'Total', 'Improvment']
-        results = []
-        # Loop over every solution for this problem
-        for solution_name, solution in self.get_solutions().items():
-            # Loop over every metric for this problem
-            for matrix_name, matrix in self.get_all_distance_matrices().items():
-                # Calculate the total value of the selected solution using this metric
-                total_metric = 0
-                for route_name, indices in solution.items():
-                    route_metric = 0
-                    for i in range(len(indices) - 1):
-                        index_from = indices[i]
-                        index_to = indices[i+1]
-                        route_metric += matrix[index_from][index_to]
-                    total_metric += route_metric
-                # Calculate the total value of the selected solution using this metric and the improvement
-                if original_solution_name is not None:
-                    total_metric_original = 0
-                    for route_name, indices in self.get_solution(original_solution_name).items():
-                        route_metric = 0
-                        for i in range(len(indices) - 1):
-                            index_from = indices[i]
-                            index_to = indices[i+1]
-                            total_metric_original += matrix[index_from][index_to]
-                        total_metric_original += route_metric
-                    improvement = (total_metric_original - total_metric) / total_metric_original
-                else:
-                    improvement = 0
-                # Add a row to the results
-                results.append([self.name, solution_name, matrix_name, total_metric, improvement])
-            # Add the OSRM route metric (if applicable)
-            if add_osrm_route_metric:
-                # Calculate the total value of the selected solution using this metric
-                total_metric = 0
-                for route_name, indices in solution.items():
-                    coordinate_list = [self.get_coordinates()[index] for index in indices]
-                    segments, route_distance = osrm_get_route(coordinate_list)
-                    total_metric += route_distance
-                # Calculate the total value of the selected solution using this metric and the improvement
-                if original_solution_name is not None:
-                    total_metric_original = 0
-                    for route_name, indices in self.get_solution(original_solution_name).items():
-                        coordinate_list = [self.get_coordinates()[index] for index in indices]
-                        segments, route_distance = osrm_get_route(coordinate_list)
-                        total_metric_original += route_distance
-                    improvement = (total_metric_original - total_metric) / total_metric_original
-                else:
-                    improvement = 0
-                results.append([self.name, solution_name, 'osrm_route', total_metric, improvement])
-        return pd.DataFrame(results, columns=header)
-
-    def plot_folium(self):
-        # Create the map
-        colors = ['#174EA6','#A50E0E','#E37400','#0D652D','#34A853','#4285F4','#EA4335','#FBBC04','#9AA0A6','#202124']
-        map = folium.Map(location=self.get_depot(), zoom_start=13, control_scale=True)
-        folium.TileLayer('openstreetmap').add_to(map)
-        folium.TileLayer('CartoDB Positron').add_to(map)
-
-        color_index = 0
-        for solution_name, solution in self.get_solutions().items():
-            for route_name, index_list in solution.items():
-                
-                # Create a new layer with real route
-                color_index += 1
-                if color_index == len(colors):
-                    color_index = 0
-                real_layer = folium.FeatureGroup(name=solution_name+" "+"ON ROAD", show=False).add_to(map)
-                coordinate_list = [self.get_coordinates()[index] for index in index_list]
-                segmented_route_coordinates, distance = osrm_get_route(coordinate_list)
-                # Add the stops and walking lines
-                for stop_index, segment_coordinates in enumerate(segmented_route_coordinates):
-                    folium.PolyLine(locations=segment_coordinates, color=colors[color_index]).add_to(real_layer)
-                    """
-                    folium.PolyLine(locations=[segment_coordinates[0], coordinate_list[stop_index]], color='#202124').add_to(real_layer)
-                    folium.CircleMarker(location=segment_coordinates[0], radius=2, color=colors[color_index], fill_color='white', fill_opacity=1).add_to(real_layer)
-                    """
-
-                # Create a new layer with direct route
-                color_index += 1
-                if color_index == len(colors):
-                    color_index = 0
-                direct_layer = folium.FeatureGroup(name=solution_name+" "+"DIRECT", show=False).add_to(map)
-                coordinate_list = [self.get_coordinates()[index] for index in index_list]
-                folium.PolyLine(locations=coordinate_list, color=colors[color_index]).add_to(direct_layer)
-
-                # Create a new layer with markers
-                marker_layer = folium.FeatureGroup(name=solution_name+" "+"MARKERS", show=False).add_to(map)
-                coordinate_list = [self.get_coordinates()[index] for index in index_list]
-                segmented_route_coordinates, distance = osrm_get_route(coordinate_list)            
-                # Add stops as Markers with the number
-                for index, stop_coordinate in enumerate(coordinate_list):
-                    folium.Marker(location=stop_coordinate,
-                                  icon=folium.plugins.BeautifyIcon(
-                                    icon="arrow-down", 
-                                    icon_shape="marker", 
-                                    border_color='#cc7a00', 
-                                    background_color='#ff9900',
-                                    number=str(index))).add_to(marker_layer)
-
-        # Create demo layer
-        index_from = 0
-        index_to = 25
-        current_index = 20
-        solution_name = 'OPTIMAL (REAL)'
-        # Create a new layer with real route
-        demo_layer = folium.FeatureGroup(name="DEMO", show=False).add_to(map)
-        index_list = self.get_solution(solution_name)['TSP_1']
-        coordinate_list = [self.get_coordinates()[index] for index in index_list]
-        segmented_route_coordinates, distance = osrm_get_route(coordinate_list)
-        # Add the stops and walking lines
-        for stop_index, segment_coordinates in enumerate(segmented_route_coordinates):
-            if stop_index <= current_index:
-                folium.PolyLine(locations=segment_coordinates, color='#9AA0A6').add_to(demo_layer)
-                folium.Marker(location=segment_coordinates[-1],
-                                  icon=folium.plugins.BeautifyIcon(
-                                    icon="arrow-down", 
-                                    icon_shape="marker", 
-                                    border_color='#9AA0A6', 
-                                    background_color='#9AA0A6',
-                                    number=str(stop_index))).add_to(demo_layer)
-            elif stop_index <= index_to:
-                folium.PolyLine(locations=segment_coordinates, color=colors[0]).add_to(demo_layer)
-                folium.Marker(location=segment_coordinates[-1],
-                                  icon=folium.plugins.BeautifyIcon(
-                                    icon="arrow-down", 
-                                    icon_shape="marker", 
-                                    border_color=colors[0], 
-                                    background_color=colors[0],
-                                    number=str(stop_index))).add_to(demo_layer)
-
-        # Add layer control and open map
-        folium.LayerControl().add_to(map)
-        map.fit_bounds(map.get_bounds())
-        map_name = './maps/map'+'_'+self.name+".html"
-        map.save(map_name)
-        #webbrowser.open(map_name, new=2)
-    
+        route_metrics = self.get_route_metrics(add_osrm_route_metric=add_osrm_route_metric)
+        return get_solution_metrics(route_metrics, original_solution_name)
+
+    @timed('plot.folium')
+    def plot_folium(self, compact=False, **options):
+        """
+        Saves the solutions on an interactive folium map in ./maps/map_<name>.html (see Plotting.plot_folium).
+        With compact the map has aggregated layers and simplified routes (see Plotting.export_folium_map for options).
+        """
+        if compact:
+            return Plotting.export_folium_map(self, **options)
+        Plotting.plot_folium(self)
+
+    @timed('plot.plotly')
     def plot(self, real=False):
-        # Depot
-        fig = go.Figure()
-        
-        # Routes
-        for solution_name, solution in self.get_solutions().items():
-            for route_name, index_list in solution.items():
-                coordinate_list = [self.get_coordinates()[index] for index in index_list]
-                if real:
-                    plot_coordinate_list, distance = osrm_get_route(coordinate_list)
-                else:
-                    plot_coordinate_list = coordinate_list
-                latitude, longitude = [list(x) for x in zip(*plot_coordinate_list)]
-                fig.add_trace(go.Scattermapbox(
-                    name= solution_name+' '+route_name,
-                    mode = 'lines',
-                    line=go.scattermapbox.Line(
-                        width=3,
-                        color='rgb(120, 120, 120)',
-                    ),
-                    lon = longitude,
-                    lat = latitude))
-            
-                # Markers
-                latitude, longitude = [list(x) for x in zip(*coordinate_list)]
-                fig.add_trace(go.Scattermapbox(
-                    name= solution_name+' '+route_name,
-                    mode = 'markers+text',
-                    marker=go.scattermapbox.Marker(
-                        size=30,
-                        color='rgb(255, 255, 255)',
-                        opacity=1.0
-                    ),
-                    text= [i for i in range(len(latitude))],
-                    lon = longitude,
-                    lat = latitude))
-                fig.add_trace(go.Scattermapbox(
-                    name= solution_name+' '+route_name,
-                    mode = 'markers+text',
-                    marker=go.scattermapbox.Marker(
-                        size=25,
-                        color='rgb(230, 96, 14)',
-                        opacity=1.0
-                    ),
-                    text= [i for i in range(len(latitude))],
-                    lon = longitude,
-                    lat = latitude))
-
-                
-
-
-        fig.update_layout(
-            margin ={'l':0,'t':0,'b':0,'r':0},
-            mapbox = {
-                'style': 'open-street-map',
-                #'style': 'carto-positron',
-                'zoom': 10,
-                'center': go.layout.mapbox.Center(lat=self.get_depot()[0], lon=self.get_depot()[1])
-                }
-            )
-
-        fig.show()
\ No newline at end of file
+        """Shows the solutions on a plotly map, with real the OSRM route geometry (see Plotting.plot)."""
+        Plotting.plot(self, real)
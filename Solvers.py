@@ -1,48 +1,386 @@
 """
 Functions to solve vehicle routing problems.
+
+OR-Tools works with integer arc costs. The distance matrix is converted once to an integer matrix (multiplied by a scale
+factor, e.g. scale=10 keeps decimeters of a matrix in meters) and, by default (native=True), registered as a transit
+matrix so the solver evaluates arcs without calling back into Python during the search.
+Costs are reported back in the units of the original matrix (see return_info).
+For large problems a SparseDistanceMatrix with only the neighbor arcs keeps the model linear in the number of stops.
 """
+import time
+from collections import deque
+import numpy as np
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
+from Instrumentation import span, add_span
+from DistanceMatrix import DistanceMatrix, SparseDistanceMatrix
+
+
+def to_integer_matrix(distance_matrix, scale=1):
+    """
+    Converts a distance matrix (nested lists, array or DistanceMatrix) to an int64 array of round(value * scale).
+    Unreachable pairs (None, NaN or inf) get a cost larger than any route through reachable pairs.
+    """
+    matrix = np.asarray(distance_matrix, dtype=np.float64) * scale
+    unreachable = ~np.isfinite(matrix)
+    if unreachable.any():
+        largest = np.max(matrix[~unreachable], initial=0)
+        matrix[unreachable] = min(largest * len(matrix) + 1, 2 ** 40)
+    return np.rint(matrix).astype(np.int64)
+
+
+def _as_matrix(distance_matrix):
+    """The distance matrix as a DistanceMatrix or a SparseDistanceMatrix, both look up arcs with take()."""
+    if isinstance(distance_matrix, (DistanceMatrix, SparseDistanceMatrix)):
+        return distance_matrix
+    return DistanceMatrix(distance_matrix)
+
+
+def _get_unreachable_cost(values, size):
+    """A cost larger than any route through the finite values."""
+    finite = values[np.isfinite(values)]
+    return min(finite.max(initial=0) * size + 1, 2 ** 40)
+
+
+def _register_sparse_distance(routing, manager, sparse_matrix, scale):
+    """
+    Registers the pairs of a SparseDistanceMatrix as a Python transit callback (OR-Tools has no native sparse transit).
+    The arcs that are not stored are estimated by the matrix when the search asks for them, or cost more than any route
+    when the matrix has no estimate. At most as many estimated arcs as stored pairs are kept, so memory stays linear.
+    """
+    size = sparse_matrix.size
+    values = sparse_matrix.values * scale
+    unreachable_cost = int(_get_unreachable_cost(values, size))
+    costs = dict(zip(sparse_matrix.keys.tolist(),
+                     np.where(np.isfinite(values), np.rint(values), unreachable_cost).astype(np.int64).tolist()))
+    max_costs = 2 * len(costs)
+
+    def distance_callback(from_index, to_index):
+        """Returns the distance between the two nodes."""
+        from_node = manager.IndexToNode(from_index)
+        to_node = manager.IndexToNode(to_index)
+        if from_node == to_node:
+            return 0
+        key = from_node * size + to_node
+        cost = costs.get(key)
+        if cost is None:
+            cost = unreachable_cost
+            if sparse_matrix.estimate is not None:
+                value = float(sparse_matrix.estimate(np.array([from_node]), np.array([to_node]))[0]) * scale
+                cost = int(round(value)) if np.isfinite(value) else unreachable_cost
+            if len(costs) < max_costs:
+                costs[key] = cost
+        return cost
+
+    return routing.RegisterTransitCallback(distance_callback)
+
+
+def _register_arc_costs(routing, manager, distance_matrix, scale, native):
+    """Registers the arc costs of a distance matrix (dense or a SparseDistanceMatrix), returns the transit index."""
+    if isinstance(distance_matrix, SparseDistanceMatrix):
+        return _register_sparse_distance(routing, manager, distance_matrix, scale)
+    return _register_distance(routing, manager, to_integer_matrix(distance_matrix, scale), native)
+
+
+def _register_distance(routing, manager, integer_matrix, native):
+    """
+    Registers the integer matrix (an int64 array) as transit evaluator, a native transit matrix or a Python callback.
+    OR-Tools copies a transit matrix from lists of ints, the rows are converted one at a time.
+    """
+    if native:
+        return routing.RegisterTransitMatrix([row.tolist() for row in integer_matrix])
+
+    def distance_callback(from_index, to_index):
+        """Returns the distance between the two nodes."""
+        # Convert from routing variable Index to distance matrix NodeIndex.
+        from_node = manager.IndexToNode(from_index)
+        to_node = manager.IndexToNode(to_index)
+        return int(integer_matrix[from_node, to_node])
+
+    return routing.RegisterTransitCallback(distance_callback)
+
+
+def _get_info(solution, distance_matrix, output, scale, monitor):
+    """
+    Objective and distance of the solution in the units of the original distance matrix, with the search trace
+    (list of (seconds, cost) per solution found) and the wall-clock time of the search.
+    The objective is the sum of the arc costs (the total distance). solver_objective is the cost the search minimized,
+    for the CVRP it also has the span cost of the longest route (1000 times its length), like the costs of the trace.
+    """
+    matrix = _as_matrix(distance_matrix)
+    route_distances = {}
+    for route_name, indices in output.items():
+        route_distances[route_name] = float(matrix.take(indices[:-1], indices[1:]).sum()) if len(indices) > 1 else 0.0
+    distance = sum(route_distances.values())
+    return {
+        'objective': distance,
+        'solver_objective': solution.ObjectiveValue() / scale,
+        'distance': distance,
+        'route_distances': route_distances,
+        'trace': monitor.trace,
+        'wall_time': time.time() - monitor.start_time,
+    }
+
+
+class SearchSettings:
+
+    """
+    Search control of the solvers.
+    first_solution_strategy: name of an OR-Tools FirstSolutionStrategy (e.g. 'PATH_CHEAPEST_ARC', 'SAVINGS')
+    local_search_metaheuristic: name of an OR-Tools LocalSearchMetaheuristic (e.g. 'GUIDED_LOCAL_SEARCH'), None for the
+        OR-Tools default (greedy descent, which stops in the first local optimum)
+    time_limit: wall-clock limit of the search in seconds, None for no limit (a metaheuristic then never stops by itself)
+    solution_limit: maximum number of solutions the search may find, None for no limit
+    plateau_window, plateau_threshold: stop the search once the best cost improved by less than plateau_threshold
+        (relative, e.g. 0.001 for 0.1%) during the last plateau_window seconds. None disables the plateau stop.
+    """
+
+    def __init__(self, first_solution_strategy='PATH_CHEAPEST_ARC', local_search_metaheuristic=None, time_limit=None,
+                 solution_limit=None, plateau_window=None, plateau_threshold=0.0):
+        self.first_solution_strategy = first_solution_strategy
+        self.local_search_metaheuristic = local_search_metaheuristic
+        self.time_limit = time_limit
+        self.solution_limit = solution_limit
+        self.plateau_window = plateau_window
+        self.plateau_threshold = plateau_threshold
+
+    def get_search_parameters(self):
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        search_parameters.first_solution_strategy = getattr(
+            routing_enums_pb2.FirstSolutionStrategy, self.first_solution_strategy)
+        if self.local_search_metaheuristic is not None:
+            search_parameters.local_search_metaheuristic = getattr(
+                routing_enums_pb2.LocalSearchMetaheuristic, self.local_search_metaheuristic)
+        if self.time_limit is not None:
+            search_parameters.time_limit.FromMilliseconds(int(self.time_limit * 1000))
+        if self.solution_limit is not None:
+            search_parameters.solution_limit = self.solution_limit
+        return search_parameters
+
+
+# Settings used when the solvers get no search settings
+DEFAULT_TSP_SEARCH = SearchSettings()
+DEFAULT_CVRP_SEARCH = SearchSettings(local_search_metaheuristic='GUIDED_LOCAL_SEARCH', time_limit=100)
+# With arcs restricted to neighbor lists a path-building first solution (PATH_CHEAPEST_ARC) easily runs into dead ends
+# and backtracks for a very long time, an insertion heuristic does not
+DEFAULT_TSP_NEIGHBORS_SEARCH = SearchSettings(first_solution_strategy='PARALLEL_CHEAPEST_INSERTION')
+DEFAULT_CVRP_NEIGHBORS_SEARCH = SearchSettings(first_solution_strategy='PARALLEL_CHEAPEST_INSERTION',
+                                               local_search_metaheuristic='GUIDED_LOCAL_SEARCH', time_limit=100)
+
 
-def get_tsp_solution(distance_matrix):
+class SearchMonitor:
+
+    """
+    Solution callback that records the time-to-quality trace of a search, (seconds since the start, cost of the
+    solution in the units of the original matrix) per solution, and stops the search on a plateau of the best cost.
+    """
+
+    def __init__(self, routing, settings, scale=1):
+        self.routing = routing
+        self.settings = settings
+        self.scale = scale
+        self.start_time = time.time()
+        self.trace = []
+        self.best_cost = None
+        # Best costs of the last plateau_window seconds, as (time, best cost)
+        self._window = deque()
+
+    def __call__(self):
+        elapsed = time.time() - self.start_time
+        cost = self.routing.CostVar().Value() / self.scale
+        self.trace.append((elapsed, cost))
+        if self.best_cost is None or cost < self.best_cost:
+            self.best_cost = cost
+        if self.settings.plateau_window is None:
+            return
+        self._window.append((elapsed, self.best_cost))
+        # Keep the newest point that is at least plateau_window seconds old as the reference
+        while len(self._window) > 1 and elapsed - self._window[1][0] >= self.settings.plateau_window:
+            self._window.popleft()
+        reference_time, reference_cost = self._window[0]
+        if elapsed - reference_time >= self.settings.plateau_window and reference_cost > 0:
+            if (reference_cost - self.best_cost) / reference_cost < self.settings.plateau_threshold:
+                self.routing.solver().FinishCurrentSearch()
+
+
+def repair_routes(routes, distance_matrix, nb_vehicles, capacities=None, demands=None, depot=0):
+    """
+    Turns the routes of a solution (e.g. the ORIGINAL routes or an earlier optimum) into nb_vehicles feasible routes of
+    the current problem, returned without the depot.
+    - The depot, unknown indices and repeated stops are removed from the routes.
+    - Routes that exceed the capacity of their vehicle are split, routes beyond nb_vehicles are dissolved.
+    - The stops that are not on a route (new stops, split off or dissolved stops) are inserted where they are the
+      cheapest, in a route that still has capacity for them. Stops that fit nowhere stay out of the routes.
+    capacities (one per vehicle) need the demands of every node.
+    """
+    if capacities is not None:
+        if demands is None:
+            raise ValueError("repair_routes needs the demands of the nodes to respect the capacities")
+        if len(capacities) < nb_vehicles:
+            raise ValueError(f"repair_routes got {len(capacities)} capacities for {nb_vehicles} vehicles")
+    matrix = _as_matrix(distance_matrix)
+    unreachable_cost = _get_unreachable_cost(matrix.values if isinstance(matrix, SparseDistanceMatrix)
+                                             else matrix.storage, len(matrix))
+
+    def get_costs(from_nodes, to_nodes):
+        costs = matrix.take(from_nodes, to_nodes)
+        return np.where(np.isfinite(costs), costs, unreachable_cost)
+
+    n = len(matrix)
+    if capacities is not None and len(demands) != n:
+        raise ValueError(f"repair_routes got {len(demands)} demands for a matrix of {n} nodes")
+    if isinstance(routes, dict):
+        routes = list(routes.values())
+    if capacities is None:
+        capacities = [float('inf')] * nb_vehicles
+        demands = [0] * n
+
+    seen = set()
+    split_routes = []
+    for route in routes:
+        current_route, load = [], 0
+        for node in route:
+            node = int(node)
+            if node == depot or not 0 <= node < n or node in seen:
+                continue
+            seen.add(node)
+            vehicle = len(split_routes)
+            capacity = capacities[vehicle] if vehicle < nb_vehicles else max(capacities)
+            if current_route and load + demands[node] > capacity:
+                split_routes.append(current_route)
+                current_route, load = [], 0
+            current_route.append(node)
+            load += demands[node]
+        if current_route:
+            split_routes.append(current_route)
+
+    repaired_routes = [[] for _ in range(nb_vehicles)]
+    loads = [0] * nb_vehicles
+    for vehicle, route in enumerate(split_routes[:nb_vehicles]):
+        route_load = sum(demands[node] for node in route)
+        if route_load <= capacities[vehicle]:
+            repaired_routes[vehicle] = route
+            loads[vehicle] = route_load
+    assigned = {node for route in repaired_routes for node in route}
+    missing = [node for node in range(n) if node != depot and node not in assigned]
+
+    for node in missing:
+        best = None
+        for vehicle, route in enumerate(repaired_routes):
+            if loads[vehicle] + demands[node] > capacities[vehicle]:
+                continue
+            path = np.array([depot] + route + [depot])
+            insertion_costs = (get_costs(path[:-1], node) + get_costs(node, path[1:]) -
+                               get_costs(path[:-1], path[1:]))
+            position = int(np.argmin(insertion_costs))
+            if best is None or insertion_costs[position] < best[0]:
+                best = (insertion_costs[position], vehicle, position)
+        if best is not None:
+            _, vehicle, position = best
+            repaired_routes[vehicle].insert(position, node)
+            loads[vehicle] += demands[node]
+    return repaired_routes
+
+
+def restrict_to_neighbors(routing, manager, neighbors, depot=0):
+    """
+    Restricts the arcs of the model to the neighbor lists: after a stop the vehicle can only go to one of the neighbors
+    of the stop or back to the depot. The lists are made symmetric first (if j is a neighbor of i, i also becomes a
+    neighbor of j) so every stop keeps arcs in both directions. The arcs out of the depot are not restricted.
+    """
+    n = len(neighbors)
+    symmetric_neighbors = [set() for _ in range(n)]
+    for node, node_neighbors in enumerate(neighbors):
+        for neighbor in node_neighbors:
+            neighbor = int(neighbor)
+            if neighbor != node and 0 <= neighbor < n:
+                symmetric_neighbors[node].add(neighbor)
+                symmetric_neighbors[neighbor].add(node)
+    end_indices = [routing.End(vehicle) for vehicle in range(routing.vehicles())]
+    for node in range(n):
+        if node == depot:
+            continue
+        allowed = [manager.NodeToIndex(neighbor) for neighbor in symmetric_neighbors[node] if neighbor != depot]
+        routing.NextVar(manager.NodeToIndex(node)).SetValues(allowed + end_indices)
+
+
+def _solve(routing, manager, settings, scale, initial_routes=None, model='tsp', build_start=None):
+    """
+    Solves the model with the search settings, from the initial routes (node indices without the depot, one list per
+    vehicle) if given. Returns the solution and the search monitor.
+    The time since build_start (time.perf_counter() when the model building started) is recorded as the solver.build
+    span and the search as the solver.search span of the model.
+    """
+    monitor = SearchMonitor(routing, settings, scale)
+    routing.AddAtSolutionCallback(monitor)
+    search_parameters = settings.get_search_parameters()
+    initial_assignment = None
+    if initial_routes is not None:
+        routing.CloseModelWithParameters(search_parameters)
+        initial_assignment = routing.ReadAssignmentFromRoutes(
+            [[manager.NodeToIndex(node) for node in route] for route in initial_routes], True)
+        if initial_assignment is None:
+            print("initial solution is infeasible, solving from scratch")
+    if build_start is not None:
+        add_span('solver.build', time.perf_counter() - build_start, model=model)
+    with span('solver.search', model=model):
+        if initial_assignment is None:
+            solution = routing.SolveWithParameters(search_parameters)
+        else:
+            solution = routing.SolveFromAssignmentWithParameters(initial_assignment, search_parameters)
+    return solution, monitor
+
+
+def get_tsp_solution(distance_matrix, scale=1, native=True, return_info=False, search_settings=None,
+                     initial_solution=None, neighbors=None, restrict_arcs=True):
+    """
+    Solves the TSP of the distance matrix that starts and ends in node 0.
+    Returns a solution dict {'TSP_1': [indices in visiting order]}, with return_info a tuple (solution, info) where info
+    has the objective and the distance of the solution in the units of distance_matrix and the search trace.
+    search_settings: SearchSettings of the search, default DEFAULT_TSP_SEARCH, with neighbors DEFAULT_TSP_NEIGHBORS_SEARCH
+    initial_solution: solution dict (or list of index lists) to start the search from, e.g. the ORIGINAL routes or an
+        earlier optimum. Multiple routes are chained, missing stops are inserted (see repair_routes).
+    neighbors: list of neighbor indices per stop (e.g. SpatialIndex.k_nearest_neighbors) to restrict the arcs of the
+        search (see restrict_to_neighbors). Without a solution on the restricted arcs, the problem is solved again
+        without the restriction.
+    distance_matrix can also be a SparseDistanceMatrix (see OSRM.get_sparse_distance_matrix), evaluated in a Python
+        callback. Without neighbors the arcs are restricted to its stored pairs (unless restrict_arcs is False).
+    """
+    build_start = time.perf_counter()
 
     """Stores the data for the problem."""
     data = {
-            "distance_matrix": distance_matrix,
             "num_vehicles": 1,
             "depot": 0
             }
 
     # Create the routing index manager.
     manager = pywrapcp.RoutingIndexManager(
-        len(data["distance_matrix"]), data["num_vehicles"], data["depot"]
+        len(distance_matrix), data["num_vehicles"], data["depot"]
     )
 
     # Create Routing Model.
     routing = pywrapcp.RoutingModel(manager)
 
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data["distance_matrix"][from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    transit_callback_index = _register_arc_costs(routing, manager, distance_matrix, scale, native)
 
     # Define cost of each arc.
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    )
-    #search_parameters.time_limit.seconds = 20
-    
+    # Restrict the arcs to the neighbors of every stop (the stored arcs of a sparse matrix).
+    if neighbors is None and restrict_arcs and isinstance(distance_matrix, SparseDistanceMatrix):
+        neighbors = distance_matrix.get_neighbors()
+    if neighbors is not None:
+        restrict_to_neighbors(routing, manager, neighbors, data["depot"])
 
-    # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
+    # Solve the problem (from the repaired initial solution).
+    initial_routes = None
+    if initial_solution is not None:
+        routes = list(initial_solution.values()) if isinstance(initial_solution, dict) else initial_solution
+        initial_routes = repair_routes([[node for route in routes for node in route]], distance_matrix, 1)
+    default_search = DEFAULT_TSP_SEARCH if neighbors is None else DEFAULT_TSP_NEIGHBORS_SEARCH
+    solution, monitor = _solve(routing, manager, search_settings or default_search, scale, initial_routes,
+                               model='tsp', build_start=build_start)
 
     # Save sequence of stops.
     if solution:
@@ -54,38 +392,68 @@ def get_tsp_solution(distance_matrix):
             index = solution.Value(routing.NextVar(index))
         route_indices.append(manager.IndexToNode(index))
         output["TSP_1"] = route_indices
+        if return_info:
+            return output, _get_info(solution, distance_matrix, output, scale, monitor)
         return output
     
     else:
-        return {}
+        if neighbors is not None:
+            print("no solution on the neighbor arcs, solving without them")
+            return get_tsp_solution(distance_matrix, scale, native, return_info, search_settings, initial_solution,
+                                    restrict_arcs=False)
+        return ({}, None) if return_info else {}
+
+def get_cvrp_solution(distance_matrix, nb_vehicles, capacities, demands, scale=1, native=True, return_info=False,
+                      search_settings=None, initial_solution=None, neighbors=None, restrict_arcs=True, mode='direct',
+                      coordinate_list=None, decomposition_options=None):
+    """
+    Solves the CVRP of the distance matrix with nb_vehicles vehicles that start and end in node 0.
+    Returns a solution dict {'truck_<i>': [indices in visiting order]}, with return_info a tuple (solution, info) where
+    info has the objective and the distance of the solution in the units of distance_matrix and the search trace.
+    search_settings: SearchSettings of the search, default DEFAULT_CVRP_SEARCH (guided local search during 100 s), with
+        neighbors DEFAULT_CVRP_NEIGHBORS_SEARCH
+    initial_solution: solution dict (or list of index lists) to start the search from, e.g. the original routes or an
+        earlier optimum. Infeasible routes are repaired first (see repair_routes).
+    neighbors: list of neighbor indices per stop (e.g. SpatialIndex.k_nearest_neighbors) to restrict the arcs of the
+        search (see restrict_to_neighbors). Without a solution on the restricted arcs, the problem is solved again
+        without the restriction.
+    distance_matrix can also be a SparseDistanceMatrix (see OSRM.get_sparse_distance_matrix), evaluated in a Python
+        callback. Without neighbors the arcs are restricted to its stored pairs (unless restrict_arcs is False).
+    mode: 'direct' solves one model with all the vehicles and stops, 'decomposed' solves cluster-first, route-second
+        for large days (see Decomposition.get_decomposed_cvrp_solution): the stops of coordinate_list (the depot first)
+        are clustered, every cluster is solved with search_settings and the clusters are stitched. decomposition_options
+        are the other keyword arguments of get_decomposed_cvrp_solution (method, vehicles_per_cluster, polish, ...).
+        initial_solution and neighbors are only used by the direct mode.
+    """
+    if mode == 'decomposed':
+        if coordinate_list is None:
+            raise ValueError("the decomposed mode needs the coordinate_list of the stops to cluster them")
+        # Imported here, Decomposition imports this module
+        from Decomposition import get_decomposed_cvrp_solution
+        return get_decomposed_cvrp_solution(distance_matrix, nb_vehicles, capacities, demands, coordinate_list,
+                                            cluster_search_settings=search_settings, scale=scale, native=native,
+                                            return_info=return_info, **(decomposition_options or {}))
+    if mode != 'direct':
+        raise ValueError(f"unknown CVRP mode {mode}, use 'direct' or 'decomposed'")
+    build_start = time.perf_counter()
 
-def get_cvrp_solution(distance_matrix, nb_vehicles, capacities, demands):
-    
     # Stores data of model
     data = {}
-    data["distance_matrix"] = distance_matrix
-    data["demands"] = demands
+    data["demands"] = [int(demand) for demand in demands]
     data["vehicle_capacities"] = capacities
     data["num_vehicles"] = nb_vehicles
     data["depot"] = 0
     
     # Create the routing index manager.
     manager = pywrapcp.RoutingIndexManager(
-        len(data["distance_matrix"]), data["num_vehicles"], data["depot"]
+        len(distance_matrix), data["num_vehicles"], data["depot"]
     )
 
     # Create Routing Model.
     routing = pywrapcp.RoutingModel(manager)
 
-     # Create and register a transit callback.
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data["distance_matrix"][from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+     # Create and register a transit matrix (or callback).
+    transit_callback_index = _register_arc_costs(routing, manager, distance_matrix, scale, native)
 
     # Define cost of each arc.
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
@@ -94,7 +462,7 @@ def get_cvrp_solution(distance_matrix, nb_vehicles, capacities, demands):
     routing.AddDimension(
         transit_callback_index,
         0,       # no slack
-        100000,  # vehicle maximum travel distance
+        100000 * scale,  # vehicle maximum travel distance
         True,    # start cumul to zero
         dimension_name,
     )
@@ -102,13 +470,16 @@ def get_cvrp_solution(distance_matrix, nb_vehicles, capacities, demands):
     distance_dimension.SetGlobalSpanCostCoefficient(1000)
 
     # Add Capacity constraint.
-    def demand_callback(from_index):
-        """Returns the demand of the node."""
-        # Convert from routing variable Index to demands NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        return data["demands"][from_node]
+    if native:
+        demand_callback_index = routing.RegisterUnaryTransitVector(data["demands"])
+    else:
+        def demand_callback(from_index):
+            """Returns the demand of the node."""
+            # Convert from routing variable Index to demands NodeIndex.
+            from_node = manager.IndexToNode(from_index)
+            return data["demands"][from_node]
 
-    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
     routing.AddDimensionWithVehicleCapacity(
         demand_callback_index,
         0,  # null capacity slack
@@ -117,18 +488,20 @@ def get_cvrp_solution(distance_matrix, nb_vehicles, capacities, demands):
         "Capacity",
     )
 
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-    )
-    search_parameters.local_search_metaheuristic = (
-        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-    )
-    search_parameters.time_limit.FromSeconds(100)
+    # Restrict the arcs to the neighbors of every stop (the stored arcs of a sparse matrix).
+    if neighbors is None and restrict_arcs and isinstance(distance_matrix, SparseDistanceMatrix):
+        neighbors = distance_matrix.get_neighbors()
+    if neighbors is not None:
+        restrict_to_neighbors(routing, manager, neighbors, data["depot"])
 
-    # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
+    # Solve the problem (from the repaired initial solution).
+    initial_routes = None
+    if initial_solution is not None:
+        initial_routes = repair_routes(initial_solution, distance_matrix, nb_vehicles, data["vehicle_capacities"],
+                                       data["demands"])
+    default_search = DEFAULT_CVRP_SEARCH if neighbors is None else DEFAULT_CVRP_NEIGHBORS_SEARCH
+    solution, monitor = _solve(routing, manager, search_settings or default_search, scale, initial_routes,
+                               model='cvrp', build_start=build_start)
 
     # Print solution on console.
     if solution:
@@ -142,7 +515,13 @@ def get_cvrp_solution(distance_matrix, nb_vehicles, capacities, demands):
                 index = solution.Value(routing.NextVar(index))
             index_list.append(manager.IndexToNode(index))
             output["truck_" + str(vehicle_id)] = index_list
+        if return_info:
+            return output, _get_info(solution, distance_matrix, output, scale, monitor)
         return output
     else:
+        if neighbors is not None:
+            print("no solution on the neighbor arcs, solving without them")
+            return get_cvrp_solution(distance_matrix, nb_vehicles, capacities, demands, scale, native, return_info,
+                                     search_settings, initial_solution, restrict_arcs=False)
         print("no solution")
-        return {}
\ No newline at end of file
+        return ({}, None) if return_info else {}
\ No newline at end of file
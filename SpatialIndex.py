@@ -0,0 +1,108 @@
+"""
+Grid index over (latitude, longitude) coordinates for nearest-neighbor queries.
+
+The coordinates are projected on a local plane (equirectangular around their mean latitude, accurate for a city) and
+put in square grid cells sized so that a cell holds a few points on average. A query only looks at the cells around the
+query point and grows the ring of cells until the k nearest points are certain, so finding the k nearest neighbors of
+every stop costs about O(N * k) instead of the O(N^2) of a full distance matrix.
+"""
+import numpy as np
+
+MEAN_EARTH_RADIUS = 6371008.8
+
+
+class SpatialIndex:
+
+    def __init__(self, coordinate_list, points_per_cell=4):
+        """coordinate_list: list of (latitude, longitude) of the indexed points"""
+        coordinates = np.asarray(coordinate_list, dtype=np.float64).reshape(-1, 2)
+        self.reference_latitude = np.radians(coordinates[:, 0].mean()) if len(coordinates) else 0.0
+        self.points = self.project(coordinates)
+        self.origin = self.points.min(axis=0) if len(self.points) else np.zeros(2)
+        extent = (self.points.max(axis=0) - self.origin) if len(self.points) else np.zeros(2)
+        area = max(extent[0] * extent[1], 1.0)
+        self.cell_size = max(np.sqrt(area * points_per_cell / max(len(self.points), 1)), 1.0)
+        cells = self._cells_of(self.points)
+        self.nb_cells = cells.max(axis=0) + 1 if len(cells) else np.ones(2, dtype=np.int64)
+        # Points sorted per cell, cell_start[c]:cell_start[c+1] are the points of flat cell c
+        flat_cells = cells[:, 0] * self.nb_cells[1] + cells[:, 1]
+        self.order = np.argsort(flat_cells, kind='stable')
+        self.cell_start = np.searchsorted(flat_cells[self.order], np.arange(self.nb_cells[0] * self.nb_cells[1] + 1))
+
+    def project(self, coordinates):
+        """Projects (latitude, longitude) coordinates to meters on the local plane of the index."""
+        coordinates = np.radians(np.asarray(coordinates, dtype=np.float64).reshape(-1, 2))
+        return np.column_stack([
+            coordinates[:, 1] * np.cos(self.reference_latitude) * MEAN_EARTH_RADIUS,
+            coordinates[:, 0] * MEAN_EARTH_RADIUS,
+        ])
+
+    def _cells_of(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def _points_in_cells(self, cell_x_range, cell_y_range):
+        x_range = range(max(cell_x_range[0], 0), min(cell_x_range[1], self.nb_cells[0] - 1) + 1)
+        y_start = max(cell_y_range[0], 0)
+        y_stop = min(cell_y_range[1], self.nb_cells[1] - 1)
+        if y_start > y_stop:
+            return np.empty(0, dtype=np.int64)
+        # The cells of one grid row are consecutive, so one slice per row
+        slices = []
+        for x in x_range:
+            row_start = x * self.nb_cells[1]
+            slices.append(self.order[self.cell_start[row_start + y_start]:self.cell_start[row_start + y_stop + 1]])
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def query(self, coordinate_list, k=1):
+        """
+        Returns (indices, distances), both len(coordinate_list) x k: the k nearest indexed points of every query
+        coordinate, nearest first, and their (planar) distance in meters. When there are fewer than k indexed points the
+        missing neighbors have index -1 and distance inf.
+        """
+        return self._query_points(self.project(coordinate_list), k)
+
+    def _query_points(self, query_points, k):
+        m = len(query_points)
+        indices = np.full((m, k), -1, dtype=np.int64)
+        distances = np.full((m, k), np.inf)
+        if m == 0 or len(self.points) == 0 or k == 0:
+            return indices, distances
+        k_found = min(k, len(self.points))
+        query_cells = self._cells_of(query_points)
+        # Queries in the same cell share their candidates
+        group_cells, group_ids = np.unique(query_cells, axis=0, return_inverse=True)
+        group_ids = group_ids.reshape(-1)
+        members_order = np.argsort(group_ids, kind='stable')
+        group_bounds = np.searchsorted(group_ids[members_order], np.arange(len(group_cells) + 1))
+        last_cell = self.nb_cells - 1
+        for group_id, (cell_x, cell_y) in enumerate(group_cells):
+            members = members_order[group_bounds[group_id]:group_bounds[group_id + 1]]
+            # Query cells outside the grid start with the first ring that reaches the grid
+            ring = max(0, -cell_x, -cell_y, cell_x - last_cell[0], cell_y - last_cell[1])
+            while True:
+                candidates = self._points_in_cells((cell_x - ring, cell_x + ring), (cell_y - ring, cell_y + ring))
+                covers_grid = (cell_x - ring <= 0 and cell_y - ring <= 0 and
+                               cell_x + ring >= last_cell[0] and cell_y + ring >= last_cell[1])
+                if len(candidates) >= k_found:
+                    candidate_distances = np.hypot(
+                        query_points[members, 0:1] - self.points[candidates, 0][None, :],
+                        query_points[members, 1:2] - self.points[candidates, 1][None, :])
+                    nearest = np.argpartition(candidate_distances, k_found - 1, axis=1)[:, :k_found]
+                    nearest_distances = np.take_along_axis(candidate_distances, nearest, axis=1)
+                    # Points outside the ring are at least ring * cell_size away from the query cell
+                    if covers_grid or nearest_distances[:, -1].max() <= ring * self.cell_size:
+                        break
+                ring += 1
+            order = np.argsort(nearest_distances, axis=1)
+            indices[members, :k_found] = candidates[np.take_along_axis(nearest, order, axis=1)]
+            distances[members, :k_found] = np.take_along_axis(nearest_distances, order, axis=1)
+        return indices, distances
+
+    def k_nearest_neighbors(self, k):
+        """Returns the k nearest other indexed points of every indexed point (len x k array of indices)."""
+        k = max(min(k, len(self.points) - 1), 0)
+        indices, _ = self._query_points(self.points, k + 1)
+        neighbors = np.empty((len(indices), k), dtype=np.int64)
+        for point, row in enumerate(indices):
+            neighbors[point] = row[row != point][:k]
+        return neighbors
@@ -1,20 +1,23 @@
 from DatasetClasses import DatasetReader
-from RoutingProblem import RoutingProblem
-from Distances import get_straight_line_distance_matrix, get_route_straight_line_distance
+from RoutingProblem import RoutingProblem, get_problem_name
+from Distances import get_straight_line_distance_array, get_route_straight_line_distance
 from Solvers import get_tsp_solution
 from OSRM import osrm_get_matrix
-import pandas as pd
+from MetricsSink import MetricsSink
 
 dataset_name = 'DATASET_SERVICEFREQS_NODUP_20240405.csv'
 dataset = DatasetReader(file=dataset_name)
 
-metrics_df = None
+# Metrics are appended to the CSV per batch of routes, a rerun skips the routes that are already in it
+metrics_sink = MetricsSink('solution_metrics.csv')
 
 for day in range(1, 8):
     routes = dataset.get_routes_of_day(day)
     for route in routes:
         print(route)
-        problem_name = str.replace(route, ' ', '_')
+        problem_name = get_problem_name(route)
+        if metrics_sink.is_done(problem_name):
+            continue
         routing_problem = RoutingProblem(problem_name)
         if routing_problem.is_saved():
             # Load a routing problem
@@ -26,11 +29,11 @@ for day in range(1, 8):
             routing_problem.add_coordinates(coordinate_list)
             routing_problem.add_solution('ORIGINAL', original_solution)
 
-            # Calculate the straight line distance matrix and solution and store
-            straight_line_matrix = get_straight_line_distance_matrix(routing_problem.get_coordinates())
-            solution_straight_line_indices = get_tsp_solution(straight_line_matrix)
-
-            routing_problem.add_distance_matrix('straight_line', straight_line_matrix)
+            # Calculate the straight line distance matrix (stored condensed, it is symmetric) and solution and store
+            straight_line_matrix = get_straight_line_distance_array(routing_problem.get_coordinates())
+            routing_problem.add_distance_matrix('straight_line', straight_line_matrix, kind='straight_line',
+                                                condensed=True)
+            solution_straight_line_indices = get_tsp_solution(routing_problem.get_distance_matrix('straight_line'))
             routing_problem.add_solution('OPTIMAL (STRAIGHT-LINE)', solution_straight_line_indices)
 
             # Calculate the OSRM distance and time matrix, get the solutions and store
@@ -52,11 +55,8 @@ for day in range(1, 8):
 
         # CALCULATE METRICS OF THE ROUTING PROBLEM SOLUTIONS
         routing_problem_metrics_df = routing_problem.get_metrics(original_solution_name='ORIGINAL', add_osrm_route_metric=True)
-        if metrics_df is None:
-            metrics_df = routing_problem_metrics_df
-        else:
-            metrics_df = pd.concat([metrics_df, routing_problem_metrics_df])
-        print(metrics_df)
+        metrics_sink.write(routing_problem_metrics_df)
+        print(routing_problem_metrics_df)
 
     # SAVE METRICS
-    metrics_df.to_csv('solution_metrics.csv', sep=';', index=False)
+    metrics_sink.flush()
@@ -1,16 +1,23 @@
 from DatasetClasses import DatasetReader
 from RoutingProblem import RoutingProblem
-from Distances import get_straight_line_distance_matrix, get_route_straight_line_distance
+from Distances import get_straight_line_distance_array, get_route_straight_line_distance
 from Solvers import get_cvrp_solution
 from OSRM import osrm_get_matrix
-import pandas as pd
+from MetricsSink import MetricsSink
 
 dataset_name = 'DATASET_SERVICEFREQS_NODUP_20240405.csv'
 dataset = DatasetReader(file=dataset_name)
 
-metrics_df = None
+# 'direct' solves every day as one model, 'decomposed' clusters the stops first and solves the clusters in parallel
+# (see Decomposition.py), for days that are too large for one model
+CVRP_MODE = 'direct'
+
+# Metrics are appended to the CSV after every day, a rerun skips the days that are already in it
+metrics_sink = MetricsSink('solution_metrics_cvrp.csv', batch_size=1)
 
 for day in range(1, 7):
+    if metrics_sink.is_done('DAY_'+str(day)):
+        continue
     # CREATE A ROUTING PROBLEM
     routing_problem = RoutingProblem('DAY_'+str(day))
     print(day)
@@ -32,22 +39,22 @@ for day in range(1, 7):
         routing_problem.set_capacities(nb_trucks, capacity_stops)
 
         # CALCULATE DISTANCE MATRIX
-        straight_line_matrix = get_straight_line_distance_matrix(coordinates)
-        routing_problem.add_distance_matrix('straight-line', straight_line_matrix)
+        straight_line_matrix = get_straight_line_distance_array(coordinates)
+        routing_problem.add_distance_matrix('straight-line', straight_line_matrix, kind='straight_line', condensed=True)
         osrm_dist, osrm_time = osrm_get_matrix(routing_problem.get_coordinates())
         routing_problem.add_distance_matrix('osrm-distance', osrm_dist)
         routing_problem.add_distance_matrix('osrm-time', osrm_time)
         
         # Solve the CVRP with straight line
-        straight_line_solution = get_cvrp_solution(routing_problem.get_distance_matrix('straight-line'), routing_problem.get_nb_vehicles(), routing_problem.get_capacities(), routing_problem.get_demands())
+        straight_line_solution = get_cvrp_solution(routing_problem.get_distance_matrix('straight-line'), routing_problem.get_nb_vehicles(), routing_problem.get_capacities(), routing_problem.get_demands(), mode=CVRP_MODE, coordinate_list=coordinates)
         routing_problem.add_solution('straight_line_solution', straight_line_solution)
         print('straight line done')
         # Solve the CVRP with OSRM Distance
-        solution_osrm_dist_indices = get_cvrp_solution(routing_problem.get_distance_matrix('osrm-distance'), routing_problem.get_nb_vehicles(), routing_problem.get_capacities(), routing_problem.get_demands())
+        solution_osrm_dist_indices = get_cvrp_solution(routing_problem.get_distance_matrix('osrm-distance'), routing_problem.get_nb_vehicles(), routing_problem.get_capacities(), routing_problem.get_demands(), mode=CVRP_MODE, coordinate_list=coordinates)
         routing_problem.add_solution('osrm-distance', solution_osrm_dist_indices)
         print('osrm distance done')
         # Solve the CVRP with OSRM Time
-        solution_osrm_time_indices  = get_cvrp_solution(routing_problem.get_distance_matrix('osrm-time'), routing_problem.get_nb_vehicles(), routing_problem.get_capacities(), routing_problem.get_demands())
+        solution_osrm_time_indices  = get_cvrp_solution(routing_problem.get_distance_matrix('osrm-time'), routing_problem.get_nb_vehicles(), routing_problem.get_capacities(), routing_problem.get_demands(), mode=CVRP_MODE, coordinate_list=coordinates)
         routing_problem.add_solution('osrm-time', solution_osrm_time_indices)
         print('osrm time done')
 
@@ -58,10 +65,7 @@ for day in range(1, 7):
 
     routing_problem.plot(real=True)
     routing_problem_metrics_df = routing_problem.get_metrics(original_solution_name='original', add_osrm_route_metric=True)
-    if metrics_df is None:
-        metrics_df = routing_problem_metrics_df
-    else:
-        metrics_df = pd.concat([metrics_df, routing_problem_metrics_df])
-    print(metrics_df)
+    metrics_sink.write(routing_problem_metrics_df)
+    print(routing_problem_metrics_df)
 
-metrics_df.to_csv('solution_metrics_cvrp.csv', sep=';', index=False)
\ No newline at end of file
+metrics_sink.close()
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+Tests of BatchRunner with small workers (no OSRM server needed). Run with python -m pytest.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from BatchRunner import BatchRunner
+
+
+def _square(value):
+    return value * value
+
+
+def _pool_worker(job):
+    # Workers may start processes of their own (e.g. Decomposition.get_decomposed_cvrp_solution)
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        total = sum(pool.map(_square, range(job['n'])))
+    return pd.DataFrame({'Routing Problem': [job['name']], 'Total': [total]})
+
+
+def _sleeping_worker(job):
+    time.sleep(job['sleep'])
+    return pd.DataFrame({'Routing Problem': [job['name']], 'Total': [0]})
+
+
+def test_worker_with_child_processes(tmp_path):
+    runner = BatchRunner(worker=_pool_worker, max_workers=2, results_directory=str(tmp_path))
+    metrics_df, statuses = runner.run([{'name': 'BA DI RES1', 'n': 4}, {'name': 'BA WO RES2', 'n': 3}])
+    assert statuses == {'BA DI RES1': 'done', 'BA WO RES2': 'done'}
+    assert metrics_df['Total'].tolist() == [14, 5]
+    # The results are saved under the name with '_' for spaces, like the routing problems
+    assert sorted(os.listdir(tmp_path)) == ['BA_DI_RES1.csv', 'BA_WO_RES2.csv']
+
+    _, statuses = runner.run([{'name': 'BA DI RES1', 'n': 4}])
+    assert statuses['BA DI RES1'] == 'skipped'
+
+
+def test_timeout_terminates_the_worker(tmp_path):
+    runner = BatchRunner(worker=_sleeping_worker, max_workers=2, time_budget=0.5, results_directory=str(tmp_path))
+    metrics_df, statuses = runner.run([{'name': 'slow', 'sleep': 30}, {'name': 'fast', 'sleep': 0}])
+    assert statuses == {'slow': 'timeout', 'fast': 'done'}
+    assert metrics_df['Routing Problem'].tolist() == ['fast']
@@ -0,0 +1,77 @@
+"""
+Tests of the DatasetReader on a small CSV: merging of the duplicate rows, the day of the routes and the npz cache.
+Run with python -m pytest.
+"""
+import os
+import numpy as np
+import pytest
+from DatasetClasses import DatasetReader
+
+DEPOT = (51.02, 3.74)
+# Without day column: the days are in the route names (DI is Tuesday, VR is Friday). The second and third rows of
+# BA DI RES1 are one stop, the route comes back to its first location at the end.
+ROWS = [
+    ('BA DI RES1', 51.01, 3.71, 2),
+    ('BA DI RES1', 51.02, 3.72, 1),
+    ('BA DI RES1', 51.02, 3.72, 3),
+    ('BA DI RES1', 51.03, 3.73, 1),
+    ('BA DI RES1', 51.01, 3.71, 4),
+    ('BA VR RES2', 51.05, 3.75, 1),
+    ('BA VR RES2', 51.06, 3.76, 2),
+]
+
+
+def _write_csv(path, rows):
+    with open(path, 'w') as out:
+        out.write('ROUTE;LATITUDE;LONGITUDE;CONTAINERS\n')
+        for route, latitude, longitude, containers in rows:
+            out.write(f"{route};{latitude};{longitude};{containers}\n")
+
+
+@pytest.fixture
+def dataset_file(tmp_path):
+    path = tmp_path / 'dataset.csv'
+    _write_csv(path, ROWS)
+    return str(path)
+
+
+def test_consecutive_duplicates_are_merged_and_revisits_kept(dataset_file):
+    dataset = DatasetReader(dataset_file, depot=DEPOT, cache_directory=None)
+    coordinates, original_solution = dataset.get_routing_problem_data_for_route('BA DI RES1')
+    assert np.allclose(coordinates, [DEPOT, (51.01, 3.71), (51.02, 3.72), (51.03, 3.73), (51.01, 3.71)])
+    assert original_solution == {'TSP_1': [0, 1, 2, 3, 4, 0]}
+    assert dataset.get_route_containers('BA DI RES1').tolist() == [2, 4, 1, 4]
+    assert dataset.nb_stops == 6
+
+
+def test_days_from_the_route_names(dataset_file):
+    dataset = DatasetReader(dataset_file, depot=DEPOT, cache_directory=None)
+    assert dataset.get_days() == [2, 5]
+    assert dataset.get_routes_of_day(2) == ['BA DI RES1']
+    assert dataset.get_routes_of_day(5) == ['BA VR RES2']
+    assert dataset.get_routes_of_day(1) == []
+    coordinates, original_solution, demand_stops, demand_containers = dataset.get_cvrp_data(5)
+    assert np.allclose(coordinates, [DEPOT, (51.05, 3.75), (51.06, 3.76)])
+    assert original_solution == {'truck_0': [0, 1, 2, 0]}
+    assert demand_stops.tolist() == [0, 1, 1] and demand_containers.tolist() == [0, 1, 2]
+
+
+def test_cache_is_used_until_the_csv_changes(dataset_file, tmp_path, monkeypatch):
+    cache_directory = str(tmp_path / 'cache')
+    DatasetReader(dataset_file, depot=DEPOT, cache_directory=cache_directory)
+    assert len(os.listdir(cache_directory)) == 1
+
+    # An unchanged CSV is read from the cache
+    def fail_parse(self):
+        raise AssertionError('the CSV is parsed again')
+    with monkeypatch.context() as patch:
+        patch.setattr(DatasetReader, '_parse', fail_parse)
+        assert DatasetReader(dataset_file, depot=DEPOT, cache_directory=cache_directory).nb_stops == 6
+
+    # Same size, another modification time: the cache is stale and the CSV is parsed again
+    _write_csv(dataset_file, [(route, latitude, longitude, 9 - containers)
+                              for route, latitude, longitude, containers in ROWS])
+    stat = os.stat(dataset_file)
+    os.utime(dataset_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    dataset = DatasetReader(dataset_file, depot=DEPOT, cache_directory=cache_directory)
+    assert dataset.get_route_containers('BA DI RES1').tolist() == [7, 14, 8, 5]
@@ -0,0 +1,78 @@
+"""
+Tests of the cluster-first, route-second CVRP (Decomposition.py) on seeded InstanceGenerator instances.
+Run with python -m pytest.
+"""
+import re
+import numpy as np
+import pytest
+from Decomposition import get_vehicle_groups, sweep_clusters, kmeans_clusters, get_decomposed_cvrp_solution
+from DistanceMatrix import DistanceMatrix
+from Distances import get_straight_line_distance_array
+from InstanceGenerator import generate_cvrp_instance
+from Solvers import SearchSettings, get_cvrp_solution
+
+FAST_SEARCH = SearchSettings(local_search_metaheuristic='GUIDED_LOCAL_SEARCH', time_limit=1)
+
+
+@pytest.fixture(scope='module')
+def instance():
+    return generate_cvrp_instance(80, seed=7, stops_per_truck=20)
+
+
+def _check_clusters(clusters, instance, group_capacities):
+    stops = [node for cluster in clusters for node in cluster]
+    # Every stop exactly once, never the depot
+    assert sorted(stops) == list(range(1, len(instance['coordinates'])))
+    for cluster, capacity in zip(clusters, group_capacities):
+        assert sum(instance['demands'][node] for node in cluster) <= capacity
+
+
+@pytest.mark.parametrize('clustering', [sweep_clusters, kmeans_clusters])
+@pytest.mark.parametrize('vehicles_per_cluster', [1, 2])
+def test_clusters_assign_every_stop_once_within_capacity(instance, clustering, vehicles_per_cluster):
+    vehicle_groups = get_vehicle_groups(instance['nb_vehicles'], vehicles_per_cluster)
+    group_capacities = [sum(instance['capacities'][vehicle] for vehicle in group) for group in vehicle_groups]
+    clusters = clustering(instance['coordinates'], instance['demands'], group_capacities)
+    assert len(clusters) == len(vehicle_groups)
+    _check_clusters(clusters, instance, group_capacities)
+
+
+def test_clusters_of_too_much_demand():
+    assert sweep_clusters([(51.0, 3.7), (51.01, 3.7), (51.0, 3.71)], [0, 3, 3], [4]) is None
+    assert kmeans_clusters([(51.0, 3.7), (51.01, 3.7), (51.0, 3.71)], [0, 3, 3], [4]) is None
+
+
+def _check_solution(solution, instance):
+    assert list(solution) == [f"truck_{vehicle}" for vehicle in range(instance['nb_vehicles'])]
+    assert all(re.fullmatch(r'truck_\d+', name) for name in solution)
+    stops = []
+    for vehicle, route in enumerate(solution.values()):
+        assert route[0] == 0 and route[-1] == 0
+        stops.extend(route[1:-1])
+        assert sum(instance['demands'][node] for node in route) <= instance['capacities'][vehicle]
+    assert sorted(stops) == list(range(1, len(instance['coordinates'])))
+
+
+@pytest.mark.parametrize('method', ['sweep', 'kmeans'])
+def test_stitched_solution(instance, method):
+    matrix = DistanceMatrix(get_straight_line_distance_array(instance['coordinates']), condensed=True)
+    solution, info = get_decomposed_cvrp_solution(
+        matrix, instance['nb_vehicles'], instance['capacities'], instance['demands'], instance['coordinates'],
+        method=method, cluster_search_settings=FAST_SEARCH, polish_search_settings=FAST_SEARCH, max_workers=2,
+        return_info=True)
+    _check_solution(solution, instance)
+    # The condensed matrix is only looked up, never expanded
+    assert matrix.is_condensed
+    assert np.isclose(info['distance'], sum(info['route_distances'].values()))
+
+
+def test_decomposed_mode_of_the_cvrp_solver(instance):
+    matrix = get_straight_line_distance_array(instance['coordinates'])
+    solution = get_cvrp_solution(matrix, instance['nb_vehicles'], instance['capacities'], instance['demands'],
+                                 search_settings=FAST_SEARCH, mode='decomposed',
+                                 coordinate_list=instance['coordinates'],
+                                 decomposition_options={'polish': False, 'max_workers': 2})
+    _check_solution(solution, instance)
+    with pytest.raises(ValueError):
+        get_cvrp_solution(matrix, instance['nb_vehicles'], instance['capacities'], instance['demands'],
+                          mode='decomposed')
@@ -0,0 +1,113 @@
+"""
+Tests of DistanceMatrix, in particular the index math of the condensed storage. Run with python -m pytest.
+"""
+import numpy as np
+import pytest
+from DistanceMatrix import DistanceMatrix, SparseDistanceMatrix
+
+
+def _symmetric_array(size, seed=0):
+    array = np.random.default_rng(seed).uniform(1, 1000, (size, size))
+    array = array + array.T
+    np.fill_diagonal(array, 0)
+    return array
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7])
+def test_condensed_round_trip(size):
+    array = _symmetric_array(size)
+    matrix = DistanceMatrix(array, condensed=True)
+    assert matrix.is_condensed
+    assert len(matrix.storage) == size * (size - 1) // 2
+    assert np.array_equal(matrix.to_array(), array)
+    assert np.array_equal(DistanceMatrix(matrix.storage).to_array(), array)
+    assert np.array_equal(matrix.expand().storage, array)
+
+
+def test_condensed_positions_are_the_upper_triangle_in_row_order():
+    size = 6
+    matrix = DistanceMatrix(_symmetric_array(size), condensed=True)
+    rows, columns = np.triu_indices(size, k=1)
+    assert np.array_equal(matrix._condensed_positions(rows, columns), np.arange(len(rows)))
+    # (j, i) is stored at the position of (i, j), the diagonal is not stored
+    assert np.array_equal(matrix._condensed_positions(columns, rows), np.arange(len(rows)))
+    assert np.all(matrix._condensed_positions(np.arange(size), np.arange(size)) == -1)
+
+
+def test_take_and_row_match_the_full_matrix():
+    array = _symmetric_array(8, seed=1)
+    full = DistanceMatrix(array)
+    condensed = DistanceMatrix(array, condensed=True)
+    rng = np.random.default_rng(2)
+    rows, columns = rng.integers(0, 8, 50), rng.integers(0, 8, 50)
+    assert np.array_equal(condensed.take(rows, columns), array[rows, columns])
+    assert np.array_equal(full.take(rows, columns), array[rows, columns])
+    for index in range(8):
+        assert np.array_equal(condensed.row(index), array[index])
+    assert np.array_equal(np.array(list(condensed)), array)
+
+
+@pytest.mark.parametrize('index', [
+    3, -1, slice(2, 5), slice(None, None, -2), [1, 4], (2, 5), (-1, 0), (slice(1, 4), 2), (2, slice(None)),
+    (slice(1, 4), slice(0, 3)), (slice(1, 3), [0, 2]), ([0, 6], [2, 3]), ([0, 6], slice(2, 4)),
+])
+def test_indexing_is_the_same_for_both_storages(index):
+    array = _symmetric_array(7, seed=3)
+    expected = DistanceMatrix(array)[index]
+    value = DistanceMatrix(array, condensed=True)[index]
+    assert np.shape(value) == np.shape(expected)
+    assert np.array_equal(value, expected)
+
+
+def test_condensed_indexing_rejects_out_of_range_indices():
+    matrix = DistanceMatrix(_symmetric_array(4), condensed=True)
+    with pytest.raises(IndexError):
+        matrix[4]
+    with pytest.raises(IndexError):
+        matrix[0, -5]
+
+
+def test_unreachable_pairs():
+    array = _symmetric_array(5, seed=4)
+    array[1, 3] = array[3, 1] = np.nan
+    array[0, 4] = np.inf
+    full = DistanceMatrix(array)
+    assert full.nb_unreachable == 3
+    assert np.array_equal(np.argwhere(full.unreachable_mask()), [[0, 4], [1, 3], [3, 1]])
+    assert full.tolist()[1][3] is None
+    assert full.filled(-1)[0, 4] == -1
+
+    array[4, 0] = np.nan
+    condensed = DistanceMatrix(array, condensed=True)
+    # A condensed pair is unreachable in both directions
+    assert condensed.nb_unreachable == 4
+    assert np.array_equal(condensed.unreachable_mask(), np.isnan(condensed.to_array()))
+
+
+def test_lists_with_none_become_nan():
+    matrix = DistanceMatrix([[0, 5, None], [5, 0, 2], [None, 2, 0]])
+    assert matrix.nb_unreachable == 2
+    assert matrix.symmetric
+    assert np.isnan(matrix[0, 2])
+
+
+def test_only_symmetric_matrices_with_zero_diagonal_are_condensed():
+    array = _symmetric_array(4)
+    array[0, 1] += 1
+    with pytest.raises(ValueError):
+        DistanceMatrix(array, condensed=True)
+    with pytest.raises(ValueError):
+        DistanceMatrix(np.ones((3, 3)), condensed=True)
+
+
+def test_sparse_matrix_lookups():
+    matrix = SparseDistanceMatrix(4, [0, 1, 3, 0], [1, 2, 0, 1], [5.0, 6.0, 7.0, 8.0])
+    # The first value of a pair that is given twice is kept, the diagonal is 0, other pairs are unknown
+    assert np.array_equal(matrix.take([0, 1, 3, 2], [1, 2, 0, 2]), [5.0, 6.0, 7.0, 0.0])
+    assert np.isnan(matrix.take(2, 3))
+    assert [neighbors.tolist() for neighbors in matrix.get_neighbors()] == [[1], [2], [], [0]]
+
+
+def test_sparse_matrix_estimates_the_pairs_that_are_not_stored():
+    matrix = SparseDistanceMatrix(3, [0], [1], [5.0], estimate=lambda rows, columns: 100.0 * rows + columns)
+    assert np.array_equal(matrix.take([0, 2, 1, 1], [1, 1, 0, 1]), [5.0, 201.0, 100.0, 0.0])
@@ -0,0 +1,64 @@
+"""
+Tests of the vectorized straight-line distances against geopy.distance on random points around Ghent, within the
+tolerances of get_straight_line_distance_array. Run with python -m pytest.
+"""
+import geopy.distance
+import numpy as np
+import pytest
+from Depot import GHENT_DEPOT
+from Distances import get_straight_line_distance_array, get_straight_line_distance_block, \
+    get_straight_line_distance_pairs
+
+NB_POINTS = 60
+# One block per row (many blocks) and the whole matrix in one block
+BLOCK_SIZES = [NB_POINTS, 2 ** 21]
+
+
+@pytest.fixture(scope='module')
+def coordinates():
+    rng = np.random.default_rng(11)
+    # Up to about 15 km from the depot, with one coincident pair
+    points = np.array(GHENT_DEPOT) + rng.uniform(-0.13, 0.13, (NB_POINTS, 2))
+    points[-1] = points[0]
+    return points
+
+
+@pytest.fixture(scope='module')
+def geodesic_matrix(coordinates):
+    return np.array([[geopy.distance.geodesic(a, b).m for b in coordinates] for a in coordinates])
+
+
+@pytest.fixture(scope='module')
+def great_circle_matrix(coordinates):
+    return np.array([[geopy.distance.great_circle(a, b).m for b in coordinates] for a in coordinates])
+
+
+@pytest.mark.parametrize('max_block_elements', BLOCK_SIZES)
+def test_ellipsoidal_agrees_with_geodesic_within_a_millimeter(coordinates, geodesic_matrix, max_block_elements):
+    matrix = get_straight_line_distance_array(coordinates, max_block_elements=max_block_elements)
+    assert np.abs(matrix - geodesic_matrix).max() < 1e-3
+    assert np.array_equal(matrix, matrix.T) and matrix[0, -1] == 0
+
+
+@pytest.mark.parametrize('max_block_elements', BLOCK_SIZES)
+def test_haversine_agrees_with_geopy(coordinates, geodesic_matrix, great_circle_matrix, max_block_elements):
+    matrix = get_straight_line_distance_array(coordinates, method='haversine', max_block_elements=max_block_elements)
+    # The same sphere as geopy's great circle (up to the last decimeter of the radius), within 0.5% of the ellipsoid
+    assert np.allclose(matrix, great_circle_matrix, rtol=1e-6, atol=1e-6)
+    assert np.all(np.abs(matrix - geodesic_matrix) <= 0.005 * geodesic_matrix + 1e-6)
+    # float32 is accurate to about 1 m at city scale
+    matrix32 = get_straight_line_distance_array(coordinates, method='haversine', dtype=np.float32,
+                                                max_block_elements=max_block_elements)
+    assert matrix32.dtype == np.float32
+    assert np.abs(matrix32 - great_circle_matrix).max() < 1.5
+
+
+@pytest.mark.parametrize('method', ['ellipsoidal', 'haversine'])
+@pytest.mark.parametrize('max_block_elements', BLOCK_SIZES)
+def test_block_and_pairs_agree_with_the_matrix(coordinates, method, max_block_elements):
+    matrix = get_straight_line_distance_array(coordinates, method=method)
+    block = get_straight_line_distance_block(coordinates[:20], coordinates, method=method,
+                                             max_block_elements=max_block_elements)
+    assert np.allclose(block, matrix[:20], rtol=1e-12, atol=1e-9)
+    pairs = get_straight_line_distance_pairs(coordinates[:-1], coordinates[1:], method=method)
+    assert np.allclose(pairs, matrix[np.arange(NB_POINTS - 1), np.arange(1, NB_POINTS)], rtol=1e-12, atol=1e-9)
@@ -0,0 +1,102 @@
+"""
+Tests of the resumable OSRM matrix build against the stand-in server (OSRMStandIn.py). Run with python -m pytest.
+"""
+import threading
+import numpy as np
+import pytest
+from InstanceGenerator import generate_coordinates
+from MatrixBuilder import build_osrm_matrix
+from OSRMClient import OSRMClient, OSRMError
+from OSRMStandIn import OSRMStandIn
+
+TILE_SIZE = 10
+
+
+class _FailingClient(OSRMClient):
+
+    """Client whose table requests fail once nb_table_requests requests have been answered."""
+
+    def __init__(self, base_url, nb_table_requests):
+        super().__init__(base_url, use_cache=False, max_retries=0)
+        self.nb_table_requests = nb_table_requests
+        self._lock = threading.Lock()
+
+    def table(self, *args, **kwargs):
+        with self._lock:
+            self.nb_table_requests -= 1
+            if self.nb_table_requests < 0:
+                raise OSRMError("OSRM request failed with status 503")
+        return super().table(*args, **kwargs)
+
+
+@pytest.fixture
+def stand_in():
+    with OSRMStandIn() as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def coordinates():
+    return generate_coordinates(34, seed=5)[0]
+
+
+def test_build_is_the_single_request_matrix(stand_in, coordinates):
+    client = OSRMClient(stand_in.url, use_cache=False)
+    response_json = client.table(coordinates)
+    distances, durations = build_osrm_matrix(coordinates, tile_size=TILE_SIZE, max_requests_per_second=1000,
+                                             progress_interval=None, client=client)
+    assert np.allclose(distances, response_json['distances'])
+    assert np.allclose(durations, response_json['durations'])
+    client.close()
+
+
+def test_interrupted_build_resumes_from_the_checkpoint(stand_in, coordinates, tmp_path):
+    directory = str(tmp_path / 'checkpoint')
+    failing_client = _FailingClient(stand_in.url, nb_table_requests=5)
+    with pytest.raises(OSRMError):
+        build_osrm_matrix(coordinates, checkpoint_directory=directory, tile_size=TILE_SIZE, max_workers=1,
+                          max_retries=0, progress_interval=None, client=failing_client)
+    failing_client.close()
+
+    stand_in.request_count = 0
+    client = OSRMClient(stand_in.url, use_cache=False)
+    distances, durations = build_osrm_matrix(coordinates, checkpoint_directory=directory, tile_size=TILE_SIZE,
+                                             progress_interval=None, client=client)
+    # 4 x 4 tiles, the 5 fetched before the failure are not fetched again
+    assert stand_in.request_count == 16 - 5
+    assert isinstance(distances, np.memmap)
+    assert np.allclose(distances, client.table(coordinates)['distances'])
+    assert not np.isnan(durations).any()
+    client.close()
+
+
+def test_checkpoint_of_another_server_is_not_resumed(stand_in, coordinates, tmp_path):
+    directory = str(tmp_path / 'checkpoint')
+    client = OSRMClient(stand_in.url, use_cache=False)
+    build_osrm_matrix(coordinates, checkpoint_directory=directory, tile_size=TILE_SIZE, progress_interval=None,
+                      client=client)
+    client.close()
+
+    with OSRMStandIn(detour_factor=1.5) as other_stand_in:
+        other_client = OSRMClient(other_stand_in.url, use_cache=False)
+        distances, _ = build_osrm_matrix(coordinates, checkpoint_directory=directory, tile_size=TILE_SIZE,
+                                         progress_interval=None, client=other_client)
+        assert other_stand_in.request_count == 16
+        assert np.allclose(distances, other_client.table(coordinates)['distances'])
+        other_client.close()
+
+    # Another profile of the same server is a build of its own as well
+    stand_in.request_count = 0
+    car_client = OSRMClient(stand_in.url, use_cache=False)
+    build_osrm_matrix(coordinates, checkpoint_directory=directory, tile_size=TILE_SIZE, progress_interval=None,
+                      client=car_client)
+    assert stand_in.request_count == 16
+    stand_in.request_count = 0
+    build_osrm_matrix(coordinates, checkpoint_directory=directory, tile_size=TILE_SIZE, progress_interval=None,
+                      client=car_client)
+    assert stand_in.request_count == 0
+    car_client.profile = 'bicycle'
+    build_osrm_matrix(coordinates, checkpoint_directory=directory, tile_size=TILE_SIZE, progress_interval=None,
+                      client=car_client)
+    assert stand_in.request_count == 16
+    car_client.close()
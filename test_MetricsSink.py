@@ -0,0 +1,60 @@
+"""
+Tests of MetricsSink: batches, resuming after a crash and the CSV and Parquet outputs. Run with python -m pytest.
+The Parquet tests are skipped when pyarrow is not installed.
+"""
+from importlib.util import find_spec
+import numpy as np
+import pandas as pd
+import pytest
+from Metrics import get_solution_metrics
+from MetricsSink import MetricsSink
+
+
+def _metrics(problem_name, original_solution_name='ORIGINAL'):
+    route_metrics = pd.DataFrame({
+        'Routing Problem': problem_name,
+        'Solution': ['ORIGINAL', 'ORIGINAL', 'OPTIMAL', 'OPTIMAL'],
+        'Route': ['0', '1', '0', '1'],
+        'Metric': 'straight_line',
+        'Total': [10.0, 20.0, 8.0, 16.0],
+    })
+    return get_solution_metrics(route_metrics, original_solution_name=original_solution_name)
+
+
+def test_improvement_is_float_with_and_without_original_solution():
+    assert _metrics('A')['Improvment'].dtype == np.float64
+    assert _metrics('A', original_solution_name=None)['Improvment'].dtype == np.float64
+
+
+@pytest.mark.parametrize('file_format', [
+    'csv', pytest.param('parquet', marks=pytest.mark.skipif(find_spec('pyarrow') is None, reason='needs pyarrow')),
+])
+def test_batches_and_resume(tmp_path, file_format):
+    path = str(tmp_path / f"metrics.{file_format}")
+    sink = MetricsSink(path, batch_size=2)
+    sink.write(_metrics('A'))
+    sink.write(_metrics('B'))
+    # Buffered, never flushed: lost by the "crash" below
+    sink.write(_metrics('C', original_solution_name=None))
+
+    resumed = MetricsSink(path, batch_size=2)
+    assert resumed.is_done('A') and resumed.is_done('B') and not resumed.is_done('C')
+    # Parts of a resumed run have the same schema as the earlier ones, with or without original solution
+    resumed.write(_metrics('C', original_solution_name=None))
+    resumed.close()
+
+    metrics = MetricsSink(path).read()
+    assert list(pd.unique(metrics['Routing Problem'])) == ['A', 'B', 'C']
+    assert len(metrics) == 6
+    assert np.allclose(metrics['Improvment'], [0.0, 0.2] * 2 + [0.0, 0.0])
+
+
+def test_csv_partial_last_line_is_dropped(tmp_path):
+    path = str(tmp_path / 'metrics.csv')
+    with MetricsSink(path) as sink:
+        sink.write(_metrics('A'))
+    with open(path, 'a') as f:
+        f.write('B;ORIG')
+    sink = MetricsSink(path)
+    assert sink.done == {'A'}
+    assert len(sink.read()) == 2
@@ -0,0 +1,89 @@
+"""
+Tests of the OSRM matrices against the local stand-in server (OSRMStandIn.py). Run with python -m pytest.
+"""
+import numpy as np
+import pytest
+from InstanceGenerator import generate_coordinates
+from OSRM import MAX_TABLE_SIZE, get_table_tiles, osrm_get_matrix, osrm_get_matrix_tiled
+from OSRMClient import OSRMClient, OSRMError
+from OSRMStandIn import OSRMStandIn
+
+
+@pytest.fixture
+def stand_in():
+    with OSRMStandIn() as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def client(stand_in):
+    client = OSRMClient(stand_in.url, use_cache=False, max_retries=0)
+    yield client
+    client.close()
+
+
+@pytest.fixture(scope='module')
+def coordinates():
+    return generate_coordinates(MAX_TABLE_SIZE + 30, seed=11)[0]
+
+
+def test_tiled_matrix_is_the_single_request_matrix(stand_in, client, coordinates):
+    stand_in.max_table_size = None
+    response_json = client.table(coordinates)
+    stand_in.max_table_size = MAX_TABLE_SIZE
+    with pytest.raises(OSRMError, match='TooBig'):
+        client.table(coordinates)
+
+    stand_in.request_count = 0
+    # More than MAX_TABLE_SIZE coordinates are fetched in tiles
+    distances, durations = osrm_get_matrix(coordinates, client=client)
+    assert stand_in.request_count == len(get_table_tiles(len(coordinates)))
+    assert distances.dtype == np.float64 and distances.shape == (len(coordinates), len(coordinates))
+    assert np.array_equal(distances, np.array(response_json['distances']))
+    assert np.array_equal(durations, np.array(response_json['durations']))
+
+
+def test_failed_tile_is_retried(stand_in, client, coordinates):
+    reference, _ = osrm_get_matrix_tiled(coordinates, tile_size=40, client=client)
+    stand_in.request_count = 0
+    stand_in.add_failures(2, status=400, body={'code': 'TooBig', 'message': 'Too many table coordinates'})
+    distances, _ = osrm_get_matrix_tiled(coordinates, tile_size=40, max_retries=2, retry_delay=0, client=client)
+    # 4 x 4 tiles and the 2 failed tiles again
+    assert stand_in.request_count == 16 + 2
+    assert np.array_equal(distances, reference)
+
+
+class _Matrices:
+
+    def __init__(self, n, nb_tiles):
+        self.distances = np.full((n, n), np.nan)
+        self.durations = np.full((n, n), np.nan)
+        self.tiles_done = np.zeros(nb_tiles, dtype=bool)
+
+
+def test_tile_that_keeps_failing_stays_nan(stand_in, client, coordinates):
+    n = len(coordinates)
+    tiles = get_table_tiles(n, 40)
+    matrices = _Matrices(n, len(tiles))
+    # One request in flight at a time: the first tile fails, and fails again when it is retried after the 16 tiles
+    stand_in.add_failures(1)
+    nb_requests = []
+
+    def before_request():
+        nb_requests.append(1)
+        if len(nb_requests) == 17:
+            stand_in.add_failures(1)
+
+    with pytest.raises(OSRMError, match='1 of 16'):
+        osrm_get_matrix_tiled(coordinates, tile_size=40, max_retries=1, retry_delay=0, client=client, max_workers=1,
+                              matrices=matrices, before_request=before_request)
+    assert matrices.tiles_done.sum() == 15 and not matrices.tiles_done[0]
+    sources, destinations = tiles[0]
+    assert np.isnan(matrices.distances[np.ix_(sources, destinations)]).all()
+    assert not np.isnan(np.delete(matrices.distances, sources, axis=0)).any()
+
+    # The next fetch with the same matrices only asks for the missing tile
+    stand_in.request_count = 0
+    distances, _ = osrm_get_matrix_tiled(coordinates, tile_size=40, client=client, matrices=matrices)
+    assert stand_in.request_count == 1
+    assert not np.isnan(distances).any()
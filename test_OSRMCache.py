@@ -0,0 +1,78 @@
+"""
+Tests of the OSRM cache shared by several processes and of the client when the cache fails. Run with python -m pytest.
+"""
+import multiprocessing
+import sqlite3
+import pytest
+from OSRMCache import OSRMCache, get_default_cache, set_default_cache
+from OSRMClient import OSRMClient
+from OSRMStandIn import OSRMStandIn
+
+COORDINATES = [(51.05, 3.72), (51.06, 3.73)]
+
+
+def _write_entries(path, worker, nb_entries):
+    cache = OSRMCache(path, busy_timeout=30)
+    for index in range(nb_entries):
+        cache.set(f"{worker}-{index}", {'code': 'Ok', 'value': index})
+    cache.close()
+
+
+@pytest.fixture
+def stand_in():
+    with OSRMStandIn() as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def default_cache():
+    """Restores the default cache of the OSRM functions after the test."""
+    cache = get_default_cache()
+    yield
+    set_default_cache(cache)
+
+
+def test_processes_write_the_same_cache(tmp_path):
+    path = str(tmp_path / 'osrm_cache.sqlite')
+    OSRMCache(path).close()
+    processes = [multiprocessing.Process(target=_write_entries, args=(path, worker, 50)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 4
+    cache = OSRMCache(path)
+    assert cache.stats()['entries'] == 200
+    assert cache.get('3-49') == {'code': 'Ok', 'value': 49}
+
+
+def test_locked_cache_does_not_fail_the_request(tmp_path, stand_in, default_cache):
+    path = str(tmp_path / 'osrm_cache.sqlite')
+    cache = OSRMCache(path, busy_timeout=0.1)
+    set_default_cache(cache)
+    # Another process holds the write lock
+    other = sqlite3.connect(path)
+    other.execute("BEGIN EXCLUSIVE")
+    client = OSRMClient(stand_in.url)
+    assert client.route(COORDINATES)['code'] == 'Ok'
+    other.rollback()
+    other.close()
+    # The response was not stored, the next request is a miss and is stored
+    assert cache.stats()['entries'] == 0
+    client.route(COORDINATES)
+    assert cache.stats()['entries'] == 1
+    client.close()
+
+
+class _BrokenCache(OSRMCache):
+
+    def get(self, key):
+        raise sqlite3.DatabaseError("database disk image is malformed")
+
+
+def test_failing_lookup_is_a_miss(stand_in, default_cache):
+    set_default_cache(_BrokenCache(':memory:'))
+    client = OSRMClient(stand_in.url)
+    assert client.route(COORDINATES)['code'] == 'Ok'
+    assert stand_in.request_count == 1
+    client.close()
@@ -0,0 +1,77 @@
+"""
+Tests of the OSRM client against the local stand-in server (OSRMStandIn.py). Run with python -m pytest.
+"""
+import pytest
+import OSRMClient
+from OSRMClient import OSRMError
+from OSRMStandIn import OSRMStandIn
+
+COORDINATES = [(51.05, 3.72), (51.06, 3.73), (51.04, 3.70), (51.07, 3.75)]
+
+
+@pytest.fixture
+def stand_in():
+    with OSRMStandIn(max_table_size=3) as stand_in:
+        yield stand_in
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """The backoff waits of the client, recorded instead of slept."""
+    recorded = []
+    monkeypatch.setattr(OSRMClient.time, 'sleep', recorded.append)
+    return recorded
+
+
+@pytest.fixture
+def client(stand_in):
+    client = OSRMClient.OSRMClient(stand_in.url, use_cache=False, max_retries=3, backoff=0.5, max_workers=4)
+    yield client
+    client.close()
+
+
+def test_5xx_is_retried_with_exponential_backoff(stand_in, client, sleeps):
+    stand_in.add_failures(2, status=503)
+    response_json = client.route(COORDINATES[:2])
+    assert response_json['code'] == 'Ok'
+    assert stand_in.request_count == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_retries_run_out(stand_in, client, sleeps):
+    stand_in.add_failures(4, status=502)
+    with pytest.raises(OSRMError, match='status 502'):
+        client.route(COORDINATES[:2])
+    assert stand_in.request_count == 4
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_too_big_is_an_osrm_error_without_retries(stand_in, client, sleeps):
+    with pytest.raises(OSRMError, match='TooBig'):
+        client.table(COORDINATES)
+    assert stand_in.request_count == 1
+    assert sleeps == []
+
+
+def test_response_that_is_not_json_is_an_osrm_error(stand_in, client):
+    stand_in.add_failures(1, status=200, body='<html><body>502 Bad Gateway</body></html>')
+    with pytest.raises(OSRMError, match='not an OSRM JSON object'):
+        client.route(COORDINATES[:2])
+    stand_in.add_failures(1, status=200, body=[1, 2])
+    with pytest.raises(OSRMError):
+        client.route(COORDINATES[:2])
+
+
+def test_batch_returns_the_results_in_order(stand_in, client):
+    stand_in.latency = 0.01
+    pairs = [(COORDINATES[i], COORDINATES[j]) for i in range(4) for j in range(4) if i != j]
+    results = client.batch(client.route, [([from_node, to_node],) for from_node, to_node in pairs])
+    expected = [stand_in.get_distances([from_node], [to_node])[0, 0] for from_node, to_node in pairs]
+    assert [result['routes'][0]['distance'] for result in results] == pytest.approx(expected, abs=0.1)
+
+    # A failed request is in its place with return_exceptions, and raises without
+    arguments = [(COORDINATES[:2],), (COORDINATES[:1],), (COORDINATES[1:3],)]
+    results = client.batch(client.route, arguments, return_exceptions=True)
+    assert results[0]['code'] == 'Ok' and isinstance(results[1], OSRMError) and results[2]['code'] == 'Ok'
+    with pytest.raises(OSRMError, match='InvalidQuery'):
+        client.batch(client.route, arguments)
@@ -0,0 +1,84 @@
+"""
+Tests of the offline road network on a small hand-built edge list: the scipy Dijkstra and the Python Dijkstra pool give
+the same matrices and routes. Run with python -m pytest.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from RoadNetwork import RoadNetwork, _haversine
+
+# A square A-B-C-D with a fast one-way diagonal A -> C and a slow side D-A, and a separate road E-F
+A, B, C, D, E, F = (51.00, 3.70), (51.00, 3.71), (51.01, 3.71), (51.01, 3.70), (51.05, 3.80), (51.05, 3.81)
+EDGES = [(A, B, 30, 0), (B, C, 30, 0), (C, D, 30, 0), (D, A, 5, 0), (A, C, 100, 1), (E, F, 30, 0)]
+STOPS = [A, B, C, D, E]
+
+
+def _length(from_point, to_point):
+    return float(_haversine(np.array([from_point[0]]), np.array([from_point[1]]), np.array([to_point[0]]),
+                            np.array([to_point[1]]))[0])
+
+
+@pytest.fixture(scope='module')
+def network(tmp_path_factory):
+    path = tmp_path_factory.mktemp('network') / 'edges.csv'
+    pd.DataFrame([{'from_latitude': start[0], 'from_longitude': start[1], 'to_latitude': end[0],
+                   'to_longitude': end[1], 'speed': speed, 'oneway': oneway} for start, end, speed, oneway in EDGES]
+                 ).to_csv(path, index=False)
+    return RoadNetwork.from_edge_list(path)
+
+
+@pytest.fixture
+def python_network(network, monkeypatch):
+    """The same network without scipy: the Python Dijkstra runs in a pool of processes."""
+    python_network = RoadNetwork(network.latitudes, network.longitudes, network.offsets, network.heads,
+                                 network.lengths, network.durations)
+    monkeypatch.setattr(python_network, '_get_scipy_graph', lambda: None)
+    return python_network
+
+
+def test_scipy_and_python_dijkstra_give_the_same_matrix(network, python_network):
+    pytest.importorskip('scipy')
+    distances, durations = network.get_matrix(STOPS)
+    python_distances, python_durations = python_network.get_matrix(STOPS, max_workers=2)
+    assert np.allclose(distances, python_distances, equal_nan=True)
+    assert np.allclose(durations, python_durations, equal_nan=True)
+
+
+@pytest.mark.parametrize('use_scipy', [True, False])
+def test_fastest_routes_and_unreachable_pairs(network, python_network, use_scipy):
+    if use_scipy:
+        pytest.importorskip('scipy')
+    distances, durations = (network if use_scipy else python_network).get_matrix(STOPS)
+    a, b, c, d, e = range(5)
+    # The one-way diagonal is only driven from A to C
+    assert distances[a, c] == pytest.approx(_length(A, C), rel=1e-5)
+    assert distances[c, a] == pytest.approx(_length(C, B) + _length(B, A), rel=1e-5)
+    assert durations[a, c] < durations[c, a]
+    # The matrices are of the fastest route: from D to A around the square, not over the slow side
+    assert distances[d, a] == pytest.approx(_length(D, C) + _length(C, B) + _length(B, A), rel=1e-5)
+    assert durations[d, a] < _length(D, A) / (5 / 3.6)
+    # E is on another road, the pairs with it are unreachable
+    assert np.isnan(distances[e, :e]).all() and np.isnan(durations[:e, e]).all()
+    assert np.all(np.diagonal(distances) == 0) and np.all(np.diagonal(durations) == 0)
+
+
+@pytest.mark.parametrize('use_scipy', [True, False])
+def test_route(network, python_network, use_scipy):
+    if use_scipy:
+        pytest.importorskip('scipy')
+    road_network = network if use_scipy else python_network
+    geometry, distance = road_network.get_route([D, A, C])
+    assert distance == pytest.approx(_length(D, C) + _length(C, B) + _length(B, A) + _length(A, C), rel=1e-5)
+    assert len(geometry) == 2
+    # Every leg goes from its stop over the graph nodes of the path to the next stop
+    assert np.allclose(geometry.leg(0), [D, D, C, B, A, A], atol=1e-5)
+    with pytest.raises(ValueError):
+        road_network.get_route([A, E])
+
+
+def test_snap_returns_the_nearest_node(network):
+    nodes, distances = network.snap([(51.0002, 3.7001), (51.0098, 3.7097), E])
+    points = np.column_stack([network.latitudes, network.longitudes])
+    assert np.allclose(points[nodes], [A, C, E])
+    assert distances[0] == pytest.approx(_length((51.0002, 3.7001), A), rel=1e-3)
+    assert distances[2] == pytest.approx(0, abs=1e-6)
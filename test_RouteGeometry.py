@@ -0,0 +1,56 @@
+"""
+Tests of the vectorized polyline codec and of RouteGeometry. Run with python -m pytest.
+"""
+import numpy as np
+import polyline
+import pytest
+from RouteGeometry import RouteGeometry, decode_polyline, decode_polylines, encode_polyline
+
+# The example of the polyline format documentation
+EXAMPLE = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+EXAMPLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+GHENT_POINTS = [(51.0206803, 3.7406690), (51.0543422, 3.7174243), (51.0543422, 3.7174243), (50.9999999, 3.8000001),
+                (-33.8688197, 151.2092955), (0.0, -179.99999)]
+
+
+def test_known_polyline():
+    assert np.allclose(decode_polyline(EXAMPLE), EXAMPLE_POINTS)
+    fixed_points, offsets = decode_polylines([EXAMPLE])
+    assert fixed_points.tolist() == [[3850000, -12020000], [4070000, -12095000], [4325200, -12645300]]
+    assert offsets.tolist() == [0, 3]
+    assert encode_polyline(fixed_points) == EXAMPLE
+
+
+def test_empty_polyline():
+    assert decode_polyline('').shape == (0, 2)
+    assert encode_polyline(np.zeros((0, 2))) == ''
+    points, offsets = decode_polylines(['', EXAMPLE, ''])
+    assert len(points) == 3 and offsets.tolist() == [0, 0, 3, 3]
+
+
+@pytest.mark.parametrize('precision', [5, 6])
+def test_encode_of_decode_is_the_polyline(precision):
+    encoded = polyline.encode(GHENT_POINTS, precision)
+    assert np.allclose(decode_polyline(encoded, precision=precision), GHENT_POINTS, atol=10 ** -precision)
+    assert encode_polyline(decode_polylines([encoded])[0]) == encoded
+
+
+def test_many_polylines_decode_like_one_at_a_time():
+    rng = np.random.default_rng(0)
+    lines = [polyline.encode([tuple(point) for point in rng.uniform((50.9, 3.6), (51.1, 3.9), (size, 2))])
+             for size in [1, 5, 12, 2]]
+    lines.insert(2, '')
+    points, offsets = decode_polylines(lines)
+    for index, line in enumerate(lines):
+        assert np.array_equal(points[offsets[index]:offsets[index + 1]], decode_polylines([line])[0])
+        assert encode_polyline(points[offsets[index]:offsets[index + 1]]) == line
+
+
+def test_geometry_of_step_polylines():
+    legs = [[polyline.encode(GHENT_POINTS[:2]), polyline.encode(GHENT_POINTS[1:3])],
+            [polyline.encode(GHENT_POINTS[2:4])]]
+    geometry = RouteGeometry.from_step_polylines(legs, distance=1234.5)
+    assert len(geometry) == 2
+    assert np.allclose(geometry.to_array()[:2], GHENT_POINTS[:2], atol=1e-5)
+    assert np.allclose(geometry.leg(1), GHENT_POINTS[2:4], atol=1e-5)
+    assert RouteGeometry.from_dict(geometry.to_dict()).to_array().tolist() == geometry.to_array().tolist()
@@ -0,0 +1,116 @@
+"""
+Tests of saving and loading routing problems: the binary directory format (lazy memory-mapped matrices) and the JSON
+format of older saves. Run with python -m pytest.
+"""
+import os
+import numpy as np
+import pytest
+from DistanceMatrix import DistanceMatrix
+from Distances import get_straight_line_distance_array
+from InstanceGenerator import generate_coordinates
+from RoutingProblem import RoutingProblem, _get_mapped_file
+
+
+@pytest.fixture
+def problems_directory(tmp_path, monkeypatch):
+    """Runs the test in an empty directory, the problems are saved in its RoutingProblems/."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('RoutingProblems')
+    return tmp_path / 'RoutingProblems'
+
+
+def _make_problem(name='DAY_1', nb_stops=12):
+    coordinates = generate_coordinates(nb_stops, seed=3)[0]
+    n = len(coordinates)
+    osrm_distance = np.random.default_rng(0).uniform(100, 5000, (n, n))
+    np.fill_diagonal(osrm_distance, 0)
+    osrm_distance[2, 5] = np.nan
+    routing_problem = RoutingProblem(name)
+    routing_problem.add_coordinates(coordinates)
+    routing_problem.set_demands([0] + [1] * (n - 1))
+    routing_problem.set_capacities(2, [8, 8])
+    routing_problem.add_solution('original', {'truck_0': [0] + list(range(1, 7)) + [0],
+                                              'truck_1': [0] + list(range(7, n)) + [0]})
+    routing_problem.add_distance_matrix('straight-line', get_straight_line_distance_array(coordinates),
+                                        kind='straight_line', condensed=True)
+    routing_problem.add_distance_matrix('osrm-distance', osrm_distance)
+    routing_problem.add_distance_matrix('osrm-time', (osrm_distance / 8).tolist())
+    return routing_problem
+
+
+def _assert_same_problem(loaded, expected):
+    assert loaded.name == expected.name
+    assert np.allclose(np.asarray(loaded.get_coordinates()), np.asarray(expected.get_coordinates()))
+    assert list(loaded.get_demands()) == list(expected.get_demands())
+    assert loaded.get_nb_vehicles() == expected.get_nb_vehicles()
+    assert list(loaded.get_capacities()) == list(expected.get_capacities())
+    assert loaded.get_solutions() == expected.get_solutions()
+    expected_matrices = expected.get_all_distance_matrices()
+    assert list(loaded.get_all_distance_matrices()) == list(expected_matrices)
+    for matrix_name, matrix in expected_matrices.items():
+        loaded_matrix = loaded.get_distance_matrix(matrix_name)
+        assert loaded_matrix.units == matrix.units
+        assert loaded_matrix.is_condensed == matrix.is_condensed
+        assert np.array_equal(np.asarray(loaded_matrix), np.asarray(matrix), equal_nan=True)
+
+
+def test_binary_round_trip(problems_directory):
+    routing_problem = _make_problem()
+    routing_problem.save()
+    files = sorted(os.listdir(problems_directory / 'DAY_1'))
+    assert files == ['matrix_0.npy', 'matrix_1.npy', 'matrix_2.npy', 'problem.json', 'route_geometries.json']
+
+    loaded = RoutingProblem('DAY_1')
+    assert loaded.is_saved()
+    loaded.load()
+    # The matrices are only read when they are used, memory-mapped
+    assert set(loaded._pending_matrices) == {'straight-line', 'osrm-distance', 'osrm-time'}
+    assert _get_mapped_file(loaded.get_distance_matrix('osrm-distance').storage) == str(
+        problems_directory / 'DAY_1' / 'matrix_1.npy')
+    assert loaded.get_distance_matrix('osrm-time').units == 's'
+    _assert_same_problem(loaded, routing_problem)
+
+
+def test_save_over_the_memory_mapped_files(problems_directory):
+    _make_problem().save()
+    loaded = RoutingProblem('DAY_1')
+    loaded.load()
+    mapped_distances = loaded.get_distance_matrix('osrm-distance')
+    original_values = np.array(mapped_distances)
+    # Saving unchanged matrices keeps their files
+    modification_time = os.path.getmtime(problems_directory / 'DAY_1' / 'matrix_1.npy')
+    loaded.save()
+    assert os.path.getmtime(problems_directory / 'DAY_1' / 'matrix_1.npy') == modification_time
+
+    # Every matrix changes: the new files are renamed over the mapped ones, which stay readable
+    loaded.remove_stops([3, 4])
+    loaded.save()
+    assert np.array_equal(np.asarray(mapped_distances), original_values, equal_nan=True)
+    assert not [name for name in os.listdir(problems_directory / 'DAY_1') if '.tmp' in name]
+    reloaded = RoutingProblem('DAY_1')
+    reloaded.load()
+    _assert_same_problem(reloaded, loaded)
+    assert len(reloaded.get_distance_matrix('osrm-distance')) == 11
+
+
+def test_stale_matrix_files_are_removed(problems_directory):
+    _make_problem().save()
+    routing_problem = _make_problem()
+    del routing_problem.data['distance_matrices']['osrm-time']
+    routing_problem.save()
+    assert sorted(name for name in os.listdir(problems_directory / 'DAY_1') if name.startswith('matrix_')) == [
+        'matrix_0.npy', 'matrix_1.npy']
+    loaded = RoutingProblem('DAY_1')
+    loaded.load()
+    assert list(loaded.get_all_distance_matrices()) == ['straight-line', 'osrm-distance']
+
+
+def test_json_fallback(problems_directory):
+    routing_problem = _make_problem('BA_DI_RES1')
+    routing_problem.save(binary=False)
+    assert os.listdir(problems_directory) == ['BA_DI_RES1.json']
+    loaded = RoutingProblem('BA_DI_RES1')
+    assert loaded.is_saved()
+    loaded.load()
+    assert isinstance(loaded.get_distance_matrix('osrm-distance'), DistanceMatrix)
+    _assert_same_problem(loaded, routing_problem)
@@ -0,0 +1,197 @@
+"""
+Tests of the search control of the solvers (SearchMonitor), the repair of initial routes, the warm start and the arcs
+restricted to neighbor lists, on seeded InstanceGenerator instances. Run with python -m pytest.
+"""
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import Solvers
+from Distances import get_straight_line_distance_array
+from InstanceGenerator import generate_cvrp_instance, generate_tsp_instance
+from Solvers import SearchMonitor, SearchSettings, get_cvrp_solution, get_tsp_solution, repair_routes, \
+    to_integer_matrix
+from SpatialIndex import SpatialIndex
+
+# Greedy descent from the first solution: stops in the first local optimum, so the tests stay fast
+DESCENT_SEARCH = SearchSettings(time_limit=5)
+
+
+@pytest.fixture(scope='module')
+def tsp_instance():
+    instance = generate_tsp_instance(40, seed=3)
+    instance['matrix'] = get_straight_line_distance_array(instance['coordinates'])
+    return instance
+
+
+@pytest.fixture(scope='module')
+def cvrp_instance():
+    instance = generate_cvrp_instance(60, seed=5, stops_per_truck=20)
+    instance['matrix'] = get_straight_line_distance_array(instance['coordinates'])
+    return instance
+
+
+def _route_distance(matrix, route):
+    return float(matrix[route[:-1], route[1:]].sum())
+
+
+def _cvrp_cost(matrix, routes):
+    """The cost the CVRP search minimizes: the total distance and 1000 times the longest route (integer arcs)."""
+    integer_matrix = np.rint(matrix)
+    distances = [_route_distance(integer_matrix, [0] + route + [0]) for route in routes]
+    return sum(distances) + 1000 * max(distances)
+
+
+class _FakeRouting:
+
+    """The parts of a RoutingModel the SearchMonitor uses, the costs of the solutions are set by the test."""
+
+    def __init__(self):
+        self.cost = None
+        self.finished = False
+        cost_var = SimpleNamespace(Value=lambda: self.cost)
+        solver = SimpleNamespace(FinishCurrentSearch=lambda: setattr(self, 'finished', True))
+        self.CostVar = lambda: cost_var
+        self.solver = lambda: solver
+
+
+def _run_monitor(monkeypatch, settings, solutions):
+    """Calls a SearchMonitor with the (seconds, cost) solutions, returns the monitor and the solution it stopped at."""
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(Solvers, 'time', SimpleNamespace(time=lambda: clock.now))
+    routing = _FakeRouting()
+    monitor = SearchMonitor(routing, settings, scale=10)
+    for index, (seconds, cost) in enumerate(solutions):
+        clock.now, routing.cost = seconds, cost * 10
+        monitor()
+        if routing.finished:
+            return monitor, index
+    return monitor, None
+
+
+def test_monitor_stops_on_a_plateau(monkeypatch):
+    settings = SearchSettings(plateau_window=10, plateau_threshold=0.01)
+    solutions = [(0, 100), (5, 90), (12, 89.5), (20, 89.4), (25, 80)]
+    monitor, stopped_at = _run_monitor(monkeypatch, settings, solutions)
+    # At 12 s the best cost improved by 10.5% in the last 10 s, at 20 s by 0.7% since 90 at 5 s
+    assert stopped_at == 3
+    assert monitor.trace == solutions[:4]
+    assert monitor.best_cost == 89.4
+
+
+def test_monitor_without_plateau_window_only_records(monkeypatch):
+    solutions = [(0, 100), (50, 100), (100, 100)]
+    monitor, stopped_at = _run_monitor(monkeypatch, SearchSettings(), solutions)
+    assert stopped_at is None
+    assert monitor.trace == solutions
+
+
+def test_plateau_stops_a_metaheuristic_before_its_time_limit(tsp_instance):
+    settings = SearchSettings(local_search_metaheuristic='GUIDED_LOCAL_SEARCH', time_limit=60, plateau_window=0.5,
+                              plateau_threshold=0.01)
+    solution, info = get_tsp_solution(tsp_instance['matrix'], return_info=True, search_settings=settings)
+    assert sorted(solution['TSP_1'][1:-1]) == list(range(1, 41))
+    assert info['wall_time'] < 30
+    times = [seconds for seconds, _ in info['trace']]
+    assert times == sorted(times)
+    assert min(cost for _, cost in info['trace']) == pytest.approx(info['solver_objective'])
+
+
+def test_repair_needs_the_demands_with_capacities(cvrp_instance):
+    with pytest.raises(ValueError):
+        repair_routes(cvrp_instance['original_solution'], cvrp_instance['matrix'], cvrp_instance['nb_vehicles'],
+                      cvrp_instance['capacities'])
+
+
+def test_repaired_routes_are_feasible(cvrp_instance):
+    demands = cvrp_instance['demands']
+    # One route with all the stops (too much for any truck), a repeated stop, the depot inside and an unknown index
+    stops = [node for route in cvrp_instance['original_solution'].values() for node in route if node != 0]
+    routes = {'all': [0] + stops[:-1] + [stops[0], 0, 1000] + [0], 'empty': [0, 0]}
+    capacities = cvrp_instance['capacities']
+    repaired = repair_routes(routes, cvrp_instance['matrix'], cvrp_instance['nb_vehicles'], capacities, demands)
+    assert len(repaired) == cvrp_instance['nb_vehicles']
+    visited = [node for route in repaired for node in route]
+    # Every stop once, the last one (not on the routes) inserted, never the depot
+    assert sorted(visited) == list(range(1, len(demands)))
+    for route, capacity in zip(repaired, capacities):
+        assert sum(demands[node] for node in route) <= capacity
+
+
+def test_tsp_warm_start_never_ends_worse(tsp_instance):
+    matrix = tsp_instance['matrix']
+    original_distance = _route_distance(matrix, tsp_instance['original_solution']['ORIGINAL'])
+    solution, info = get_tsp_solution(matrix, return_info=True, search_settings=DESCENT_SEARCH,
+                                      initial_solution=tsp_instance['original_solution'])
+    assert sorted(solution['TSP_1'][1:-1]) == list(range(1, 41))
+    assert info['distance'] <= original_distance + 1e-6
+
+
+def test_cvrp_warm_start_never_ends_worse(cvrp_instance):
+    matrix = cvrp_instance['matrix']
+    nb_vehicles, capacities, demands = (cvrp_instance['nb_vehicles'], cvrp_instance['capacities'],
+                                        cvrp_instance['demands'])
+    # The search starts from the repaired original routes
+    initial_routes = repair_routes(cvrp_instance['original_solution'], matrix, nb_vehicles, capacities, demands)
+    solution, info = get_cvrp_solution(matrix, nb_vehicles, capacities, demands, return_info=True,
+                                       search_settings=DESCENT_SEARCH,
+                                       initial_solution=cvrp_instance['original_solution'])
+    assert info['solver_objective'] <= _cvrp_cost(matrix, initial_routes)
+    for route, capacity in zip(solution.values(), capacities):
+        assert sum(demands[node] for node in route) <= capacity
+    assert sorted(node for route in solution.values() for node in route[1:-1]) == list(range(1, len(demands)))
+
+
+def _get_symmetric_neighbors(neighbors):
+    symmetric_neighbors = [set() for _ in neighbors]
+    for node, node_neighbors in enumerate(neighbors):
+        for neighbor in node_neighbors:
+            symmetric_neighbors[node].add(int(neighbor))
+            symmetric_neighbors[int(neighbor)].add(node)
+    return symmetric_neighbors
+
+
+def test_tsp_on_neighbor_arcs(tsp_instance, capsys):
+    neighbors = SpatialIndex(tsp_instance['coordinates']).k_nearest_neighbors(8)
+    solution = get_tsp_solution(tsp_instance['matrix'], search_settings=SearchSettings(
+        first_solution_strategy='PARALLEL_CHEAPEST_INSERTION', time_limit=5), neighbors=neighbors)
+    route = solution['TSP_1']
+    assert route[0] == route[-1] == 0 and sorted(route[1:-1]) == list(range(1, 41))
+    # Between two stops the route only takes neighbor arcs, so the restricted model was solved
+    symmetric_neighbors = _get_symmetric_neighbors(neighbors)
+    assert all(to_node in symmetric_neighbors[from_node] for from_node, to_node in zip(route[1:-2], route[2:-1]))
+    assert 'solving without them' not in capsys.readouterr().out
+
+
+def test_tsp_without_solution_on_neighbor_arcs_falls_back(tsp_instance, capsys):
+    # Without neighbors every stop can only go back to the depot, no single route visits them all
+    neighbors = [[] for _ in tsp_instance['coordinates']]
+    solution = get_tsp_solution(tsp_instance['matrix'], search_settings=DESCENT_SEARCH, neighbors=neighbors)
+    assert sorted(solution['TSP_1'][1:-1]) == list(range(1, 41))
+    assert 'no solution on the neighbor arcs, solving without them' in capsys.readouterr().out
+
+
+def test_cvrp_without_solution_on_neighbor_arcs_falls_back(cvrp_instance, capsys):
+    demands, capacities = cvrp_instance['demands'], cvrp_instance['capacities']
+    neighbors = [[] for _ in cvrp_instance['coordinates']]
+    solution = get_cvrp_solution(cvrp_instance['matrix'], cvrp_instance['nb_vehicles'], capacities, demands,
+                                 search_settings=DESCENT_SEARCH, neighbors=neighbors)
+    assert sorted(node for route in solution.values() for node in route[1:-1]) == list(range(1, len(demands)))
+    for route, capacity in zip(solution.values(), capacities):
+        assert sum(demands[node] for node in route) <= capacity
+    assert 'no solution on the neighbor arcs, solving without them' in capsys.readouterr().out
+
+
+def test_integer_matrix_is_an_array_with_a_cost_for_unreachable_pairs():
+    integer_matrix = to_integer_matrix([[0, 1.26, np.nan], [1.24, 0, 2.5], [np.inf, 3, 0]], scale=10)
+    assert isinstance(integer_matrix, np.ndarray) and integer_matrix.dtype == np.int64
+    assert integer_matrix[:2].tolist() == [[0, 13, integer_matrix[0, 2]], [12, 0, 25]]
+    # More than any route through the reachable pairs
+    assert integer_matrix[0, 2] > 3 * 30 and integer_matrix[2, 0] == integer_matrix[0, 2]
+
+
+def test_transit_matrix_and_callback_give_the_same_solution(tsp_instance):
+    solution, info = get_tsp_solution(tsp_instance['matrix'], scale=10, native=True, return_info=True)
+    callback_solution, callback_info = get_tsp_solution(tsp_instance['matrix'], scale=10, native=False,
+                                                        return_info=True)
+    assert callback_solution == solution
+    assert callback_info['solver_objective'] == info['solver_objective']